@@ -1,40 +1,31 @@
 import streamlit as st
-import json
-import re
 import sys
 import io
-import traceback
-import ezdxf
+import tempfile
 import os
-import matplotlib.pyplot as plt
+import hashlib
 import logging
+from collections import Counter
 
 from openai import OpenAI
-from ezdxf.addons.drawing import RenderContext, Frontend
-from ezdxf.addons.drawing.matplotlib import MatplotlibBackend
+from cad_cache import DrawingCache
+from sandbox_pool import SandboxPool
+from context_compactor import ContextCompactor, DEFAULT_TOKEN_BUDGET
+from pipeline_metrics import RequestTrace
+from cad_pipeline import CadPipeline, PipelineHooks, OUTPUT_FILE
+from cad_render import load_doc_from_bytes, render_doc_to_image, serialize_doc
+from spatial_index import SpatialIndex
+from drawing_summary import DrawingSummary
+from cad_tool_engine import EzdxfBackend, draw_with_tools
+from dxf_export import export_dxf_bytes
 
 # ================= 配置区域 =================
 API_KEY = "EMPTY"
 # 请确保你的 LLM 服务地址正确
-BASE_URL = "http://10.184.17.223:12345/v1" 
-BASE_URL = "http://localhost:12345/v1" 
+BASE_URL = "http://10.184.17.223:12345/v1"
+BASE_URL = "http://localhost:12345/v1"
 
 MODEL_NAME = "Qwen3-8B"
-OUTPUT_FILE = "generated_drawing.dxf"
-
-# === 核心：隐藏的指令 (注入到 API 请求中，不在前端显示) ===
-HIDDEN_INSTRUCTION = f"""
-你是一个 Python ezdxf 库的专家。你的任务是根据用户的自然语言描述编写 Python 代码。
-1. 直接输出可执行的 Python 代码。
-2. 必须导入 ezdxf。
-3. 创建新图纸使用 ezdxf.new()。
-4. **最后必须将图纸保存为 '{OUTPUT_FILE}'**。
-5. 不要做任何需要用户键盘输入的操作 (如 input())。
-6. 尽量使用常见的 ezdxf 操作，确保兼容性。
-7. 如果之前有报错，请根据报错信息修正代码。
---------------------------------------------------
-用户需求：
-"""
 
 # === 日志配置 ===
 logging.basicConfig(
@@ -50,96 +41,134 @@ def get_client():
 
 client = get_client()
 
-# ================= 工具函数 =================
-
-def extract_code(text):
-    """从 LLM 回复中提取 Python 代码块"""
-    pattern = r"```python\s*(.*?)\s*```"
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group(1)
-    if "import ezdxf" in text:
-        return text
-    return ""
-
-def execute_ezdxf_code(code_str):
-    """执行生成的代码"""
-    old_stdout = sys.stdout
-    redirected_output = sys.stdout = io.StringIO()
-    local_scope = {}
-    
-    try:
-        # 确保每次执行前清理旧文件
-        if os.path.exists(OUTPUT_FILE):
-            os.remove(OUTPUT_FILE)
+@st.cache_resource
+def get_result_cache():
+    return DrawingCache()
 
-        logger.info("Executing generated code...")
-        # 警告：exec 存在安全风险，仅在受控环境使用
-        exec(code_str, globals(), local_scope)
-        
-        stdout_log = redirected_output.getvalue()
-        
-        if os.path.exists(OUTPUT_FILE):
-            logger.info("Execution successful, file generated.")
-            return True, "执行成功", stdout_log
-        else:
-            logger.warning("Execution finished but file not found.")
-            return False, f"代码执行没有报错，但未检测到 {OUTPUT_FILE} 文件生成。请确保代码包含 doc.saveas('{OUTPUT_FILE}')。", stdout_log
-            
-    except Exception:
-        error_msg = traceback.format_exc()
-        logger.error(f"Execution failed: {error_msg}")
-        return False, error_msg, redirected_output.getvalue()
-    finally:
-        sys.stdout = old_stdout
-
-def render_dxf_to_image(dxf_path):
-    """将 DXF 文件渲染为 matplotlib 图片流"""
-    try:
-        doc = ezdxf.readfile(dxf_path)
-        msp = doc.modelspace()
-        
-        # 创建图形上下文
-        fig = plt.figure(dpi=150) # DPI 这里的清晰度
-        ax = fig.add_axes([0, 0, 1, 1])
-        ctx = RenderContext(doc)
-        out = MatplotlibBackend(ax)
-        
-        # 渲染
-        Frontend(ctx, out).draw_layout(msp, finalize=True)
-        
-        # 保存到内存
-        img_buffer = io.BytesIO()
-        fig.savefig(img_buffer, format='png', bbox_inches='tight')
-        plt.close(fig) # 释放内存
-        img_buffer.seek(0)
-        return img_buffer, None
-    except Exception as e:
-        logger.error(f"Image rendering failed: {e}")
-        return None, str(e)
+result_cache = get_result_cache()
 
-def build_api_messages(ui_messages):
+@st.cache_resource
+def get_sandbox_pool():
+    # 常驻的沙箱进程池，所有会话共享
+    return SandboxPool()
+
+sandbox_pool = get_sandbox_pool()
+
+# 生成 → 提取 → 执行 → 渲染 的流程在 cad_pipeline 中实现，本文件只负责界面
+pipeline = CadPipeline(client, sandbox_pool, MODEL_NAME, result_cache=result_cache)
+
+
+def get_spatial_index():
+    """当前图纸 (上一轮的 DXF) 的空间索引，按 DXF 内容缓存在会话中，图纸不变时不重建"""
+    dxf_bytes = st.session_state.get("last_dxf")
+    if not dxf_bytes:
+        return None
+    key = hashlib.sha1(dxf_bytes).hexdigest()
+    cached = st.session_state.get("spatial_index")
+    if cached is None or cached[0] != key:
+        doc = load_doc_from_bytes(dxf_bytes)
+        cached = (key, SpatialIndex.from_doc(doc))
+        st.session_state.spatial_index = cached
+        logger.info(f"Spatial index built: {len(cached[1])} entities")
+    return cached[1]
+
+
+
+def run_tool_drawing(ui_messages, trace):
     """
-    构建 API 消息列表：
-    找到第一条用户消息，并在其内容前拼接 HIDDEN_INSTRUCTION。
-    这样用户在界面上看不到这一大段提示词，但模型能看到。
+    工具绘图：模型通过工具调用直接在上一轮的图纸 (没有时为新图纸) 上作图，不生成也不执行代码。
+    返回与 pipeline.run 相同结构的结果字典。
     """
-    api_msgs = []
-    
-    # 找到第一条 role='user' 的消息索引
-    first_user_idx = -1
-    for i, msg in enumerate(ui_messages):
-        if msg["role"] == "user":
-            first_user_idx = i
-            break
-            
-    for i, msg in enumerate(ui_messages):
-        new_msg = msg.copy() # 浅拷贝，不影响 Session State
-        if i == first_user_idx:
-            new_msg["content"] = HIDDEN_INSTRUCTION + new_msg["content"]
-        api_msgs.append(new_msg)
-        
-    return api_msgs
+    import ezdxf
+
+    result = {
+        "status": "failed", "success": False, "reply": "", "message": "", "attempts": 1,
+        "dxf": None, "png": None, "delta": None, "digest": None, "worker_rss_kb": None, "trace": trace,
+    }
+    dxf_bytes = st.session_state.get("last_dxf")
+    doc = load_doc_from_bytes(dxf_bytes) if dxf_bytes else ezdxf.new(setup=True)
+    try:
+        reply, toolbox = draw_with_tools(client, MODEL_NAME, ui_messages, EzdxfBackend(doc), trace)
+    except Exception as e:
+        logger.exception("Tool drawing error")
+        result["message"] = f"系统错误: {str(e)}"
+        return result
+
+    if toolbox.log:
+        counts = Counter(name for name, _args, _res in toolbox.log)
+        failed = len(toolbox.log) - toolbox.created
+        reply += "\n\n*工具调用：" + "，".join(f"{name}×{n}" for name, n in counts.items())
+        reply += (f" (其中 {failed} 次报错)" if failed else "") + "*"
+    result.update(status="success", success=True, reply=reply)
+    if toolbox.created:
+        with trace.span("render"):
+            img, img_err = render_doc_to_image(doc)
+        if img is None:
+            result["reply"] += f"\n\n⚠️ 预览生成失败: {img_err}"
+        with trace.span("summarize"):
+            digest = DrawingSummary.from_doc(doc).digest()
+        result.update(dxf=serialize_doc(doc), png=img.getvalue() if img else None, digest=digest)
+    return result
+
+
+class StreamlitHooks(PipelineHooks):
+    """把流水线的进度回调渲染到 Streamlit 页面上"""
+
+    def __init__(self, status_container, show_debug):
+        self.status_container = status_container
+        self.show_debug = show_debug
+        self.stream_placeholder = None
+        self.debug_container = None
+        self.reply_info = None
+
+    def on_status(self, text):
+        self.status_container.info(text)
+
+    def on_stream(self, text, done):
+        if self.stream_placeholder is None:
+            self.stream_placeholder = st.empty()
+        if done:
+            self.stream_placeholder.empty()
+            self.stream_placeholder = None
+        else:
+            self.stream_placeholder.markdown(text + "▌")
+
+    def on_reply(self, attempt, request_messages, ctx_stats, llm_content, code):
+        self.debug_container = st.empty()
+        self.reply_info = (attempt, request_messages, ctx_stats, llm_content, code)
+        self._render_debug()
+
+    def on_exec(self, attempt, ok, message, stdout):
+        self._render_debug((ok, message, stdout))
+
+    def on_error(self, error):
+        self.status_container.error(f"系统错误: {str(error)}")
+        if self.show_debug: st.exception(error)
+
+    def _render_debug(self, exec_info=None):
+        # === Debug 面板展示 ===
+        if not self.show_debug or self.reply_info is None:
+            return
+        attempt, request_messages, ctx_stats, llm_content, code = self.reply_info
+        with self.debug_container.expander(f"🔍 第 {attempt} 次尝试详情 (Debug Log)", expanded=False):
+            if ctx_stats:
+                st.caption(f"🗜️ 上下文压缩：{ctx_stats['tokens_before']} → {ctx_stats['tokens_after']} tokens (节省 {ctx_stats['tokens_saved']})")
+            if attempt == 1:
+                st.caption("ℹ️ 实际发给模型的 User Prompt (首行包含隐藏指令):")
+                for m in request_messages:
+                    if m['role'] == 'user':
+                        st.code(m['content'][:200] + "...", language="text")
+                        break
+            st.markdown("**模型回复:**")
+            st.code(llm_content, language="markdown")
+            st.markdown("**提取代码:**")
+            st.code(code, language="python")
+            if exec_info:
+                exec_success, msg, logs = exec_info
+                st.markdown("**执行结果:**")
+                if logs: st.text(f"Stdout:\n{logs}")
+                if exec_success: st.success("Success")
+                else: st.error(f"Failed:\n{msg}")
 
 # ================= 页面主逻辑 =================
 
@@ -151,13 +180,33 @@ with st.sidebar:
     
     if st.button("🗑️ 清除上下文 / 开始新任务", type="primary"):
         st.session_state.messages = [] # 清空历史
-        if os.path.exists(OUTPUT_FILE):
-            try: os.remove(OUTPUT_FILE)
+        st.session_state.pop("last_dxf", None)
+        st.session_state.pop("drawing_digest", None)
+        st.session_state.pop("spatial_index", None)
+        if "workdir" in st.session_state:
+            try: os.remove(os.path.join(st.session_state.workdir, OUTPUT_FILE))
             except: pass
+        if "sandbox_session" in st.session_state:
+            st.session_state.pop("sandbox_session").close()
         st.rerun() # 强制刷新页面
     
     st.divider()
     show_debug = st.checkbox("显示实时调试面板", value=True, help="显示代码生成、报错和重试的详细日志")
+    use_cache = st.checkbox("启用结果缓存", value=True, help="相同的对话上下文直接复用之前生成的代码、DXF 和预览图，跳过模型调用与渲染")
+    if st.button("🧹 清空结果缓存"):
+        result_cache.clear()
+    speculative_k = st.slider("投机并行候选数", min_value=1, max_value=4, value=1, help="大于 1 时一次生成多个候选代码并行执行，取第一个成功的结果 (此时不使用流式输出)")
+    stream_mode = st.checkbox("流式输出", value=True, help="实时显示模型输出，代码块一闭合就开始执行，无需等待后续解释文字")
+    compact_context = st.checkbox("压缩历史上下文", value=True, help="只保留最近一份代码原文，旧代码折叠为摘要、报错截断到关键调用帧")
+    token_budget = st.number_input("上下文 token 预算", min_value=1000, max_value=32000, value=DEFAULT_TOKEN_BUDGET, step=500, disabled=not compact_context)
+    incremental_mode = st.checkbox("增量绘图模式", value=False, help="图纸在会话中常驻，模型只输出增删改操作，只重新渲染变更区域 (此模式下不使用缓存和投机执行)")
+    tool_drawing = st.checkbox("工具调用绘图", value=False, help="模型直接调用绘图工具 (直线、圆、阵列...) 在图纸上作图，不生成、不执行代码 (此时上面的生成选项不生效)")
+    use_tools = st.checkbox("空间查询工具", value=False, help="模型可先调用工具查询当前图纸中的图元 (最右边的圆、某点附近的文字...) 再写代码 (此时不使用流式输出和投机执行)")
+    st.divider()
+    st.markdown("**下载格式**")
+    export_binary = st.checkbox("二进制 DXF", value=False, help="体积更小、读写更快，AutoCAD / 中望CAD / ezdxf 均可直接打开")
+    export_minimal = st.checkbox("精简表", value=False, help="去掉图纸中未使用的文字样式、线型和标注样式 (新建图纸预置的大量样式)")
+    export_compression = st.selectbox("压缩", [None, "gzip", "zip"], format_func=lambda c: {None: "不压缩", "gzip": "gzip (.dxf.gz)", "zip": "zip"}[c])
     st.markdown(f"**Current Model:** `{MODEL_NAME}`")
 
 st.title("🏗️ 智能 CAD 绘图助手")
@@ -166,6 +215,17 @@ st.title("🏗️ 智能 CAD 绘图助手")
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# 每个会话独立的工作目录，避免多个会话互相覆盖生成的文件
+if "workdir" not in st.session_state:
+    st.session_state.workdir = tempfile.mkdtemp(prefix="cad_session_")
+workdir = st.session_state.workdir
+
+# 增量模式：每个会话独占一个 worker，图纸在其中跨轮次常驻
+if incremental_mode and "sandbox_session" not in st.session_state:
+    st.session_state.sandbox_session = sandbox_pool.open_session()
+elif not incremental_mode and "sandbox_session" in st.session_state:
+    st.session_state.pop("sandbox_session").close()
+
 # 1. 展示历史消息
 for msg in st.session_state.messages:
     if msg["role"] == "user":
@@ -186,124 +246,79 @@ if prompt := st.chat_input("例如：画一个中心在(0,0)，半径为50的圆
         status_container = st.empty()
         status_container.info("🤖 正在思考并编写代码...")
 
-        max_retries = 3
-        attempt = 0
-        success = False
-        final_response_text = ""
-        generated_image = None
-        
-        # 初始化 msg，防止 NameError
-        msg = "未知错误 (未收到代码或执行被中断)"
+        # 分阶段耗时追踪 (写入 traces/ 下的 JSONL 与 Prometheus 指标文件)
+        trace = RequestTrace("app", model=MODEL_NAME, stream=stream_mode, speculative=speculative_k, incremental=incremental_mode)
 
-        # 构建发送给 API 的消息 (包含隐藏指令)
-        current_api_messages = build_api_messages(st.session_state.messages)
-
-        while attempt < max_retries:
-            debug_container = st.empty()
-            
-            try:
-                logger.info(f"--- Attempt {attempt + 1} Start ---")
-                
-                # 调用 LLM
-                response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=current_api_messages,
-                    temperature=0.7,
-                    max_tokens=8192
-                )
-                llm_content = response.choices[0].message.content
-                code = extract_code(llm_content)
-                
-                # === Debug 面板展示 ===
-                if show_debug:
-                    with debug_container.expander(f"🔍 第 {attempt + 1} 次尝试详情 (Debug Log)", expanded=False):
-                        if attempt == 0:
-                            st.caption("ℹ️ 实际发给模型的 User Prompt (首行包含隐藏指令):")
-                            for m in current_api_messages:
-                                if m['role'] == 'user':
-                                    st.code(m['content'][:200] + "...", language="text")
-                                    break
-                        st.markdown("**模型回复:**")
-                        st.code(llm_content, language="markdown")
-                        st.markdown("**提取代码:**")
-                        st.code(code, language="python")
-                
-                if not code:
-                    logger.info("No code found in response.")
-                    final_response_text = llm_content
-                    success = True
-                    break
-
-                status_container.info(f"⚙️ 正在执行代码 (第 {attempt + 1} 次尝试)...")
-                
-                # 执行代码
-                exec_success, msg, logs = execute_ezdxf_code(code)
-
-                # 补充执行结果到 Debug 面板
-                if show_debug:
-                    with debug_container.expander(f"🔍 第 {attempt + 1} 次尝试详情 (Debug Log)", expanded=False):
-                        st.markdown("**执行结果:**")
-                        if logs: st.text(f"Stdout:\n{logs}")
-                        if exec_success: st.success("Success")
-                        else: st.error(f"Failed:\n{msg}")
-
-                if exec_success:
-                    success = True
-                    final_response_text = f"✅ 绘图成功！\n\n*生成的代码逻辑：*\n```python\n{code}\n```"
-                    
-                    status_container.info("🎨 正在生成预览图...")
-                    img_buffer, img_err = render_dxf_to_image(OUTPUT_FILE)
-                    if img_buffer:
-                        generated_image = img_buffer
-                    else:
-                        logger.error(f"Preview failed: {img_err}")
-                        final_response_text += f"\n\n⚠️ 预览生成失败: {img_err}"
-                    break # 成功跳出循环
-                else:
-                    # === 自动修正逻辑 ===
-                    logger.warning(f"Attempt {attempt + 1} failed.")
-                    error_feedback = f"执行代码报错：\n{msg}\n请修复代码并确保保存为 {OUTPUT_FILE}。"
-                    
-                    # 将本次失败的对话加入到临时的 API 上下文中
-                    current_api_messages.append({"role": "assistant", "content": llm_content})
-                    current_api_messages.append({"role": "user", "content": error_feedback})
-                    
-                    attempt += 1
-            
-            except Exception as e:
-                # 捕获系统级异常 (如 API 连接断开)
-                msg = f"系统错误: {str(e)}"
-                status_container.error(msg)
-                if show_debug: st.exception(e)
-                break
+        if tool_drawing:
+            result = run_tool_drawing(st.session_state.messages, trace)
+            # 图纸已在会话 worker 之外被修改：关闭增量会话，下次从 last_dxf 重新开始
+            if result["dxf"] and "sandbox_session" in st.session_state:
+                st.session_state.pop("sandbox_session").close()
+        else:
+            result = pipeline.run(
+                st.session_state.messages,
+                workdir,
+                hooks=StreamlitHooks(status_container, show_debug),
+                trace=trace,
+                stream=stream_mode,
+                speculative_k=speculative_k,
+                compactor=ContextCompactor(token_budget=token_budget) if compact_context else None,
+                use_cache=use_cache,
+                session=st.session_state.sandbox_session if incremental_mode else None,
+                seed_dxf=st.session_state.get("last_dxf"),
+                drawing_digest=st.session_state.get("drawing_digest"),
+                tools=get_spatial_index() if use_tools else None,
+            )
+        success = result["success"]
+        delta = result["delta"]
+        dxf_bytes = result["dxf"]
+        generated_image = io.BytesIO(result["png"]) if result["png"] else None
+        if success and dxf_bytes:
+            st.session_state.last_dxf = dxf_bytes
+            # 图纸概况 (命中缓存时没有，下一轮退回到只看历史代码)
+            st.session_state.drawing_digest = result["digest"]
 
         status_container.empty() # 清除进度条
+
+        trace.finish(result["status"])
+        if show_debug:
+            with st.expander(f"⏱️ 本次请求耗时分解 (request_id={trace.request_id})", expanded=False):
+                st.table(trace.breakdown())
+                for u in trace.usage:
+                    speed = f"，{u['tokens_per_second']} tokens/s" if "tokens_per_second" in u else ""
+                    st.caption(f"第 {u.get('attempt', '?')} 次尝试：prompt {u['prompt_tokens']} / completion {u['completion_tokens']} tokens{speed}")
         
         if success:
+            final_response_text = result["reply"]
             st.markdown(final_response_text)
             
             # 布局：下载按钮 和 预览
             col1, col2 = st.columns([1, 1])
             with col1:
-                if os.path.exists(OUTPUT_FILE):
-                    with open(OUTPUT_FILE, "rb") as file:
-                        st.download_button(
-                            label="📥 下载 .dxf 原文件",
-                            data=file,
-                            file_name="drawing.dxf",
-                            mime="application/dxf"
-                        )
+                if dxf_bytes:
+                    # 下载内容在内存中生成，不经过临时文件
+                    try:
+                        download_data, download_file, download_mime = export_dxf_bytes(
+                            dxf_bytes, binary=export_binary, compression=export_compression, minimal=export_minimal)
+                    except Exception as e:
+                        logger.error(f"DXF export failed, falling back to ASCII: {e}")
+                        download_data, download_file, download_mime = dxf_bytes, "drawing.dxf", "application/dxf"
+                    st.download_button(
+                        label=f"📥 下载 {download_file} ({len(download_data) / 1024:.0f} KB)",
+                        data=download_data,
+                        file_name=download_file,
+                        mime=download_mime
+                    )
             
             if generated_image:
                 with st.expander("👁️ 点击预览生成效果 (图片)", expanded=True):
-                    st.image(generated_image, caption="DXF 渲染预览", use_container_width=True)
+                    preview_caption = "本轮变更区域预览" if delta and not delta["full_render"] else "DXF 渲染预览"
+                    st.image(generated_image, caption=preview_caption, use_container_width=True)
             
             # 将助手的最终回复存入 Session State (用于展示)
             st.session_state.messages.append({"role": "assistant", "content": final_response_text})
             
         else:
-            # 失败处理，此时 msg 必定已被赋值
-            logger.error("Task failed after retries.")
-            fail_msg = f"❌ 任务失败，已达最大重试次数。\n错误详情：\n```{msg}```"
+            fail_msg = f"❌ 任务失败，已达最大重试次数。\n错误详情：\n```{result['message']}```"
             st.error(fail_msg)
-            st.session_state.messages.append({"role": "assistant", "content": fail_msg})
\ No newline at end of file
+            st.session_state.messages.append({"role": "assistant", "content": fail_msg})
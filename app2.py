@@ -5,9 +5,22 @@ import io
 import traceback
 import logging
 import math
-import pythoncom
-from pyautocad import Autocad, APoint, aDouble
+import time
+import uuid
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from openai import OpenAI
+from code_validator import validate_code
+from com_batch import BatchingAcad
+from fake_acad import dry_run
+from cad_mirror import ModelMirror
+from drawing_summary import inject_digest
+from spatial_index import SpatialIndex
+from cad_pipeline import run_tool_loop, append_to_last_user
+from cad_tool_engine import ComBackend, draw_with_tools
+import cad_patterns
+from com_worker import ComWorker, ComConnectionError, ComSessionBusy, get_connect_factory, scope_helpers, BACKENDS
+from pipeline_metrics import RequestTrace, maybe_span
 
 # ================= 1. 配置区域 =================
 API_KEY = "EMPTY" 
@@ -40,6 +53,41 @@ def extract_code(text):
         return text
     return ""
 
+def request_completion(api_messages, trace=None, attempt=None):
+    """单次非流式调用 LLM，返回回复文本"""
+    with maybe_span(trace, "llm", attempt=attempt) as span:
+        response = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=api_messages,
+            temperature=0.7,
+            max_tokens=8192
+        )
+    if trace is not None:
+        trace.record_usage(response.usage, decode_seconds=span["seconds"], attempt=attempt)
+    return response.choices[0].message.content
+
+def generate_candidates(api_messages, k, trace=None, attempt=None):
+    """
+    一次请求 k 个候选回复 (n 参数)，服务端忽略 n 时用并发请求补足。
+    """
+    with maybe_span(trace, "llm", attempt=attempt, candidates=k) as span:
+        response = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=api_messages,
+            temperature=0.7,
+            max_tokens=8192,
+            n=k
+        )
+        contents = [choice.message.content or "" for choice in response.choices]
+    if trace is not None:
+        trace.record_usage(response.usage, decode_seconds=span["seconds"], attempt=attempt)
+    missing = k - len(contents)
+    if missing > 0:
+        # 补足的请求各自记录 llm 阶段与 token 用量
+        with ThreadPoolExecutor(max_workers=missing) as executor:
+            contents += list(executor.map(lambda _: request_completion(api_messages, trace, attempt), range(missing)))
+    return contents
+
 def render_assistant_msg(content):
     """
     【新增】专门的渲染函数：
@@ -68,50 +116,144 @@ def render_assistant_msg(content):
         # 如果没有代码块，直接显示全文
         st.markdown(content)
 
-def execute_pyautocad_code(code_str):
-    """执行 pyautocad 代码，包含 CoInitialize 修复"""
-    pythoncom.CoInitialize() 
+@st.cache_resource
+def get_com_worker(backend):
+    # 常驻的 COM 线程，所有会话共享同一个 CAD 连接，任务按会话轮转执行
+    return ComWorker(connect=get_connect_factory(backend), name=f"{backend}-com-worker")
 
-    old_stdout = sys.stdout
-    redirected_output = sys.stdout = io.StringIO()
-    
-    acad_instance = None
-    
+@st.cache_resource
+def get_model_mirror(backend):
+    # 在线图纸的本地镜像，查询与图纸概况不再逐个遍历 COM 图元
+    return ModelMirror()
+
+def sync_model_mirror(backend, session_id="default", trace=None):
+    """镜像未加载、被标记过期或 CAD 中切换了文档时，在 COM 线程中全量同步一次；返回镜像，无法连接时返回 None"""
+    mirror = get_model_mirror(backend)
+    worker = get_com_worker(backend)
+    if not mirror.needs_sync and mirror.doc_name == worker.doc_name:
+        return mirror
     try:
-        logger.info("Connecting to AutoCAD...")
-        try:
-            acad_instance = Autocad(create_if_not_exists=True)
-            doc_name = acad_instance.doc.Name
-            logger.info(f"Connected to: {doc_name}")
-        except Exception as e:
-            logger.error(f"Connection error: {e}")
-            return False, "❌ 无法连接到 AutoCAD。请确保软件已打开。", ""
+        with maybe_span(trace, "mirror_sync"):
+            worker.run(mirror.load, session_id)
+    except (ComConnectionError, ComSessionBusy, FuturesTimeout) as e:
+        logger.warning(f"Model mirror sync skipped: {e}")
+        return None
+    except Exception as e:
+        logger.warning(f"Model mirror sync failed: {e}")
+        return None
+    return mirror
+
+def execute_pyautocad_code(code_str, trace=None, attempt=None, batch=True, use_script=False,
+                           backend="autocad", session_id="default", dry_run_first=True, mirror=None):
+    """
+    在常驻 COM 线程中执行 pyautocad 代码 (连接只建立一次，失效时才重连)。
+    batch=True 时代码拿到的是批量代理 (com_batch.BatchingAcad)，绘图调用在代码执行完后一次性提交；
+    代码中途报错时积压的调用被丢弃，CAD 中不会留下半张图。
+    dry_run_first=True 时先在 ezdxf 替身 (fake_acad) 上试运行，报错的代码不会发往 CAD。
+    mirror 为 cad_mirror.ModelMirror，代码中可用 mirror.query(...) 查询已有图元，批量提交的写入会同步到镜像。
+    返回 (是否成功, 消息, stdout, 试运行预览 PNG 字节串或 None)。
+    """
+    # 执行前静态检查：不必连接 AutoCAD 就能发现的错误直接返回
+    with maybe_span(trace, "validate", attempt=attempt):
+        ok, code_str, error, _fixes = validate_code(code_str, api="pyautocad")
+    if not ok:
+        logger.warning(f"Pre-execution check failed: {error}")
+        return False, error, "", None
+
+    # 离线试运行：参数、方法名、数学错误在毫秒级内暴露，同时得到一张预览图
+    preview_png = None
+    if dry_run_first:
+        with maybe_span(trace, "dry_run", attempt=attempt):
+            ok, error, stdout_log, dry = dry_run(code_str, scope={"mirror": mirror, "patterns": cad_patterns})
+        if not ok:
+            logger.warning(f"Dry run failed: {error}")
+            return False, error, stdout_log, None
+        preview_png = dry["png"]
 
+    def job(acad_instance):
+        # 在 COM 线程中运行：所有 COM 调用都必须发生在持有连接的线程里
+        helpers = scope_helpers(backend)
+        timings = {}
+        redirected_output = io.StringIO()
+        if batch:
+            acad_proxy = BatchingAcad(acad_instance, use_script=use_script, make_array=helpers["aDouble"], observer=mirror)
+        else:
+            acad_proxy = acad_instance
+            # 不经过批量代理时无法知道代码写了什么，下一次请求前重新同步
+            if mirror is not None: mirror.mark_stale("unbatched exec")
         local_scope = {
-            'acad': acad_instance, 
-            'APoint': APoint, 
-            'aDouble': aDouble,
-            'math': math
+            '__name__': '__main__',
+            'acad': acad_proxy, 
+            'APoint': helpers["APoint"], 
+            'aDouble': helpers["aDouble"],
+            'math': math,
+            'mirror': mirror,
+            'patterns': cad_patterns
         }
+        try:
+            with contextlib.redirect_stdout(redirected_output):
+                t0 = time.perf_counter()
+                try:
+                    exec(code_str, local_scope)  # 单一命名空间：代码中定义的函数也能访问 acad 等变量
+                except Exception:
+                    if batch: acad_proxy.discard()
+                    raise
+                timings["exec"] = time.perf_counter() - t0
 
-        # 自动追加视图刷新
-        final_code = code_str + "\n\n# 系统自动追加：刷新视图\ntry:\n    acad.app.ZoomExtents()\n    acad.app.Update()\nexcept: pass"
-        
-        exec(final_code, globals(), local_scope)
-        
-        stdout_log = redirected_output.getvalue()
-        return True, f"✅ 操作CAD绘制成功!请打开CAD软件查看结果 (文档: {doc_name})", stdout_log
+                # 批量提交 (出错时已回退本次创建的图元)，提交完成后再刷新视图
+                if batch:
+                    t0 = time.perf_counter()
+                    acad_proxy.flush()
+                    timings["com_flush"] = time.perf_counter() - t0
+                    logger.info(f"COM batch stats: {acad_proxy.stats}")
 
-    except Exception:
-        error_msg = traceback.format_exc()
+            # 系统自动追加：刷新视图
+            try:
+                acad_instance.app.ZoomExtents()
+                acad_instance.app.Update()
+            except: pass
+            return True, "", redirected_output.getvalue(), timings
+        except Exception:
+            return False, traceback.format_exc(), redirected_output.getvalue(), timings
+
+    worker = get_com_worker(backend)
+    try:
+        (exec_ok, error_msg, stdout_log, timings), info = worker.run(job, session_id)
+    except ComConnectionError:
+        return False, "❌ 无法连接到 CAD 软件。请确保软件已打开。", "", preview_png
+    except FuturesTimeout:
+        return False, "❌ CAD 执行超时 (可能有其他会话的任务仍在执行或 CAD 弹出了对话框)。", "", preview_png
+    except ComSessionBusy:
+        return False, "❌ 上一次超时的绘图仍在 CAD 中执行，请等待其结束 (或关闭 CAD 中的对话框) 后再试。", "", preview_png
+
+    if trace is not None:
+        trace.add_span("com_queue_wait", info["queue_wait"], attempt=attempt)
+        if info["reconnected"]:
+            trace.add_span("com_connect", info["com_connect"], attempt=attempt)
+        trace.add_timings(timings, attempt=attempt)
+
+    if not exec_ok:
         logger.error(f"Execution logic failed: {error_msg}")
-        return False, error_msg, redirected_output.getvalue()
-    finally:
-        sys.stdout = old_stdout
-        try:
-            pythoncom.CoUninitialize()
-        except:
-            pass
+        return False, error_msg, stdout_log, preview_png
+    return True, f"✅ 操作CAD绘制成功!请打开CAD软件查看结果 (文档: {worker.doc_name})", stdout_log, preview_png
+
+def run_tool_drawing(ui_messages, backend="autocad", session_id="default", mirror=None, trace=None):
+    """
+    工具绘图：模型的工具调用 (直线、圆、阵列...) 经 COM 线程批量提交到 CAD，不生成代码、不 exec。
+    ui_messages 为不含隐藏指令的对话 (用户的原始输入)。返回 (是否成功, 回复文本)。
+    """
+    cad = ComBackend(get_com_worker(backend), backend, session_id, mirror)
+    try:
+        reply, toolbox = draw_with_tools(client, MODEL_NAME, ui_messages, cad, trace, 0.7, 8192)
+    except ComConnectionError:
+        return False, "❌ 无法连接到 CAD 软件。请确保软件已打开。"
+    except FuturesTimeout:
+        return False, "❌ CAD 执行超时 (可能有其他会话的任务仍在执行或 CAD 弹出了对话框)。"
+    except ComSessionBusy:
+        return False, "❌ 上一次超时的绘图仍在 CAD 中执行，请等待其结束 (或关闭 CAD 中的对话框) 后再试。"
+    failed = len(toolbox.log) - toolbox.created
+    summary = f"*共 {len(toolbox.log)} 次工具调用" + (f"，其中 {failed} 次报错" if failed else "") + "*"
+    return True, f"{reply}\n\n{summary}"
 
 # ================= 3. 页面 UI 逻辑 =================
 
@@ -121,10 +263,20 @@ CORE_INSTRUCTIONS = """
 你是一个 Python pyautocad 库的专家。你的任务是将用户的自然语言转换为 Python 代码，直接在 AutoCAD 中绘图。
 
 **运行环境说明：**
-1. 变量 `acad`, `APoint`, `math` 已直接可用，无需导入。
+1. 变量 `acad`, `APoint`, `math`, `patterns` 已直接可用，无需导入。
 2. 严禁使用 input()。
 3. 必须使用 ActiveX API，如 `acad.model.AddLine`, `acad.model.AddCircle`。
 4. 坐标点必须使用 `APoint(x, y)`。
+5. 绘图调用会在代码结束时批量提交，尽量不要读取刚创建图元的属性 (如 .Length)，否则会打断批量提交。
+6. 需要查找图纸中已有的图元时，使用 `mirror.query(type="CIRCLE", layer="墙", region=(xmin, ymin, xmax, ymax), text="子串")`
+   (返回 [{type, handle, layer, bbox, text}])，再用 `acad.doc.HandleToObject(handle)` 取得对象；不要用 acad.iter_objects 逐个遍历。
+7. 重复排布的图元 (螺栓孔、齿、栅格、沿路径排列、对称布置) 使用已预置的 `patterns` 一次算出全部位置：
+   `patterns.polar(center, radius, count)`、`patterns.rect(origin, rows, columns, row_spacing, column_spacing)`、
+   `patterns.along_path(vertices, count=...)`，可再 `.mirror(p1, p2)`。重复元件先定义为块，然后 `.insert_com(acad, "块名", APoint)` 批量插入
+   (栅格只需一次 AddMInsertBlock，环形阵列一次 ArrayPolar)；单纯的圆用 `.add_circles_com(acad, r, APoint)`。不要用 for 循环逐点计算 cos/sin。
+   图纸中可能已有同名块 (前几轮对话定义过)，定义前先检查、已存在就直接复用：先 `acad.doc.Blocks.Item("块名")`，
+   在 `except Exception:` 分支中才 `blk = acad.doc.Blocks.Add(APoint(0, 0), "块名")` 并 `blk.AddCircle(...)` 等。
+   需要的形状与已有同名块不同时，换一个更具体的新块名 (如 "螺栓孔_M8")，不要往已有的块里追加图元。
 
 请直接输出代码块。
 """
@@ -137,12 +289,23 @@ with st.sidebar:
     st.divider()
     st.markdown("**状态:** 🟢 系统就绪")
     show_debug = st.checkbox("显示调试信息", value=True)
+    dry_run_first = st.checkbox("执行前离线试运行", value=True, help="先在内存中的 ezdxf 图纸上试运行代码，报错的代码不会发往 CAD，并生成一张预览图")
+    cad_backend = st.selectbox("CAD 软件", BACKENDS, format_func=lambda b: {"autocad": "AutoCAD", "zwcad": "中望CAD"}[b])
+    batch_com = st.checkbox("批量提交 COM 调用", value=True, help="绘图调用先记录，代码结束后一次性提交：首尾相接的直线合并为多段线，出错时不留下半张图")
+    script_com = st.checkbox("命令脚本提交", value=False, disabled=not batch_com, help="把简单的直线/圆/点改写为一条 SendCommand 脚本，进一步减少 COM 往返。脚本由 CAD 异步执行：其中的错误不会反馈，也不会被自动回退")
+    speculative_k = st.slider("投机候选数", min_value=1, max_value=4, value=1, help="一次生成多个候选代码，前一个失败时直接尝试下一个，无需再次请求模型")
+    tool_drawing = st.checkbox("工具调用绘图", value=False, help="模型直接调用绘图工具，由 COM 线程批量提交，不生成、不执行代码")
+    use_tools = st.checkbox("空间查询工具", value=False, help="模型可先调用工具查询图纸中的图元 (最右边的圆、某点附近的文字...) 再写代码 (此时不使用投机候选)")
 
 st.title("🏗️ AutoCAD 智能绘图助手")
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# 会话标识：COM 线程按会话轮转执行任务
+if "com_session_id" not in st.session_state:
+    st.session_state.com_session_id = uuid.uuid4().hex
+
 # --- 渲染逻辑修改 ---
 for msg in st.session_state.messages:
     if msg["role"] == "user":
@@ -179,62 +342,128 @@ if prompt := st.chat_input("例如：画一个五角星"):
             for m in st.session_state.messages
         ]
 
+        trace = RequestTrace("app2", model=MODEL_NAME, speculative=speculative_k)
+
+        # 图纸概况只附加在发给模型的副本上，不写入会话记录 (每次请求都按最新图纸重新生成)；
+        # CAD 中的图纸一直存在，历史代码全部折叠为摘要，由概况告诉模型图纸里实际有什么
+        mirror = sync_model_mirror(cad_backend, st.session_state.com_session_id, trace)
+        if mirror is not None:
+            api_messages = inject_digest(api_messages, mirror.describe(), keep_latest_code=False)
+
+        # 空间查询工具：按镜像中的图元建立索引 (每轮重建，执行后镜像会变化)
+        spatial_tools = None
+        if use_tools and mirror is not None:
+            with maybe_span(trace, "spatial_index"):
+                spatial_tools = SpatialIndex.from_records(mirror.query())
+            api_messages = append_to_last_user(api_messages, SpatialIndex.TOOL_HINT)
+
         current_api_messages = api_messages.copy()
         max_retries = 3
         attempt = 0
         success = False
+        cad_busy = False
         final_response = ""
+        preview_png = None
 
-        while attempt < max_retries:
+        if tool_drawing:
+            tool_messages = [{"role": m["role"], "content": m.get("display_content", m["content"])}
+                             for m in st.session_state.messages]
+            if mirror is not None:
+                tool_messages = inject_digest(tool_messages, mirror.describe(), keep_latest_code=False)
+            status_box.write("正在通过工具调用在 CAD 中绘图...")
             try:
-                response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=current_api_messages,
-                    temperature=0.7,
-                    max_tokens=8192
-                )
-                
-                content = response.choices[0].message.content
-                print(response)
-                code = extract_code(content)
-                
-                if show_debug:
-                    # 在 status_box 里显示代码也折叠起来，保持整洁
-                    status_box.write(f"**尝试 #{attempt+1} 生成完毕，准备执行...**")
-                    # Debug 这里的代码可以不折叠，或者保持现状，看你想不想看过程
-                    # 这里保持现状，方便调试
-
-                if not code:
-                    status_box.update(label="⚠️ 未检测到代码", state="complete")
-                    final_response = content
-                    success = True
+                success, final_response = run_tool_drawing(
+                    tool_messages, cad_backend, st.session_state.com_session_id, mirror, trace)
+            except Exception as e:
+                logger.exception("Tool drawing error")
+                final_response = f"发生未预期的错误: {e}"
+            if success:
+                status_box.update(label="✅ 绘图完成", state="complete", expanded=False)
+            else:
+                status_box.update(label="💥 工具绘图失败", state="error")
+                st.error(final_response)
+
+        # 工具绘图模式下不进入代码生成与重试循环
+        while not tool_drawing and attempt < max_retries:
+            try:
+                # 投机模式：一次拿到多个候选。AutoCAD 文档只有一个且绘图有副作用，
+                # 候选无法并行执行，因此按顺序尝试，省掉失败后重新请求模型的往返。
+                if spatial_tools is not None:
+                    content, _n_calls = run_tool_loop(client, MODEL_NAME, current_api_messages, spatial_tools,
+                                                      0.7, 8192, trace, attempt + 1)
+                    contents = [content]
+                elif speculative_k > 1:
+                    contents = generate_candidates(current_api_messages, speculative_k, trace, attempt + 1)
+                else:
+                    contents = [request_completion(current_api_messages, trace, attempt + 1)]
+
+                first_failure = None
+                for cand_idx, content in enumerate(contents):
+                    code = extract_code(content)
+
+                    if show_debug:
+                        # 在 status_box 里显示代码也折叠起来，保持整洁
+                        status_box.write(f"**尝试 #{attempt+1} 候选 #{cand_idx+1} 生成完毕，准备执行...**")
+
+                    if not code:
+                        continue
+
+                    status_box.write(f"正在发送指令到 AutoCAD...")
+                    exec_success, result_msg, logs, preview_png = execute_pyautocad_code(
+                        code, trace, attempt + 1, batch_com, script_com, cad_backend, st.session_state.com_session_id,
+                        dry_run_first, mirror)
+
+                    if exec_success:
+                        success = True
+                        status_box.update(label="✅ 绘图完成", state="complete", expanded=False)
+
+                        # 构造最终响应字符串，保持 Markdown 格式以便后续 regex 解析
+                        final_response = f"**执行成功！**\n\n```python\n{code}\n```\n\n{result_msg}"
+                        break
+
+                    status_box.write(f"❌ 尝试 #{attempt+1} 候选 #{cand_idx+1} 失败: {result_msg}")
+                    if first_failure is None:
+                        first_failure = (content, result_msg)
+                    if get_com_worker(cad_backend).busy(st.session_state.com_session_id):
+                        # 超时的任务仍在 CAD 中执行：此时重试会在它结束后画出重复的图形
+                        cad_busy = True
+                        break
+
+                if success:
                     break
-                
-                status_box.write(f"正在发送指令到 AutoCAD...")
-                exec_success, result_msg, logs = execute_pyautocad_code(code)
-                
-                if exec_success:
+
+                if cad_busy:
+                    status_box.update(label="⏳ CAD 仍在执行上一次超时的任务，已停止重试", state="error")
+                    break
+
+                if first_failure is None:
+                    status_box.update(label="⚠️ 未检测到代码", state="complete")
+                    final_response = contents[0]
                     success = True
-                    status_box.update(label="✅ 绘图完成", state="complete", expanded=False)
-                    
-                    # 构造最终响应字符串，保持 Markdown 格式以便后续 regex 解析
-                    final_response = f"**执行成功！**\n\n```python\n{code}\n```\n\n{result_msg}"
                     break
-                else:
-                    status_box.write(f"❌ 尝试 #{attempt+1} 失败: {result_msg}")
-                    error_feedback = f"代码执行出错，请修复。错误信息：\n{result_msg}"
-                    current_api_messages.append({"role": "assistant", "content": content})
-                    current_api_messages.append({"role": "user", "content": error_feedback})
-                    attempt += 1
+
+                content, result_msg = first_failure
+                error_feedback = f"代码执行出错，请修复。错误信息：\n{result_msg}"
+                current_api_messages.append({"role": "assistant", "content": content})
+                current_api_messages.append({"role": "user", "content": error_feedback})
+                attempt += 1
             
             except Exception as e:
                 status_box.update(label="💥 系统错误", state="error")
                 st.error(f"发生未预期的错误: {e}")
                 break
         
+        trace.finish("success" if success else "failed")
+        if show_debug:
+            with st.expander(f"⏱️ 本次请求耗时分解 (request_id={trace.request_id})", expanded=False):
+                st.table(trace.breakdown())
+
         if success:
             # 【修改点 2】实时输出时，也调用自定义渲染函数
             render_assistant_msg(final_response)
+            if preview_png:
+                with st.expander("👁️ 离线试运行预览", expanded=False):
+                    st.image(io.BytesIO(preview_png), caption="ezdxf 替身渲染的预览 (与 CAD 中的显示可能略有差异)", use_container_width=True)
             st.session_state.messages.append({"role": "assistant", "content": final_response})
         else:
             fail_msg = "❌ 任务失败。"
@@ -0,0 +1,224 @@
+"""
+批量出图：从 JSONL 读取需求，无界面地并发生成图纸 (适合夜间批量预生成标准图)。
+
+    python batch_generate.py prompts.jsonl --out batch_output --concurrency 16 --workers 4
+
+输入每行 {"id": "可选的任务名", "prompt": "画一个..."}，没有 id 时按需求文本生成。
+每个任务写入 <out>/<id>/ (drawing.dxf、preview.png、code.py)，
+结果逐条追加到 <out>/results.jsonl；中断后重新运行同一命令会跳过已有结果的任务。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import AsyncOpenAI
+from sandbox_pool import SandboxPool, DEFAULT_TIMEOUT
+from pipeline_metrics import RequestTrace, maybe_span
+from cad_pipeline import CadPipeline, build_api_messages, extract_code, MAX_RETRIES
+
+# ================= 配置区域 =================
+API_KEY = "EMPTY"
+BASE_URL = "http://localhost:12345/v1"
+MODEL_NAME = "Qwen3-8B"
+
+DEFAULT_CONCURRENCY = 8            # 同时在途的 LLM 请求数
+RESULTS_FILE = "results.jsonl"
+
+logger = logging.getLogger("CAD_Agent")
+
+
+def job_id_for(entry, line_no):
+    """任务 ID：优先使用输入中的 id，否则由需求文本哈希得到 (保证断点续跑时稳定)"""
+    raw = str(entry.get("id") or "")
+    if not raw:
+        raw = "job-" + hashlib.sha1(entry["prompt"].encode("utf-8")).hexdigest()[:12]
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in raw).strip(".")
+    return safe or f"line-{line_no}"
+
+
+def load_jobs(path):
+    jobs = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if not entry.get("prompt"):
+                logger.warning(f"Line {line_no}: missing prompt, skipped.")
+                continue
+            job_id = job_id_for(entry, line_no)
+            if job_id in seen:
+                logger.warning(f"Line {line_no}: duplicate id {job_id}, skipped.")
+                continue
+            seen.add(job_id)
+            jobs.append({"id": job_id, "prompt": entry["prompt"]})
+    return jobs
+
+
+def load_finished(results_path, retry_failed=False):
+    """读取已有结果，返回需要跳过的任务 ID 集合 (最后一行可能因中断而不完整，直接忽略)"""
+    if not os.path.exists(results_path):
+        return set()
+    statuses = {}  # 同一任务重跑过时以最后一行为准
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            statuses[record["id"]] = record.get("status")
+    return {job_id for job_id, status in statuses.items() if status == "success" or not retry_failed}
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BatchRunner:
+    """
+    asyncio 驱动 LLM 请求 (信号量限制并发)，代码执行与渲染交给沙箱进程池，
+    两者通过线程池衔接，LLM 等待与 CPU 渲染互相重叠。
+    """
+
+    def __init__(self, client, sandbox_pool, out_dir, model_name=MODEL_NAME, concurrency=DEFAULT_CONCURRENCY,
+                 max_retries=MAX_RETRIES):
+        self.client = client
+        self.out_dir = out_dir
+        self.model_name = model_name
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # 复用 app.py 的执行逻辑 (执行前检查 + 沙箱执行 + 内存渲染)
+        self.pipeline = CadPipeline(None, sandbox_pool, model_name)
+        self.executor = ThreadPoolExecutor(max_workers=sandbox_pool.size)
+        self.results_path = os.path.join(out_dir, RESULTS_FILE)
+        self._results_lock = asyncio.Lock()
+
+    async def _complete(self, api_messages, trace, attempt):
+        async with self.semaphore:
+            with maybe_span(trace, "llm", attempt=attempt) as span:
+                response = await self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=api_messages,
+                    temperature=0.7,
+                    max_tokens=8192
+                )
+        trace.record_usage(response.usage, decode_seconds=span["seconds"], attempt=attempt)
+        return response.choices[0].message.content or ""
+
+    async def run_job(self, job):
+        job_dir = os.path.join(self.out_dir, job["id"])
+        os.makedirs(job_dir, exist_ok=True)
+        trace = RequestTrace("batch", job_id=job["id"], model=self.model_name)
+        api_messages = build_api_messages([{"role": "user", "content": job["prompt"]}])
+        loop = asyncio.get_running_loop()
+
+        record = {"id": job["id"], "prompt": job["prompt"], "status": "failed", "attempts": 0,
+                  "output_dir": job_dir, "message": ""}
+        try:
+            for attempt in range(1, self.max_retries + 1):
+                record["attempts"] = attempt
+                llm_content = await self._complete(api_messages, trace, attempt)
+                code = extract_code(llm_content)
+                if not code:
+                    record.update(status="no_code", message=llm_content)
+                    break
+
+                ok, msg, _logs, artifacts = await loop.run_in_executor(
+                    self.executor, self.pipeline.execute_ezdxf_code, code, job_dir)
+                trace.add_timings(artifacts["timings"], attempt=attempt)
+                if ok:
+                    _write_atomic(os.path.join(job_dir, "code.py"), (artifacts["code"] or code).encode("utf-8"))
+                    _write_atomic(os.path.join(job_dir, "drawing.dxf"), artifacts["dxf"])
+                    if artifacts["png"]:
+                        _write_atomic(os.path.join(job_dir, "preview.png"), artifacts["png"])
+                    record.update(status="success", message=artifacts["render_error"] or "", fixes=artifacts["fixes"])
+                    break
+
+                record["message"] = msg
+                api_messages.append({"role": "assistant", "content": llm_content})
+                api_messages.append({"role": "user", "content": f"执行代码报错：\n{msg}\n请修复代码并确保最终图纸赋值给变量 doc。"})
+        except Exception as e:
+            logger.error(f"Job {job['id']} error: {e}")
+            record.update(status="error", message=str(e))
+
+        trace_record = trace.finish(record["status"])
+        record["seconds"] = trace_record["total_seconds"]
+        record["completion_tokens"] = sum(u["completion_tokens"] for u in trace.usage)
+        await self._append_result(record)
+        return record
+
+    async def _append_result(self, record):
+        # 每完成一个任务立即追加一行并落盘，中断时最多丢失正在进行的任务
+        async with self._results_lock:
+            with open(self.results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    async def run(self, jobs):
+        total = len(jobs)
+        done = 0
+        counts = {}
+        t0 = time.perf_counter()
+        for future in asyncio.as_completed([self.run_job(job) for job in jobs]):
+            record = await future
+            done += 1
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            logger.info(f"[{done}/{total}] {record['id']}: {record['status']} ({record['attempts']} attempt(s), {record['seconds']:.1f}s)")
+        elapsed = time.perf_counter() - t0
+        logger.info(f"Batch finished in {elapsed:.1f}s: {counts}")
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从 JSONL 需求文件批量生成 DXF 图纸")
+    parser.add_argument("prompts", help="输入 JSONL，每行 {\"id\": ..., \"prompt\": ...}")
+    parser.add_argument("--out", default="batch_output", help="输出目录 (每个任务一个子目录)")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时在途的 LLM 请求数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="执行与渲染的沙箱进程数")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="单个任务代码执行的超时 (秒)")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--retry-failed", action="store_true", help="续跑时重新执行之前失败的任务")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+
+    os.makedirs(args.out, exist_ok=True)
+    jobs = load_jobs(args.prompts)
+    finished = load_finished(os.path.join(args.out, RESULTS_FILE), args.retry_failed)
+    pending = [job for job in jobs if job["id"] not in finished]
+    logger.info(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run.")
+    if not pending:
+        return
+
+    pool = SandboxPool(size=args.workers, timeout=args.timeout)
+    client = AsyncOpenAI(api_key=API_KEY, base_url=args.base_url)
+    runner = BatchRunner(client, pool, args.out, args.model, args.concurrency, args.max_retries)
+    try:
+        asyncio.run(runner.run(pending))
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; rerun the same command to resume.")
+    finally:
+        runner.executor.shutdown(wait=False, cancel_futures=True)
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+块提取的读取方式基准：对比完整读取 (ezdxf.readfile) 与只加载块定义的低内存模式
+(percieve_dxf.load_blocks_only) 的耗时与峰值 RSS。
+
+每种模式在独立的子进程中运行，峰值 RSS 互不影响：
+    python bench/bench_block_loading.py path/to/一次系统图.dxf --repeat 3
+    python bench/bench_block_loading.py --blocks 300 --entities 400000   # 生成合成图纸
+
+--extract 时在读取之后继续跑一次图集提取 (extract_blocks_to_atlas)，测量端到端的时间与内存。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import queue
+import statistics
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ("full", "blocks_only")
+POLL_SECONDS = 1.0       # 等待子进程结果时检查其是否已退出的间隔
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def make_synthetic_dxf(path, blocks=200, entities=200_000):
+    """生成测试图纸：blocks 个小元件块，模型空间放 entities 个图元 (其中每个块至少插入一次)"""
+    import ezdxf
+    doc = ezdxf.new(setup=True)
+    for i in range(blocks):
+        block = doc.blocks.new(f"SYM_{i:04d}")
+        block.add_circle((0, 0), 2 + i % 5)
+        block.add_lwpolyline([(-3, -3), (3, -3), (3, 3), (-3, 3)], close=True)
+        block.add_text(f"S{i}", height=1.5).set_placement((0, -5))
+    msp = doc.modelspace()
+    for i in range(blocks):
+        msp.add_blockref(f"SYM_{i:04d}", (i * 10, 0))
+    for i in range(entities - blocks):
+        x, y = (i % 1000) * 3.0, (i // 1000) * 3.0
+        msp.add_line((x, y), (x + 2, y + 1))
+    doc.saveas(path)
+
+
+def _measure(mode, dxf_path, extract, queue):
+    """子进程：读取 (可选再提取)，报告耗时与峰值 RSS"""
+    import percieve_dxf
+    t0 = time.perf_counter()
+    doc, roots = percieve_dxf.load_drawing(dxf_path, low_memory=(mode == "blocks_only"))
+    load_seconds = time.perf_counter() - t0
+    n_blocks = len(percieve_dxf.select_blocks(doc, skip_unreferenced=True, roots=roots))
+    record = {"mode": mode, "load_seconds": load_seconds, "referenced_blocks": n_blocks}
+    if extract:
+        del doc
+        out_dir = tempfile.mkdtemp(prefix="block_bench_")
+        try:
+            t0 = time.perf_counter()
+            percieve_dxf.extract_blocks_to_atlas(dxf_path, out_dir, low_memory=(mode == "blocks_only"))
+            record["extract_seconds"] = time.perf_counter() - t0
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    record["peak_rss_kb"] = _peak_rss_kb()
+    queue.put(record)
+
+
+def run_once(mode, dxf_path, extract, timeout):
+    """在子进程中测量一次；子进程异常退出或超时时抛出 RuntimeError，而不是一直等待结果"""
+    context = mp.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(mode, dxf_path, extract, results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+            if not process.is_alive() and results.empty():
+                raise RuntimeError(f"{mode} 子进程异常退出 (exitcode={process.exitcode})，错误信息见上方输出")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{mode} 子进程超过 {timeout:.0f} 秒未完成")
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="完整读取与仅块定义读取的耗时 / 峰值内存对比")
+    parser.add_argument("dxf", nargs="?", help="要测试的 DXF 文件，省略时生成合成图纸")
+    parser.add_argument("--blocks", type=int, default=200, help="合成图纸的块数")
+    parser.add_argument("--entities", type=int, default=200_000, help="合成图纸模型空间的图元数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--extract", action="store_true", help="同时测量图集提取的端到端耗时")
+    parser.add_argument("--timeout", type=float, default=1800, help="单次测量的超时 (秒)")
+    parser.add_argument("--json", help="把逐次记录写入该 JSON 文件")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    dxf_path = args.dxf
+    if dxf_path is None:
+        tmp_dir = tempfile.mkdtemp(prefix="block_bench_dxf_")
+        dxf_path = os.path.join(tmp_dir, "synthetic.dxf")
+        print(f"生成合成图纸: {args.blocks} 个块，{args.entities} 个模型空间图元...")
+        make_synthetic_dxf(dxf_path, args.blocks, args.entities)
+    print(f"文件大小: {os.path.getsize(dxf_path) / 1e6:.1f} MB\n")
+
+    records = []
+    try:
+        for _ in range(args.repeat):
+            for mode in MODES:
+                records.append(run_once(mode, dxf_path, args.extract, args.timeout))
+                r = records[-1]
+                print(f"  {mode:<12} 读取 {r['load_seconds']:.2f} s"
+                      + (f"  提取 {r['extract_seconds']:.2f} s" if "extract_seconds" in r else "")
+                      + (f"  峰值 RSS {r['peak_rss_kb'] / 1024:.0f} MB" if r["peak_rss_kb"] else ""), flush=True)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"{'模式':<14}{'读取 p50 (s)':>14}{'提取 p50 (s)':>14}{'峰值 RSS (MB)':>16}{'引用块数':>10}")
+    for mode in MODES:
+        rows = [r for r in records if r["mode"] == mode]
+        load = statistics.median(r["load_seconds"] for r in rows)
+        extracts = [r["extract_seconds"] for r in rows if "extract_seconds" in r]
+        extract = statistics.median(extracts) if extracts else None
+        rss = [r["peak_rss_kb"] for r in rows if r["peak_rss_kb"]]
+        print(f"{mode:<14}{load:>14.2f}{(f'{extract:.2f}' if extract is not None else '-'):>14}"
+              f"{(f'{max(rss) / 1024:.0f}' if rss else '-'):>16}{rows[0]['referenced_blocks']:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "records": records}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+DXF 输出格式基准：对比当前的 ASCII 输出与二进制 / 精简表 / gzip / zip 的文件大小、写出耗时与重新读取耗时。
+
+    python bench/bench_dxf_export.py                      # 合成图纸：少量图元 (体现样板开销) 与大图各一份
+    python bench/bench_dxf_export.py path/to/drawing.dxf --repeat 5
+
+写出耗时从内存中的图纸开始计时 (含精简表与压缩)，读取耗时为解压 + 解析得到图纸对象。
+精简表会修改图纸，因此每次写出前都从同一份 ASCII 字节串重新加载，加载时间不计入。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# (名称, export_doc 的参数)；"ascii" 即当前 serialize_doc 的输出
+MODES = [
+    ("ascii", {}),
+    ("ascii+minimal", {"minimal": True}),
+    ("binary", {"binary": True}),
+    ("binary+minimal", {"binary": True, "minimal": True}),
+    ("ascii+gzip", {"compression": "gzip"}),
+    ("ascii+zip", {"compression": "zip"}),
+    ("binary+gzip", {"binary": True, "compression": "gzip"}),
+    ("binary+minimal+gzip", {"binary": True, "minimal": True, "compression": "gzip"}),
+]
+
+
+def make_synthetic_doc(entities):
+    """与生成代码相同的起点 (ezdxf.new(setup=True))，模型空间放 entities 个直线/圆/文字"""
+    import ezdxf
+    doc = ezdxf.new(setup=True)
+    msp = doc.modelspace()
+    for i in range(entities):
+        x, y = (i % 500) * 4.0, (i // 500) * 4.0
+        kind = i % 3
+        if kind == 0:
+            msp.add_line((x, y), (x + 3, y + 1))
+        elif kind == 1:
+            msp.add_circle((x, y), 1.5)
+        else:
+            msp.add_text(f"T{i}", dxfattribs={"insert": (x, y), "height": 0.8})
+    return doc
+
+
+def bench_drawing(label, ascii_bytes, repeat):
+    from dxf_export import export_doc, read_dxf_bytes
+
+    rows = []
+    for name, options in MODES:
+        writes, reads = [], []
+        data = None
+        for _ in range(repeat):
+            doc = read_dxf_bytes(ascii_bytes)
+            t0 = time.perf_counter()
+            data, _file_name, _mime = export_doc(doc, **options)
+            writes.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            read_dxf_bytes(data)
+            reads.append(time.perf_counter() - t0)
+        print(f"  {name:<22}{len(data) / 1024:>10.1f} KB  写出 {statistics.median(writes) * 1000:.0f} ms"
+              f"  读取 {statistics.median(reads) * 1000:.0f} ms", flush=True)
+        rows.append({
+            "drawing": label, "mode": name, "bytes": len(data),
+            "write_seconds": statistics.median(writes), "read_seconds": statistics.median(reads),
+        })
+    return rows
+
+
+def print_rows(rows):
+    base = {r["drawing"]: r for r in rows if r["mode"] == "ascii"}
+    print(f"{'图纸':<10}{'模式':<22}{'大小 (KB)':>12}{'相对 ASCII':>12}{'写出 p50 (ms)':>16}{'读取 p50 (ms)':>16}")
+    for r in rows:
+        ratio = r["bytes"] / base[r["drawing"]]["bytes"]
+        print(f"{r['drawing']:<10}{r['mode']:<22}{r['bytes'] / 1024:>12.1f}{ratio:>12.2f}"
+              f"{r['write_seconds'] * 1000:>16.1f}{r['read_seconds'] * 1000:>16.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DXF 输出格式的大小 / 写出 / 读取耗时对比")
+    parser.add_argument("dxf", nargs="?", help="要测试的 DXF 文件，省略时使用合成图纸")
+    parser.add_argument("--small", type=int, default=10, help="小图的图元数 (主要是样板开销)")
+    parser.add_argument("--large", type=int, default=10_000, help="大图的图元数 (ezdxf 解析约 0.1 ms/图元，每种模式每轮都要重新加载)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="把结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    from cad_render import serialize_doc
+    from dxf_export import read_dxf_bytes
+
+    if args.dxf:
+        # 输入可以是任意一种格式，统一转为 ASCII 作为基准
+        with open(args.dxf, "rb") as f:
+            drawings = [(os.path.basename(args.dxf), serialize_doc(read_dxf_bytes(f.read())))]
+    else:
+        print(f"生成合成图纸 ({args.small} / {args.large} 图元)...", flush=True)
+        drawings = [(f"{n} 图元", serialize_doc(make_synthetic_doc(n))) for n in (args.small, args.large)]
+
+    rows = []
+    for label, ascii_bytes in drawings:
+        print(f"测试 {label}: ASCII {len(ascii_bytes) / 1024:.1f} KB ...", flush=True)
+        rows += bench_drawing(label, ascii_bytes, args.repeat)
+    print()
+    print_rows(rows)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "rows": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
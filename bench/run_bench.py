@@ -0,0 +1,177 @@
+"""
+离线端到端基准测试：启动本地桩 LLM 服务回放录制好的回复，
+用 cad_pipeline 跑完整的 生成 → 提取 → 执行 → 渲染 流程，报告
+各阶段 p50/p95 耗时、首次成功率、平均重试次数与峰值内存。
+
+不需要网络，也不需要 GPU：
+    python bench/run_bench.py --repeat 3
+    python bench/run_bench.py --mode blocking --speculative-k 2 --json bench_result.json
+
+语料中 expect 与实际结果不符时以非零状态码退出，便于在部署前发现回归。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openai import OpenAI
+from sandbox_pool import SandboxPool, DEFAULT_POOL_SIZE
+from context_compactor import ContextCompactor, DEFAULT_TOKEN_BUDGET
+from pipeline_metrics import RequestTrace
+from cad_pipeline import CadPipeline
+from stub_llm_server import StubLLMServer, load_corpus, DEFAULT_CORPUS
+
+logger = logging.getLogger("CAD_Agent")
+
+
+def percentile(values, q):
+    """线性插值的分位数 (q 取 0~100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _main_peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_bench(cases, args):
+    """跑完整个语料，返回 (逐请求记录, 汇总)"""
+    server = StubLLMServer(cases, prefill_ms=args.prefill_ms, tokens_per_second=args.tokens_per_second).start()
+    t0 = time.perf_counter()
+    pool = SandboxPool(size=args.pool_size)
+    pool_startup = time.perf_counter() - t0
+    client = OpenAI(api_key="EMPTY", base_url=server.base_url, max_retries=0)
+    pipeline = CadPipeline(client, pool, server.model_name)
+    trace_dir = tempfile.mkdtemp(prefix="cad_bench_traces_")
+
+    records = []
+    try:
+        for rnd in range(args.repeat):
+            for case in cases:
+                workdir = tempfile.mkdtemp(prefix="cad_bench_")
+                trace = RequestTrace("bench", case=case["id"], round=rnd + 1, mode=args.mode, speculative=args.speculative_k)
+                result = pipeline.run(
+                    [{"role": "user", "content": case["prompt"]}],
+                    workdir,
+                    trace=trace,
+                    stream=args.mode == "stream",
+                    speculative_k=args.speculative_k,
+                    compactor=ContextCompactor(token_budget=args.token_budget) if args.token_budget else None,
+                    use_cache=False,
+                )
+                record = trace.finish(result["status"],
+                                      trace_file=os.path.join(trace_dir, "bench_trace.jsonl"),
+                                      metrics_file=os.path.join(trace_dir, "metrics.prom"))
+                record.update(success=result["success"], attempts=result["attempts"], worker_rss_kb=result["worker_rss_kb"])
+                records.append(record)
+                shutil.rmtree(workdir, ignore_errors=True)
+                logger.info(f"[{rnd + 1}/{args.repeat}] {case['id']}: {result['status']} after {result['attempts']} attempt(s), {record['total_seconds']:.3f}s")
+    finally:
+        pool.shutdown()
+        server.stop()
+        if args.keep_traces:
+            logger.info(f"Traces kept in {trace_dir}")
+        else:
+            shutil.rmtree(trace_dir, ignore_errors=True)
+
+    return records, summarize(cases, records, pool_startup, check_attempts=args.speculative_k <= 1)
+
+
+def summarize(cases, records, pool_startup, check_attempts=True):
+    # 同一请求内同名阶段 (如多次重试的 llm) 按实例分别计入分位数
+    stage_values = defaultdict(list)
+    for r in records:
+        stage_values["total"].append(r["total_seconds"])
+        for span in r["spans"]:
+            stage_values[span["stage"]].append(span["seconds"])
+
+    n = len(records)
+    expected = {c["id"]: c.get("expect") for c in cases}
+    mismatches = []
+    # 投机模式下后续的修正回复会作为额外候选提前参与竞争，语料中的 attempts 预期只适用于单候选模式
+    for r in records:
+        expect = expected.get(r["case"])
+        if not expect:
+            continue
+        if expect.get("success") is not None and expect["success"] != r["success"]:
+            mismatches.append(f"{r['case']} (round {r['round']}): success={r['success']}, expected {expect['success']}")
+        elif check_attempts and expect.get("attempts") is not None and expect["attempts"] != r["attempts"]:
+            mismatches.append(f"{r['case']} (round {r['round']}): attempts={r['attempts']}, expected {expect['attempts']}")
+
+    worker_rss = [r["worker_rss_kb"] for r in records if r["worker_rss_kb"]]
+    return {
+        "requests": n,
+        "success_rate": sum(r["success"] for r in records) / n if n else 0.0,
+        "first_try_success_rate": sum(r["success"] and r["attempts"] == 1 for r in records) / n if n else 0.0,
+        "avg_retries": sum(max(r["attempts"] - 1, 0) for r in records) / n if n else 0.0,
+        "pool_startup_seconds": round(pool_startup, 6),
+        "peak_rss_kb": {"main": _main_peak_rss_kb(), "worker": max(worker_rss) if worker_rss else None},
+        "stages": {
+            stage: {"count": len(v), "p50": round(percentile(v, 50), 6), "p95": round(percentile(v, 95), 6)}
+            for stage, v in sorted(stage_values.items())
+        },
+        "mismatches": mismatches,
+    }
+
+
+def print_summary(summary):
+    print(f"\n请求数: {summary['requests']}   沙箱池启动: {summary['pool_startup_seconds']:.3f}s")
+    print(f"成功率: {summary['success_rate']:.1%}   首次成功率: {summary['first_try_success_rate']:.1%}   平均重试: {summary['avg_retries']:.2f}")
+    rss = summary["peak_rss_kb"]
+    fmt = lambda kb: f"{kb / 1024:.1f} MB" if kb else "n/a"
+    print(f"峰值 RSS: 主进程 {fmt(rss['main'])} / worker {fmt(rss['worker'])}\n")
+    print(f"{'阶段':<24}{'次数':>6}{'p50 (ms)':>12}{'p95 (ms)':>12}")
+    for stage, s in summary["stages"].items():
+        print(f"{stage:<24}{s['count']:>6}{s['p50'] * 1000:>12.1f}{s['p95'] * 1000:>12.1f}")
+    if summary["mismatches"]:
+        print("\n与语料预期不符：")
+        for m in summary["mismatches"]:
+            print(f"  - {m}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAD Agent 离线端到端基准测试")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=3, help="语料重复的轮数")
+    parser.add_argument("--mode", choices=("stream", "blocking"), default="stream")
+    parser.add_argument("--speculative-k", type=int, default=1, help="大于 1 时使用投机并行候选 (忽略 --mode)")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="上下文压缩预算，0 表示不压缩")
+    parser.add_argument("--prefill-ms", type=float, default=0, help="桩服务模拟的首 token 延迟 (毫秒)")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="桩服务模拟的解码速度，0 表示不限速")
+    parser.add_argument("--json", help="把逐请求记录与汇总写入该 JSON 文件")
+    parser.add_argument("--keep-traces", action="store_true", help="保留 RequestTrace 写出的 JSONL 与指标文件")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    cases = load_corpus(args.corpus)
+    records, summary = run_bench(cases, args)
+    print_summary(summary)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summary": summary, "records": records}, f, ensure_ascii=False, indent=2)
+
+    sys.exit(1 if summary["mismatches"] else 0)
+
+
+if __name__ == "__main__":
+    main()
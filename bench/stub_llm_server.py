@@ -0,0 +1,193 @@
+"""
+本地 OpenAI 兼容的桩 LLM 服务：按录制好的语料回放模型回复，用于离线基准测试。
+
+匹配规则：请求中第一条用户消息以语料的 prompt 结尾 (前面是隐藏指令)；
+请求中已有的 assistant 消息数即为第几次尝试，回放 responses 中对应的一条
+(超出时重复最后一条)。支持非流式、流式 (SSE) 与 n 个候选。
+
+也可以单独启动，让 app.py 直接连上来做手工回归：
+    python bench/stub_llm_server.py --corpus bench/corpus.jsonl --port 12345
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from context_compactor import count_tokens, count_message_tokens
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.jsonl")
+STREAM_CHUNK_CHARS = 8  # 流式输出时每个 chunk 的字符数 (约 2 个 token)
+
+
+def load_corpus(path=DEFAULT_CORPUS):
+    """读取 JSONL 语料：每行 {"id", "prompt", "responses": [...], "expect": {...}}"""
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                cases.append(json.loads(line))
+    return cases
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server_version = "StubLLM/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug("stub: " + format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.model_name, "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        messages = request.get("messages", [])
+
+        contents = self.server.lookup(messages, request.get("n") or 1)
+        if contents is None:
+            self._send_json(404, {"error": {"message": "no recorded response for this prompt", "type": "not_found"}})
+            return
+
+        usage = {
+            "prompt_tokens": count_message_tokens(messages),
+            "completion_tokens": sum(count_tokens(c) for c in contents),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if self.server.prefill_seconds:
+            time.sleep(self.server.prefill_seconds)
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            self._stream(contents[0], usage if include_usage else None)
+        else:
+            if self.server.tokens_per_second:
+                time.sleep(usage["completion_tokens"] / self.server.tokens_per_second)
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": self.server.model_name,
+                "choices": [
+                    {"index": i, "message": {"role": "assistant", "content": c}, "finish_reason": "stop"}
+                    for i, c in enumerate(contents)
+                ],
+                "usage": usage,
+            })
+
+    def _stream(self, content, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        def send(choices, **extra):
+            payload = {"id": chunk_id, "object": "chat.completion.chunk", "created": created,
+                       "model": self.server.model_name, "choices": choices, **extra}
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            piece = content[i:i + STREAM_CHUNK_CHARS]
+            if self.server.tokens_per_second:
+                time.sleep(count_tokens(piece) / self.server.tokens_per_second)
+            send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if usage is not None:
+            send([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    回放录制回复的 HTTP 服务。prefill_ms 模拟首 token 延迟，
+    tokens_per_second 模拟解码速度 (0 表示不限速)。
+    """
+    daemon_threads = True
+
+    def __init__(self, cases, host="127.0.0.1", port=0, model_name="stub-model", prefill_ms=0, tokens_per_second=0):
+        super().__init__((host, port), _StubHandler)
+        self.cases = cases
+        self.model_name = model_name
+        self.prefill_seconds = prefill_ms / 1000.0
+        self.tokens_per_second = tokens_per_second
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def lookup(self, messages, n=1):
+        """返回本次请求应回放的 n 条回复；找不到对应语料时返回 None"""
+        first_user = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+        matched = [c for c in self.cases if first_user.rstrip().endswith(c["prompt"].rstrip())]
+        if not matched:
+            return None
+        case = max(matched, key=lambda c: len(c["prompt"]))  # 多条语料互为后缀时取最长的匹配
+        responses = case["responses"]
+        attempt = sum(1 for m in messages if m.get("role") == "assistant")
+        return [responses[min(attempt + i, len(responses) - 1)] for i in range(n)]
+
+    def start(self):
+        """在后台线程中开始服务 (供 run_bench.py 在同一进程内使用)"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制回复的 OpenAI 兼容桩服务")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--model", default="Qwen3-8B", help="/v1/models 中报告的模型名")
+    parser.add_argument("--prefill-ms", type=float, default=0, help="模拟的首 token 延迟 (毫秒)")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="模拟的解码速度，0 表示不限速")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = StubLLMServer(load_corpus(args.corpus), args.host, args.port, args.model, args.prefill_ms, args.tokens_per_second)
+    logger.info(f"Stub LLM server listening on {server.base_url} ({len(server.cases)} recorded prompts)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
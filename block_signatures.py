@@ -0,0 +1,253 @@
+"""
+块的矢量几何特征与相似检索：直接从 DXF 几何计算定长特征向量，不经过任何渲染。
+
+    python block_signatures.py add block_index 图纸1.dxf 图纸2.dxf ...
+    python block_signatures.py query block_index 图纸1.dxf "断路器" -k 10
+
+索引目录中 vectors.npy 为 N×D 的 float32 矩阵 (可内存映射)，meta.json 为对应的 [{drawing, block, hash}]。
+"""
+import os
+import json
+import math
+import argparse
+
+import numpy as np
+from ezdxf import bbox, disassemble
+
+from percieve_dxf import load_drawing, select_blocks, save_manifest, BlockHasher
+
+# ================= 配置区域 =================
+SIGNATURE_VERSION = 1          # 特征定义改变时加一，旧索引中的向量会被重新计算
+FLATTENING_RATIO = 0.005       # 曲线离散精度 = 块尺寸 × 该比例 (与块的绝对大小无关)
+ORIENTATION_BINS = 8           # 线段方向直方图 (0~180°)
+RADIAL_BINS = 8                # 到包围盒中心距离的直方图
+GRID_SIZE = 4                  # 几何分布的 4×4 占据网格
+TURNING_BINS = 6               # 相邻线段转角直方图 (0~180°)
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+# 图元类型直方图的分桶 (未列出的类型计入最后的 OTHER)
+TYPE_BINS = ("LINE", "POLYLINE", "CIRCLE", "ARC", "ELLIPSE", "SPLINE", "TEXT", "HATCH", "SOLID", "POINT")
+TYPE_ALIASES = {"LWPOLYLINE": "POLYLINE", "MTEXT": "TEXT", "ATTDEF": "TEXT", "ATTRIB": "TEXT",
+                "TRACE": "SOLID", "3DFACE": "SOLID"}
+
+# 特征分组：(名称, 维数, 权重)。权重决定各组在欧氏距离中的占比
+FEATURE_LAYOUT = (
+    ("shape", 2, 1.0),                        # 归一化的包围盒宽、高 (较长边为 1)
+    ("types", len(TYPE_BINS) + 1, 1.0),       # 图元类型占比
+    ("size", 2, 0.5),                         # log(1 + 图元数)、log(1 + 总长度 / 包围盒尺寸)
+    ("orientation", ORIENTATION_BINS, 1.0),   # 按长度加权的线段方向分布
+    ("radial", RADIAL_BINS, 1.0),             # 按长度加权的径向分布
+    ("grid", GRID_SIZE * GRID_SIZE, 1.0),     # 按长度加权的空间占据
+    ("turning", TURNING_BINS, 0.5),           # 折线/曲线的转角分布
+)
+SIGNATURE_DIM = sum(dims for _name, dims, _weight in FEATURE_LAYOUT)
+
+
+def _type_bin(dxftype):
+    dxftype = TYPE_ALIASES.get(dxftype, dxftype)
+    return TYPE_BINS.index(dxftype) if dxftype in TYPE_BINS else len(TYPE_BINS)
+
+
+def _histogram(values, bins, upper, weights):
+    hist, _edges = np.histogram(values, bins=bins, range=(0.0, upper), weights=weights)
+    total = hist.sum()
+    return hist / total if total > 0 else hist
+
+
+def block_signature(block):
+    """
+    计算一个块的特征向量 (float32，长度 SIGNATURE_DIM)。
+    嵌套的块参照会被展开；文字按其外框参与几何统计。几何在包围盒内归一化，与位置和缩放无关。
+    """
+    types = np.zeros(len(TYPE_BINS) + 1)
+    ext = bbox.extents(block)
+    size = max(ext.size.x, ext.size.y) if ext.has_data else 0.0
+    flattening = size * FLATTENING_RATIO if size > 0 else 0.01
+
+    polylines = []
+    for primitive in disassemble.to_primitives(disassemble.recursive_decompose(block), max_flattening_distance=flattening):
+        types[_type_bin(primitive.entity.dxftype())] += 1
+        if primitive.is_empty:
+            continue
+        points = np.array([(v.x, v.y) for v in primitive.vertices()], dtype=np.float64)
+        if len(points):
+            polylines.append(points)
+
+    vector = np.zeros(SIGNATURE_DIM, dtype=np.float32)
+    if not polylines or size <= 0:
+        # 空块或所有图元都没有几何：只保留类型信息
+        features = {"types": types / types.sum() if types.sum() else types}
+        return _assemble(features, vector)
+
+    # 归一化到以包围盒中心为原点、较长边为 1 的坐标系
+    center = np.array([(ext.extmin.x + ext.extmax.x) / 2, (ext.extmin.y + ext.extmax.y) / 2])
+    polylines = [(points - center) / size for points in polylines]
+
+    deltas, mids, turns, turn_weights = [], [], [], []
+    for points in polylines:
+        if len(points) < 2:
+            continue
+        d = np.diff(points, axis=0)
+        deltas.append(d)
+        mids.append((points[:-1] + points[1:]) / 2)
+        if len(d) >= 2:
+            a, b = d[:-1], d[1:]
+            la, lb = np.hypot(a[:, 0], a[:, 1]), np.hypot(b[:, 0], b[:, 1])
+            valid = (la > 0) & (lb > 0)
+            cos = np.einsum("ij,ij->i", a[valid], b[valid]) / (la[valid] * lb[valid])
+            turns.append(np.arccos(np.clip(cos, -1.0, 1.0)))
+            turn_weights.append(np.minimum(la[valid], lb[valid]))
+
+    if deltas:
+        d = np.concatenate(deltas)
+        mid = np.concatenate(mids)
+        lengths = np.hypot(d[:, 0], d[:, 1])
+    else:
+        # 只有孤立点：每个点按单位权重统计分布
+        mid = np.concatenate(polylines)
+        d = np.zeros_like(mid)
+        lengths = np.zeros(len(mid))
+    weights = lengths if lengths.sum() > 0 else np.ones(len(mid))
+
+    grid, _xe, _ye = np.histogram2d(mid[:, 0], mid[:, 1], bins=GRID_SIZE, range=[[-0.5, 0.5], [-0.5, 0.5]], weights=weights)
+    features = {
+        "shape": np.array([ext.size.x / size, ext.size.y / size]),
+        "types": types / types.sum(),
+        "size": np.array([math.log1p(types.sum()), math.log1p(lengths.sum())]),
+        "orientation": _histogram(np.mod(np.arctan2(d[:, 1], d[:, 0]), np.pi), ORIENTATION_BINS, np.pi, lengths),
+        "radial": _histogram(np.hypot(mid[:, 0], mid[:, 1]), RADIAL_BINS, math.sqrt(0.5), weights),
+        "grid": grid.ravel() / max(grid.sum(), 1e-12),
+        "turning": _histogram(np.concatenate(turns), TURNING_BINS, np.pi, np.concatenate(turn_weights))
+        if turns else np.zeros(TURNING_BINS),
+    }
+    return _assemble(features, vector)
+
+
+def _assemble(features, vector):
+    offset = 0
+    for name, dims, weight in FEATURE_LAYOUT:
+        if name in features:
+            vector[offset:offset + dims] = np.asarray(features[name], dtype=np.float32) * weight
+        offset += dims
+    return vector
+
+
+class SignatureIndex:
+    """
+    磁盘上的块特征索引 (可累积多张图纸)：
+    - add_drawing()：计算一张图纸全部块的特征，同一图纸重复加入时替换旧记录；
+      内容哈希相同的块 (不同图纸中的标准元件) 直接复用已有向量；
+    - query()：暴力 kNN，一次矩阵乘法完成，几十万个块也只需毫秒级。
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.meta = []
+        self.vectors = np.zeros((0, SIGNATURE_DIM), dtype=np.float32)
+        self._sq_norms = None
+        vectors_path = os.path.join(index_dir, VECTORS_FILE)
+        meta_path = os.path.join(index_dir, META_FILE)
+        if os.path.exists(vectors_path) and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == SIGNATURE_VERSION:
+                self.meta = data["blocks"]
+                self.vectors = np.load(vectors_path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.meta)
+
+    def add_drawing(self, dxf_path, skip_unreferenced=False, low_memory=True):
+        """加入 (或替换) 一张图纸的全部块，返回加入的块数"""
+        drawing = os.path.abspath(dxf_path)
+        doc, roots = load_drawing(dxf_path, low_memory)
+        hasher = BlockHasher(doc, {"signature_version": SIGNATURE_VERSION})
+
+        known = {m["hash"]: i for i, m in enumerate(self.meta)}
+        keep = [i for i, m in enumerate(self.meta) if m["drawing"] != drawing]
+        new_meta, new_vectors = [], []
+        for name in select_blocks(doc, skip_unreferenced, roots):
+            block_hash = hasher(name)
+            if block_hash in known:
+                vector = np.asarray(self.vectors[known[block_hash]])
+            else:
+                try:
+                    vector = block_signature(doc.blocks.get(name))
+                except Exception as e:
+                    print(f"计算特征失败: {name} ({e})")
+                    continue
+            new_meta.append({"drawing": drawing, "block": name, "hash": block_hash})
+            new_vectors.append(vector)
+
+        self.meta = [self.meta[i] for i in keep] + new_meta
+        self.vectors = np.vstack([np.asarray(self.vectors)[keep]] + ([np.stack(new_vectors)] if new_vectors else []))
+        self._sq_norms = None
+        return len(new_meta)
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        vectors_path = os.path.join(self.index_dir, VECTORS_FILE)
+        tmp_path = f"{vectors_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        os.replace(tmp_path, vectors_path)
+        save_manifest(os.path.join(self.index_dir, META_FILE), {"version": SIGNATURE_VERSION, "blocks": self.meta})
+
+    def query(self, vectors, k=10):
+        """
+        kNN 查询：vectors 为单个特征向量或 Q×D 矩阵，
+        返回每个查询的 [(欧氏距离, {drawing, block, hash}), ...]，按距离升序。
+        """
+        q = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if not self.meta:
+            return [[] for _ in q]
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        # ||v - q||² = ||v||² - 2 v·q + ||q||²，一次矩阵乘法算出全部距离
+        d2 = self._sq_norms[None, :] - 2.0 * (q @ self.vectors.T) + np.einsum("ij,ij->i", q, q)[:, None]
+        k = min(k, len(self.meta))
+        nearest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(d2, nearest, axis=1), axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        return [[(float(math.sqrt(max(d2[row, i], 0.0))), self.meta[i]) for i in nearest[row]]
+                for row in range(len(q))]
+
+    def query_block(self, dxf_path, block_name, k=10):
+        """以某张图纸中的一个块为样例查询相似块 (样例本身也在索引中时会排在第一位)"""
+        doc, _roots = load_drawing(dxf_path, low_memory=True)
+        block = doc.blocks.get(block_name)
+        if block is None:
+            raise KeyError(f"图纸中没有块: {block_name}")
+        return self.query(block_signature(block), k)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="块几何特征索引与相似检索")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="把图纸中的块加入索引")
+    add.add_argument("index_dir")
+    add.add_argument("dxf", nargs="+")
+    add.add_argument("--skip-unreferenced", action="store_true", help="只加入被 INSERT 引用的块")
+    query = sub.add_parser("query", help="查询与某个块最相似的块")
+    query.add_argument("index_dir")
+    query.add_argument("dxf")
+    query.add_argument("block")
+    query.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    index = SignatureIndex(args.index_dir)
+    if args.command == "add":
+        for path in args.dxf:
+            n = index.add_drawing(path, args.skip_unreferenced)
+            print(f"{path}: {n} 个块")
+        index.save()
+        print(f"索引共 {len(index)} 个块")
+        return
+
+    for distance, meta in index.query_block(args.dxf, args.block, args.k):
+        print(f"{distance:8.4f}  {meta['block']}  ({meta['drawing']})")
+
+
+if __name__ == "__main__":
+    main()
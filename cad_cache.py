@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+CACHE_DIR = ".cad_cache"
+MAX_MEMORY_ENTRIES = 64                 # 内存 LRU 最多保留的条目数
+MAX_DISK_BYTES = 512 * 1024 * 1024      # 磁盘缓存总大小上限，超过后按最近访问时间淘汰
+
+# 每个缓存条目在磁盘上是一个目录，包含以下三个文件
+_ENTRY_FILES = {
+    "code": "code.py",
+    "dxf": "drawing.dxf",
+    "png": "preview.png",
+}
+
+
+def make_cache_key(api_messages, model_name, instruction):
+    """
+    根据 API 消息列表 (build_api_messages 之后)、模型名和隐藏指令计算缓存键。
+    只保留 role/content 并去掉首尾空白，避免无关字段和空格差异导致缓存失效。
+    """
+    normalized = [
+        {"role": m["role"], "content": (m.get("content") or "").strip()}
+        for m in api_messages
+    ]
+    payload = json.dumps(
+        {"model": model_name, "instruction": instruction, "messages": normalized},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DrawingCache:
+    """
+    prompt → code → DXF → 预览图 的内容寻址缓存。
+    一级：有界的内存 LRU；二级：磁盘目录，按总大小淘汰最久未访问的条目。
+    条目格式为 {"code": str, "dxf": bytes, "png": bytes}。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_memory_entries=MAX_MEMORY_ENTRIES, max_disk_bytes=MAX_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ---------- 对外接口 ----------
+
+    def get(self, key):
+        """命中返回条目字典，未命中返回 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._touch(key)
+                return entry
+
+            entry = self._load_from_disk(key)
+            if entry is not None:
+                self._remember(key, entry)
+                self._touch(key)
+            return entry
+
+    def put(self, key, code, dxf_bytes, png_bytes):
+        """写入缓存 (内存 + 磁盘)，随后按磁盘大小上限执行淘汰"""
+        entry = {"code": code, "dxf": dxf_bytes, "png": png_bytes}
+        with self._lock:
+            self._remember(key, entry)
+            try:
+                self._save_to_disk(key, entry)
+                self._evict_disk()
+            except OSError as e:
+                logger.warning(f"Cache write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ---------- 内存 LRU ----------
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    # ---------- 磁盘存储 ----------
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _load_from_disk(self, key):
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return None
+        try:
+            with open(os.path.join(entry_dir, _ENTRY_FILES["code"]), "r", encoding="utf-8") as f:
+                code = f.read()
+            with open(os.path.join(entry_dir, _ENTRY_FILES["dxf"]), "rb") as f:
+                dxf_bytes = f.read()
+            with open(os.path.join(entry_dir, _ENTRY_FILES["png"]), "rb") as f:
+                png_bytes = f.read()
+        except OSError:
+            # 条目不完整 (例如写入中途被中断)，直接丢弃
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        return {"code": code, "dxf": dxf_bytes, "png": png_bytes}
+
+    def _save_to_disk(self, key, entry):
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp{threading.get_ident()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, _ENTRY_FILES["code"]), "w", encoding="utf-8") as f:
+            f.write(entry["code"])
+        with open(os.path.join(tmp_dir, _ENTRY_FILES["dxf"]), "wb") as f:
+            f.write(entry["dxf"])
+        with open(os.path.join(tmp_dir, _ENTRY_FILES["png"]), "wb") as f:
+            f.write(entry["png"])
+        # 先写临时目录再改名，保证磁盘上不会出现写了一半的条目
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._entry_dir(key))
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for item in os.scandir(self.cache_dir):
+            if not item.is_dir() or ".tmp" in item.name:
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(item.path) if f.is_file())
+            entries.append((item.stat().st_mtime, size, item.path, item.name))
+            total += size
+
+        # 最久未访问的条目优先淘汰
+        entries.sort()
+        for _, size, path, key in entries:
+            if total <= self.max_disk_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            self._memory.pop(key, None)
+            total -= size
+            logger.info(f"Cache evicted: {key[:12]}")
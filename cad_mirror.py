@@ -0,0 +1,310 @@
+import os
+import math
+import shutil
+import logging
+import tempfile
+import threading
+from collections import Counter
+
+from drawing_summary import DrawingSummary, DIGEST_TOKEN_BUDGET
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+TEXT_CHAR_WIDTH = 0.7         # 估算文字包围盒时的字宽/字高比例
+AC_SELECTION_SET_ALL = 5      # ActiveX acSelectionSetAll
+
+# ActiveX Add* 方法 → 生成的 DXF 图元类型
+METHOD_TYPES = {
+    "AddLine": "LINE", "AddCircle": "CIRCLE", "AddArc": "ARC", "AddPoint": "POINT",
+    "AddText": "TEXT", "AddMText": "MTEXT", "AddLightWeightPolyline": "LWPOLYLINE",
+    "AddPolyline": "POLYLINE", "Add3DPoly": "POLYLINE", "AddSpline": "SPLINE",
+    "AddEllipse": "ELLIPSE", "AddHatch": "HATCH", "AddSolid": "SOLID", "AddRay": "RAY",
+    "AddXline": "XLINE", "InsertBlock": "INSERT", "AddMInsertBlock": "INSERT",
+    "AddDimAligned": "DIMENSION", "AddDimRotated": "DIMENSION", "AddDimRadial": "DIMENSION",
+    "AddDimDiametric": "DIMENSION", "AddDimAngular": "DIMENSION",
+}
+
+# 不在模型空间中创建图元的写入 (com_batch 通过 record_writes 告知)，只记录、不需要重新同步
+NON_MODEL_WRITES = {"Blocks.Add"}
+
+# ActiveX ObjectName → DXF 图元类型 (逐个读取的回退路径使用)
+OBJECT_NAME_TYPES = {
+    "AcDbLine": "LINE", "AcDbCircle": "CIRCLE", "AcDbArc": "ARC", "AcDbPoint": "POINT",
+    "AcDbText": "TEXT", "AcDbMText": "MTEXT", "AcDbPolyline": "LWPOLYLINE",
+    "AcDb2dPolyline": "POLYLINE", "AcDb3dPolyline": "POLYLINE", "AcDbSpline": "SPLINE",
+    "AcDbEllipse": "ELLIPSE", "AcDbHatch": "HATCH", "AcDbBlockReference": "INSERT",
+    "AcDbMInsertBlock": "INSERT", "AcDbTrace": "SOLID", "AcDbRay": "RAY", "AcDbXline": "XLINE",
+}
+
+
+class MirrorEntity:
+    """镜像中的一条记录：类型、句柄、图层、二维包围盒 (xmin, ymin, xmax, ymax)，文字/块名另存"""
+    __slots__ = ("type", "handle", "layer", "bbox", "text")
+
+    def __init__(self, type, handle, layer, bbox, text=None):
+        self.type = type
+        self.handle = handle
+        self.layer = layer
+        self.bbox = bbox
+        self.text = text
+
+    def as_dict(self):
+        return {"type": self.type, "handle": self.handle, "layer": self.layer, "bbox": self.bbox, "text": self.text}
+
+    def __repr__(self):
+        return f"<{self.type} {self.handle or '(新建)'} layer={self.layer}>"
+
+
+def _xyz(point):
+    if hasattr(point, "value"):  # win32com.client.VARIANT
+        point = point.value
+    values = [float(v) for v in point]
+    return (values + [0.0, 0.0])[:3]
+
+
+def _box(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _flat_points(values, stride):
+    values = [float(v) for v in (values.value if hasattr(values, "value") else values)]
+    return [values[i:i + stride] for i in range(0, len(values) - stride + 1, stride)]
+
+
+def _bbox_from_call(method, args):
+    """根据 Add* 调用的参数在本地推算包围盒 (不需要任何 COM 调用)"""
+    try:
+        if method == "AddLine":
+            return _box([_xyz(args[0]), _xyz(args[1])])
+        if method in ("AddCircle", "AddArc"):
+            (x, y, _z), r = _xyz(args[0]), float(args[1])
+            return (x - r, y - r, x + r, y + r)
+        if method == "AddPoint":
+            x, y, _z = _xyz(args[0])
+            return (x, y, x, y)
+        if method == "AddText":
+            x, y, _z = _xyz(args[1])
+            h = float(args[2])
+            return (x, y, x + len(str(args[0])) * h * TEXT_CHAR_WIDTH, y + h)
+        if method == "AddMText":
+            x, y, _z = _xyz(args[0])
+            return (x, y, x + float(args[1]), y)
+        if method == "AddLightWeightPolyline":
+            return _box(_flat_points(args[0], 2))
+        if method in ("AddPolyline", "Add3DPoly", "AddSpline"):
+            return _box(_flat_points(args[0], 3))
+        if method == "AddEllipse":
+            (x, y, _z), (mx, my, _) = _xyz(args[0]), _xyz(args[1])
+            r = math.hypot(mx, my)
+            return (x - r, y - r, x + r, y + r)
+        if method in ("InsertBlock", "AddMInsertBlock"):
+            x, y, _z = _xyz(args[0])
+            return (x, y, x, y)
+    except (TypeError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class ModelMirror:
+    """
+    在线 CAD 模型空间的本地镜像，避免用 acad.iter_objects 逐个跨进程遍历图元：
+    - load(acad)：一次性批量读取 (优先导出为 DXF 后本地解析，失败时回退为逐个读取)；
+    - record_writes()：由 com_batch.BatchingAcad 在提交成功后回调，记录本程序生成代码的写入；
+    - mark_stale()：代码绕过代理直接修改了图纸，下一次使用前需要重新 load；
+    - query() / describe()：查询与给模型的图纸概况都直接读镜像 (概况由 DrawingSummary 增量维护)。
+    本会话新建的图元在下一次全量同步前没有句柄 (handle 为 None)。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entities = []
+        self._summary = DrawingSummary()
+        self.doc_name = None
+        self.current_layer = "0"
+        self.loaded = False
+        self.stale_reason = None
+        self.defined_blocks = set()   # 上次全量同步以来本程序定义的块
+
+    # ---------- 同步 ----------
+
+    @property
+    def needs_sync(self):
+        return not self.loaded or self.stale_reason is not None
+
+    def load(self, acad):
+        """全量同步 (必须在持有 COM 连接的线程中调用)，返回读到的图元数"""
+        doc = acad.doc
+        try:
+            entities, summary = self._load_via_dxf(doc)
+            source = "dxf export"
+        except Exception as e:
+            logger.warning(f"Bulk DXF export failed ({e}), falling back to per-object read.")
+            entities, summary = self._load_via_iteration(acad.model)
+            source = "iteration"
+        try:
+            current_layer = doc.ActiveLayer.Name
+        except Exception:
+            current_layer = "0"
+
+        with self._lock:
+            self._entities = entities
+            self._summary = summary
+            self.doc_name = doc.Name
+            self.current_layer = current_layer
+            self.loaded = True
+            self.stale_reason = None
+            self.defined_blocks = set()
+        logger.info(f"Model mirror loaded {len(entities)} entities from {self.doc_name} ({source}).")
+        return len(entities)
+
+    def _load_via_dxf(self, doc):
+        """选择全部图元导出为 DXF (几次 COM 调用)，再用 ezdxf 在本地解析"""
+        from ezdxf import recover, bbox
+
+        tmp_dir = tempfile.mkdtemp(prefix="cad_mirror_")
+        selection = None
+        try:
+            selection = doc.SelectionSets.Add(f"MIRROR_{os.getpid()}_{threading.get_ident()}")
+            selection.Select(AC_SELECTION_SET_ALL)
+            base = os.path.join(tmp_dir, "mirror")
+            doc.Export(base, "DXF", selection)
+            dxf_doc, _auditor = recover.readfile(base + ".dxf")
+            cache = bbox.Cache()
+            entities = []
+            summary = DrawingSummary()
+            for e in dxf_doc.modelspace():
+                box = bbox.extents([e], cache=cache)
+                text = None
+                if e.dxftype() == "TEXT":
+                    text = e.dxf.text
+                elif e.dxftype() == "MTEXT":
+                    text = e.text
+                elif e.dxftype() == "INSERT":
+                    text = e.dxf.name
+                entity = MirrorEntity(
+                    e.dxftype(), e.dxf.handle, e.dxf.layer,
+                    (box.extmin.x, box.extmin.y, box.extmax.x, box.extmax.y) if box.has_data else None, text)
+                entities.append(entity)
+                summary.add_entity(e, entity.bbox)
+            return entities, summary
+        finally:
+            if selection is not None:
+                try:
+                    selection.Delete()
+                except Exception:
+                    pass
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _load_via_iteration(self, model):
+        """回退路径：逐个读取 (每个图元 4~5 次 COM 调用，只在导出不可用时使用)"""
+        entities = []
+        summary = DrawingSummary()
+        for i in range(model.Count):
+            obj = model.Item(i)
+            object_name = obj.ObjectName
+            try:
+                lo, hi = obj.GetBoundingBox()
+                box = (lo[0], lo[1], hi[0], hi[1])
+            except Exception:
+                box = None
+            text = None
+            if object_name in ("AcDbText", "AcDbMText"):
+                text = obj.TextString
+            entity = MirrorEntity(OBJECT_NAME_TYPES.get(object_name, object_name), obj.Handle, obj.Layer, box, text)
+            entities.append(entity)
+            summary.add(entity.handle, entity.type, entity.layer, box, text, handle=entity.handle)
+        return entities, summary
+
+    def record_writes(self, writes):
+        """记录生成代码通过批量代理提交的写入 [(方法, 参数, [(属性, 值), ...]), ...]"""
+        new_entities = []
+        new_blocks = set()
+        for method, args, ops in writes:
+            if method in NON_MODEL_WRITES:
+                new_blocks.add(str(args[0]))
+                continue
+            props = dict(ops)
+            text = None
+            if method == "AddText":
+                text = str(args[0])
+            elif method == "AddMText":
+                text = str(args[2])
+            elif method in ("InsertBlock", "AddMInsertBlock"):
+                text = str(args[1])
+            entity = MirrorEntity(
+                METHOD_TYPES.get(method, method[3:].upper()), None,
+                str(props.get("Layer", self.current_layer)), _bbox_from_call(method, args), text)
+            measure = None
+            if method in ("AddCircle", "AddArc"):
+                try:
+                    measure = float(args[1])
+                except (TypeError, ValueError, IndexError):
+                    pass
+            new_entities.append((entity, measure))
+        with self._lock:
+            self.defined_blocks |= new_blocks
+            for entity, measure in new_entities:
+                # 新图元在下次全量同步前没有句柄，概况中用本地编号作 key
+                self._summary.add(("new", len(self._entities)), entity.type, entity.layer, entity.bbox, entity.text, measure)
+                self._entities.append(entity)
+
+    def mark_stale(self, reason):
+        if self.stale_reason is None:
+            logger.info(f"Model mirror marked stale: {reason}")
+        self.stale_reason = reason
+
+    # ---------- 查询 ----------
+
+    def query(self, type=None, layer=None, region=None, text=None, limit=None):
+        """
+        按条件筛选图元，返回字典列表 {type, handle, layer, bbox, text}：
+        type/layer 不区分大小写，region 为 (xmin, ymin, xmax, ymax)，text 为文字内容或块名中包含的子串。
+        """
+        type = type.upper() if type else None
+        layer = layer.lower() if layer else None
+        results = []
+        with self._lock:
+            for e in self._entities:
+                if type and e.type != type:
+                    continue
+                if layer and e.layer.lower() != layer:
+                    continue
+                if region and (e.bbox is None or not _intersects(e.bbox, region)):
+                    continue
+                if text and (e.text is None or text not in e.text):
+                    continue
+                results.append(e.as_dict())
+                if limit and len(results) >= limit:
+                    break
+        return results
+
+    def count(self):
+        with self._lock:
+            return len(self._entities)
+
+    def counts_by_type(self):
+        with self._lock:
+            return Counter(e.type for e in self._entities)
+
+    def layers(self):
+        with self._lock:
+            return Counter(e.layer for e in self._entities)
+
+    def extents(self):
+        with self._lock:
+            boxes = [e.bbox for e in self._entities if e.bbox]
+        if not boxes:
+            return None
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def describe(self, token_budget=DIGEST_TOKEN_BUDGET):
+        """给模型的图纸概况：总数、范围、类型/图层/块参照分布、半径与带句柄的文字，不超过 token_budget"""
+        with self._lock:
+            return self._summary.digest(token_budget, title=f"当前图纸 ({self.doc_name or '未知'}) 模型空间")
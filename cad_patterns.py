@@ -0,0 +1,205 @@
+import math
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+ANGLE_TOLERANCE = 1e-9       # 判断 “整圆” 与 “所有元件未旋转” 的容差
+
+
+def _full_circle(angle):
+    return abs(abs(angle) - 360.0) < ANGLE_TOLERANCE
+
+
+class Pattern:
+    """
+    一组元件的摆放位置：points (N×2)、rotations (N，度)、flipped (N，镜像过的元件)。
+    由 polar / rect / along_path 生成，可以平移、旋转、镜像、用 + 合并；
+    grid / polar 记录生成方式，写入 CAD 时据此选用一次调用完成的 MINSERT / ArrayPolar。
+    """
+
+    def __init__(self, points, rotations=None, flipped=None, grid=None, polar=None):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n = len(self.points)
+        self.rotations = np.zeros(n) if rotations is None else np.broadcast_to(np.asarray(rotations, dtype=np.float64), (n,)).copy()
+        self.flipped = np.zeros(n, dtype=bool) if flipped is None else np.asarray(flipped, dtype=bool).reshape(n)
+        self.grid = grid      # (rows, columns, row_spacing, column_spacing)：左下角为 points[0]
+        self.polar = polar    # (center, count, angle)：points[0] 为第一项，其余由它绕 center 旋转得到
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        """逐个元件返回 (x, y, rotation)，方便在普通 for 循环中使用"""
+        return zip(self.points[:, 0].tolist(), self.points[:, 1].tolist(), self.rotations.tolist())
+
+    def __add__(self, other):
+        return Pattern(np.vstack([self.points, other.points]), np.concatenate([self.rotations, other.rotations]),
+                       np.concatenate([self.flipped, other.flipped]))
+
+    def __repr__(self):
+        kind = "grid" if self.grid else "polar" if self.polar else "points"
+        return f"<Pattern {kind} n={len(self)}>"
+
+    # ---------- 变换 ----------
+
+    def translate(self, dx, dy):
+        grid = self.grid
+        polar = None
+        if self.polar:
+            (cx, cy), count, angle = self.polar
+            polar = ((cx + dx, cy + dy), count, angle)
+        return Pattern(self.points + (dx, dy), self.rotations, self.flipped, grid, polar)
+
+    def rotate(self, angle, center=(0, 0)):
+        """整体绕 center 旋转 angle 度 (元件自身的朝向一起旋转)"""
+        a = math.radians(angle)
+        c, s = math.cos(a), math.sin(a)
+        p = self.points - center
+        points = np.column_stack([p[:, 0] * c - p[:, 1] * s, p[:, 0] * s + p[:, 1] * c]) + center
+        polar = None
+        if self.polar:
+            (cx, cy), count, fill = self.polar
+            pc = np.array([cx, cy]) - center
+            polar = (tuple((pc[0] * c - pc[1] * s + center[0], pc[0] * s + pc[1] * c + center[1])), count, fill)
+        return Pattern(points, self.rotations + angle, self.flipped, None, polar)
+
+    def mirror(self, p1, p2, keep=True):
+        """
+        以 p1→p2 所在直线为对称轴镜像；keep=True 时保留原元件 (得到对称的两组)。
+        镜像元件的朝向为 2·轴角 − 原朝向，并标记为 flipped (插入块时 Y 向比例取负，非对称元件也能正确镜像)。
+        """
+        p1 = np.asarray(p1, dtype=np.float64)
+        d = np.asarray(p2, dtype=np.float64) - p1
+        d /= np.hypot(*d)
+        rel = self.points - p1
+        proj = rel @ d
+        mirrored = p1 + 2 * np.outer(proj, d) - rel
+        axis_deg = math.degrees(math.atan2(d[1], d[0]))
+        flipped = Pattern(mirrored, 2 * axis_deg - self.rotations, ~self.flipped)
+        return self + flipped if keep else flipped
+
+    # ---------- ezdxf ----------
+
+    def insert(self, layout, block_name, scale=1.0, dxfattribs=None):
+        """
+        在 ezdxf 布局 (msp 或块) 中插入块参照：未旋转的栅格为一个 MINSERT，其余逐点 add_blockref。
+        返回创建的 Insert 列表。
+        """
+        attribs = dict(dxfattribs or {})
+        if self.grid and not self.flipped.any() and np.allclose(self.rotations, 0, atol=ANGLE_TOLERANCE):
+            rows, columns, row_spacing, column_spacing = self.grid
+            attribs.update(xscale=scale, yscale=scale, zscale=scale, row_count=rows, column_count=columns,
+                           row_spacing=row_spacing, column_spacing=column_spacing)
+            return [layout.add_blockref(block_name, tuple(self.points[0].tolist()), dxfattribs=attribs)]
+        yscales = np.where(self.flipped, -scale, scale).tolist()
+        return [
+            layout.add_blockref(block_name, (x, y), dxfattribs={**attribs, "xscale": scale, "yscale": ys, "zscale": scale, "rotation": r})
+            for (x, y, r), ys in zip(self, yscales)
+        ]
+
+    def add_circles(self, layout, radius, dxfattribs=None):
+        """在每个位置画一个圆 (螺栓孔、定位孔)，返回 Circle 列表"""
+        return [layout.add_circle((x, y), radius, dxfattribs=dxfattribs) for x, y, _r in self]
+
+    # ---------- COM (pyautocad / 中望CAD) ----------
+
+    def insert_com(self, acad, block_name, APoint, scale=1.0, layer=None):
+        """
+        通过 COM 插入块参照 (APoint 传入执行环境中的 APoint)：
+        - 未旋转的栅格：一次 AddMInsertBlock；
+        - 未经镜像的环形阵列：一次 InsertBlock + 一次 ArrayPolar (其余副本在 CAD 内部生成)；
+        - 其他情况逐点 InsertBlock。
+        返回创建的块参照对象列表。
+        """
+        model = acad.model
+        if self.grid and not self.flipped.any() and np.allclose(self.rotations, 0, atol=ANGLE_TOLERANCE):
+            rows, columns, row_spacing, column_spacing = self.grid
+            x, y = self.points[0].tolist()
+            refs = [model.AddMInsertBlock(APoint(x, y), block_name, scale, scale, scale, 0,
+                                          rows, columns, row_spacing, column_spacing)]
+        elif self.polar and not self.flipped.any() and len(self) > 1:
+            (cx, cy), count, angle = self.polar
+            x, y = self.points[0].tolist()
+            first = model.InsertBlock(APoint(x, y), block_name, scale, scale, scale, math.radians(self.rotations[0]))
+            refs = [first] + list(first.ArrayPolar(count, math.radians(angle), APoint(cx, cy)))
+        else:
+            yscales = np.where(self.flipped, -scale, scale).tolist()
+            refs = [model.InsertBlock(APoint(x, y), block_name, scale, ys, scale, math.radians(r))
+                    for (x, y, r), ys in zip(self, yscales)]
+        if layer:
+            for ref in refs:
+                ref.Layer = layer
+        return refs
+
+    def add_circles_com(self, acad, radius, APoint):
+        """通过 COM 在每个位置画一个圆 (批量代理下这些调用会合并提交)"""
+        return [acad.model.AddCircle(APoint(x, y), radius) for x, y, _r in self]
+
+
+# ================= 图案生成 =================
+
+def polar(center, radius, count, start_angle=0.0, angle=360.0, rotate=True):
+    """
+    环形阵列：count 个位置均布在半径 radius 的圆上，从 start_angle 开始逆时针填充 angle 度
+    (整圆时均分 360°，否则首尾两项分别位于 start_angle 与 start_angle + angle)。
+    rotate=True 时元件朝向随角度旋转 (第一项的朝向为 0)，否则保持原方向。
+    """
+    count = int(count)
+    step = angle / count if _full_circle(angle) or count < 2 else angle / (count - 1)
+    offsets = np.arange(count) * step
+    theta = np.radians(start_angle + offsets)
+    points = np.column_stack([center[0] + radius * np.cos(theta), center[1] + radius * np.sin(theta)])
+    rotations = offsets if rotate else np.zeros(count)
+    # ArrayPolar 会旋转副本，只有 rotate=True 时才能用它一次生成
+    meta = ((float(center[0]), float(center[1])), count, float(angle)) if rotate else None
+    return Pattern(points, rotations, polar=meta)
+
+
+def rect(origin, rows, columns, row_spacing, column_spacing):
+    """矩形阵列：origin 为左下角第一项，行沿 Y 方向、列沿 X 方向 (间距可为负)"""
+    rows, columns = int(rows), int(columns)
+    xs = origin[0] + np.arange(columns) * column_spacing
+    ys = origin[1] + np.arange(rows) * row_spacing
+    gx, gy = np.meshgrid(xs, ys)
+    return Pattern(np.column_stack([gx.ravel(), gy.ravel()]),
+                   grid=(rows, columns, float(row_spacing), float(column_spacing)))
+
+
+def along_path(vertices, count=None, spacing=None, closed=False, rotate=True):
+    """
+    沿折线 vertices 按弧长等距排布：给定 count 时首尾各一项、均分全长 (闭合时均分整圈)，
+    或给定 spacing 时从起点开始每隔 spacing 一项。rotate=True 时元件朝向为所在线段的切线方向。
+    """
+    v = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    if closed:
+        v = np.vstack([v, v[:1]])
+    seg = np.diff(v, axis=0)
+    seg_len = np.hypot(seg[:, 0], seg[:, 1])
+    keep = seg_len > 0
+    seg, seg_len, starts = seg[keep], seg_len[keep], v[:-1][keep]
+    if len(seg) == 0:
+        raise ValueError("路径长度为 0")
+    cum = np.concatenate([[0.0], np.cumsum(seg_len)])
+    total = cum[-1]
+    if spacing is not None:
+        s = np.arange(0.0, total + ANGLE_TOLERANCE, spacing)
+        if closed and len(s) > 1 and total - s[-1] < ANGLE_TOLERANCE:
+            s = s[:-1]  # 闭合路径终点与起点重合
+    elif count is not None:
+        count = int(count)
+        s = np.linspace(0.0, total, count, endpoint=not closed) if count > 1 else np.zeros(1)
+    else:
+        raise ValueError("count 与 spacing 至少给定一个")
+    idx = np.clip(np.searchsorted(cum, s, side="right") - 1, 0, len(seg) - 1)
+    t = (s - cum[idx]) / seg_len[idx]
+    points = starts[idx] + seg[idx] * t[:, None]
+    rotations = np.degrees(np.arctan2(seg[idx, 1], seg[idx, 0])) if rotate else None
+    return Pattern(points, rotations)
+
+
+def points(xy, rotations=None):
+    """由任意坐标序列 (N×2) 构造图案，例如自己用 NumPy 算出的齿顶点"""
+    return Pattern(xy, rotations)
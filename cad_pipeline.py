@@ -0,0 +1,550 @@
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from cad_cache import make_cache_key
+from code_validator import validate_code
+from drawing_summary import inject_digest
+from pipeline_metrics import RequestTrace, maybe_span
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+OUTPUT_FILE = "generated_drawing.dxf"
+STREAM_RENDER_INTERVAL = 0.1  # 流式输出时回调界面的最小间隔 (秒)，避免刷新过于频繁
+MAX_RETRIES = 3
+MAX_TOOL_ROUNDS = 4           # 函数调用循环中模型最多发起几轮工具调用，之后强制给出最终回复
+
+# === 核心：隐藏的指令 (注入到 API 请求中，不在前端显示) ===
+HIDDEN_INSTRUCTION = """
+你是一个 Python ezdxf 库的专家。你的任务是根据用户的自然语言描述编写 Python 代码。
+1. 直接输出可执行的 Python 代码。
+2. 必须导入 ezdxf。
+3. 创建新图纸使用 ezdxf.new()。
+4. **最终的图纸对象必须赋值给全局变量 `doc`**，系统会直接读取内存中的图纸，无需调用 saveas 保存文件。
+5. 不要做任何需要用户键盘输入的操作 (如 input())。
+6. 尽量使用常见的 ezdxf 操作，确保兼容性。
+7. 重复排布的图元 (螺栓孔、齿、栅格、沿路径排列、对称布置) 使用已预置的 `patterns` 一次算出全部位置：
+   `patterns.polar(center, radius, count)`、`patterns.rect(origin, rows, columns, row_spacing, column_spacing)`、
+   `patterns.along_path(vertices, count=...)`，可再 `.mirror(p1, p2)`；然后 `.add_circles(msp, r)` 画圆，
+   或把重复元件定义为块 (doc.blocks.new) 后 `.insert(msp, "块名")` 批量插入，不要用 for 循环逐点计算 cos/sin。
+8. 如果之前有报错，请根据报错信息修正代码。
+--------------------------------------------------
+用户需求：
+"""
+
+# === 增量模式的隐藏指令：图纸在会话中常驻，模型只输出增量操作 ===
+INCREMENTAL_INSTRUCTION = """
+你是一个 Python ezdxf 库的专家，正在以“增量模式”修改一张已经存在的图纸。
+1. 直接输出可执行的 Python 代码。
+2. 变量 `doc` (当前图纸) 和 `msp` (模型空间) 已经存在，**不要**调用 ezdxf.new() 重新创建图纸，也不需要保存文件。
+3. 只输出本轮需要的增量操作：新增图元 (msp.add_*)、修改已有图元 (entity.dxf.xxx = ...)、删除图元 (msp.delete_entity(entity))。
+4. 查找已有图元可使用 msp.query('CIRCLE')、msp.query('LINE[layer=="0"]') 等查询语句。
+5. 重复排布的图元使用已预置的 `patterns` (polar / rect / along_path / mirror) 算出位置，再 `.add_circles(msp, r)` 或 `.insert(msp, "块名")` 批量写入。
+   图纸中可能已有前几轮定义的同名块：先用 `if "块名" not in doc.blocks:` 判断，不存在时才 `doc.blocks.new("块名")` 并添加图元，
+   已存在就直接复用；形状与已有同名块不同时换一个更具体的新块名。
+6. 不要做任何需要用户键盘输入的操作 (如 input())。
+7. 如果之前有报错，请根据报错信息修正代码 (报错时本轮的修改已被回滚)。
+--------------------------------------------------
+用户需求：
+"""
+
+# 增量模式下执行环境中预置的变量及其类型 (供执行前检查使用)
+INCREMENTAL_PREDEFINED = {"doc": "Drawing", "msp": "Modelspace"}
+
+
+# ================= 工具函数 =================
+
+CODE_BLOCK_PATTERN = re.compile(r"```python\s*(.*?)\s*```", re.DOTALL)
+
+def extract_code(text):
+    """从 LLM 回复中提取 Python 代码块"""
+    match = CODE_BLOCK_PATTERN.search(text)
+    if match:
+        return match.group(1)
+    if "import ezdxf" in text:
+        return text
+    return ""
+
+def extract_closed_code_block(text):
+    """仅当 python 代码块已经闭合时返回其内容 (用于流式输出过程中的检测)"""
+    match = CODE_BLOCK_PATTERN.search(text)
+    return match.group(1) if match else ""
+
+def unpack_exec_result(result):
+    """将沙箱返回的结果字典整理为 (是否成功, 消息, stdout, 产物)"""
+    artifacts = {k: result.get(k) for k in ("dxf", "png", "render_error", "delta", "code", "fixes", "timings", "peak_rss_kb", "digest")}
+    return result["ok"], result["message"], result["stdout"], artifacts
+
+def validation_failure(error, timings=None):
+    """静态检查未通过：不进入沙箱执行，直接把错误说明交给模型修正"""
+    return unpack_exec_result({"ok": False, "message": error, "stdout": "", "timings": timings})
+
+def build_api_messages(ui_messages, instruction=HIDDEN_INSTRUCTION):
+    """
+    构建 API 消息列表：
+    找到第一条用户消息，并在其内容前拼接隐藏指令 (默认 HIDDEN_INSTRUCTION)。
+    这样用户在界面上看不到这一大段提示词，但模型能看到。
+    """
+    api_msgs = []
+
+    # 找到第一条 role='user' 的消息索引
+    first_user_idx = -1
+    for i, msg in enumerate(ui_messages):
+        if msg["role"] == "user":
+            first_user_idx = i
+            break
+
+    for i, msg in enumerate(ui_messages):
+        new_msg = msg.copy() # 浅拷贝，不影响调用方的历史
+        if i == first_user_idx:
+            new_msg["content"] = instruction + new_msg["content"]
+        api_msgs.append(new_msg)
+
+    return api_msgs
+
+def append_to_last_user(api_messages, text):
+    """在最后一条用户消息后追加一段说明 (返回新列表，不修改传入的消息)"""
+    messages = [m.copy() for m in api_messages]
+    for m in reversed(messages):
+        if m["role"] == "user":
+            m["content"] = f"{m['content']}\n\n{text}"
+            break
+    return messages
+
+def run_tool_loop(client, model_name, api_messages, toolbox, temperature=0.1, max_tokens=2048,
+                  trace=None, attempt=None, max_rounds=MAX_TOOL_ROUNDS):
+    """
+    函数调用循环 (与 tool_vllm_qwen.py 的流程相同)：带上 toolbox.TOOLS 请求模型，
+    模型返回 tool_calls 时由 toolbox.call(name, arguments) 执行并把结果作为 tool 消息追加，再次请求；
+    直到模型给出普通回复，或达到 max_rounds 后不带工具再请求一次。
+    toolbox 需提供 TOOLS 列表和 call(name, arguments) -> str (如 spatial_index.SpatialIndex)；
+    提供 call_batch([(name, arguments), ...]) 时，一轮中的全部调用作为一批执行 (如 cad_tool_engine.CadToolbox)。
+    返回 (回复文本, 工具调用次数)；api_messages 不被修改。
+    """
+    messages = list(api_messages)
+    n_calls = 0
+    for rnd in range(max_rounds + 1):
+        tools = toolbox.TOOLS if rnd < max_rounds else None
+        with maybe_span(trace, "llm", attempt=attempt, tool_round=rnd) as span:
+            response = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **({"tools": tools} if tools else {})
+            )
+        if trace is not None:
+            trace.record_usage(response.usage, decode_seconds=span["seconds"], attempt=attempt)
+        message = response.choices[0].message
+        if not message.tool_calls:
+            return message.content or "", n_calls
+        messages.append(message.model_dump(exclude_none=True))
+        calls = [(c.function.name, c.function.arguments) for c in message.tool_calls]
+        if hasattr(toolbox, "call_batch"):
+            # 同一轮中的调用互不依赖 (模型还没看到彼此的结果)，作为一批执行
+            with maybe_span(trace, "tool_call", attempt=attempt, tools=len(calls)):
+                contents = toolbox.call_batch(calls)
+        else:
+            contents = []
+            for name, arguments in calls:
+                with maybe_span(trace, "tool_call", attempt=attempt, tool=name):
+                    contents.append(toolbox.call(name, arguments))
+        for tool_call, (name, arguments), content in zip(message.tool_calls, calls, contents):
+            logger.info(f"Tool call {name}({arguments}) -> {len(content)} chars")
+            messages.append({"role": "tool", "content": content, "tool_call_id": tool_call.id})
+        n_calls += len(calls)
+    return "", n_calls
+
+
+# ================= 界面回调 =================
+
+class PipelineHooks:
+    """
+    流水线向界面汇报进度的回调，默认全部为空操作 (headless 运行时直接使用)。
+    Streamlit 等前端继承此类，只覆盖需要展示的部分。
+    """
+
+    def on_status(self, text):
+        """阶段性状态提示，例如“正在执行代码”"""
+
+    def on_stream(self, text, done):
+        """流式输出过程中的完整回复文本；done=True 表示本次流结束"""
+
+    def on_reply(self, attempt, request_messages, ctx_stats, llm_content, code):
+        """模型回复完成并提取出代码后调用 (attempt 从 1 开始)"""
+
+    def on_exec(self, attempt, ok, message, stdout):
+        """代码执行完成后调用"""
+
+    def on_error(self, error):
+        """流水线内部出现未预期的异常 (如 API 连接断开)"""
+
+
+# ================= 生成 → 提取 → 执行 → 渲染 =================
+
+class CadPipeline:
+    """
+    不依赖任何界面的绘图流水线：调用 LLM、提取代码、在沙箱中执行并渲染预览，
+    失败时把报错交给模型修正重试。app.py 与离线基准测试 (bench/) 共用这一实现。
+    """
+
+    def __init__(self, client, sandbox_pool, model_name, result_cache=None, max_retries=MAX_RETRIES,
+                 temperature=0.7, max_tokens=8192):
+        self.client = client
+        self.sandbox_pool = sandbox_pool
+        self.model_name = model_name
+        self.result_cache = result_cache
+        self.max_retries = max_retries
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+    # ---------- 代码执行 ----------
+
+    def execute_ezdxf_code(self, code_str, workdir):
+        """
+        在沙箱 worker 进程中执行生成的代码 (带超时和内存上限)。
+        返回 (是否成功, 消息, stdout, 产物)，产物中包含内存中的 DXF 字节串和预览 PNG，
+        worker 直接渲染执行后得到的图纸对象，不再经过 保存 → 读取 的文件往返。
+        """
+        t0 = time.perf_counter()
+        ok, code_str, error, fixes = validate_code(code_str)
+        timings = {"validate": time.perf_counter() - t0}
+        if not ok:
+            logger.warning(f"Pre-execution check failed: {error}")
+            return validation_failure(error, timings)
+
+        logger.info("Executing generated code in sandbox...")
+        t0 = time.perf_counter()
+        result = self.sandbox_pool.run(code_str, workdir, OUTPUT_FILE)
+        timings["sandbox_roundtrip"] = time.perf_counter() - t0
+        result.update(code=code_str, fixes=fixes, timings={**timings, **result.get("timings", {})})
+        if result["ok"]:
+            logger.info("Execution successful, drawing captured.")
+        else:
+            logger.error(f"Execution failed: {result['message']}")
+        return unpack_exec_result(result)
+
+    def execute_incremental_code(self, code_str, session, workdir, seed_dxf=None):
+        """在增量会话的常驻图纸上执行增量代码，返回值与 execute_ezdxf_code 相同 (产物中另含变更统计)"""
+        t0 = time.perf_counter()
+        ok, code_str, error, fixes = validate_code(code_str, predefined=INCREMENTAL_PREDEFINED)
+        timings = {"validate": time.perf_counter() - t0}
+        if not ok:
+            logger.warning(f"Pre-execution check failed: {error}")
+            return validation_failure(error, timings)
+
+        logger.info("Executing delta code in incremental session...")
+        t0 = time.perf_counter()
+        result = session.run(code_str, workdir, seed_dxf=seed_dxf)
+        timings["sandbox_roundtrip"] = time.perf_counter() - t0
+        result.update(code=code_str, fixes=fixes, timings={**timings, **result.get("timings", {})})
+        if result["ok"]:
+            logger.info(f"Delta applied: {result['delta']}")
+        else:
+            logger.error(f"Delta execution failed: {result['message']}")
+        return unpack_exec_result(result)
+
+    # ---------- LLM 调用 ----------
+
+    def request_completion(self, api_messages, trace=None, attempt=None):
+        """单次非流式调用 LLM，返回回复文本"""
+        with maybe_span(trace, "llm", attempt=attempt) as span:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=api_messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens
+            )
+        if trace is not None:
+            trace.record_usage(response.usage, decode_seconds=span["seconds"], attempt=attempt)
+        return response.choices[0].message.content
+
+    def request_with_tools(self, api_messages, toolbox, trace=None, attempt=None):
+        """带工具的非流式调用：模型可先查询图纸 (见 run_tool_loop)，返回最终回复文本"""
+        content, n_calls = run_tool_loop(self.client, self.model_name, api_messages, toolbox, self.temperature,
+                                         self.max_tokens, trace, attempt)
+        if n_calls:
+            logger.info(f"Model made {n_calls} tool calls before answering.")
+        return content
+
+    def generate_candidates(self, api_messages, k, trace=None, attempt=None):
+        """
+        一次请求 k 个候选回复 (OpenAI 兼容接口的 n 参数)。
+        若服务端忽略了 n，则用并发请求补足剩余的候选。
+        """
+        with maybe_span(trace, "llm", attempt=attempt, candidates=k) as span:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=api_messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                n=k
+            )
+            contents = [choice.message.content or "" for choice in response.choices]
+        if trace is not None:
+            trace.record_usage(response.usage, decode_seconds=span["seconds"], attempt=attempt)
+        missing = k - len(contents)
+        if missing > 0:
+            # 补足的请求各自记录 llm 阶段与 token 用量
+            with ThreadPoolExecutor(max_workers=missing) as executor:
+                contents += list(executor.map(lambda _: self.request_completion(api_messages, trace, attempt), range(missing)))
+        return contents
+
+    def speculative_generate_and_execute(self, api_messages, k, workdir, trace=None, attempt=None):
+        """
+        投机模式：一次生成 k 个候选，在沙箱池中并行执行 (每个候选独立的工作目录)，
+        第一个成功生成图纸的候选获胜，其余候选被取消。
+        返回值与 stream_generate_and_execute 相同：(回复, 代码, 执行结果)。
+        全部失败时返回第一个带代码候选的结果，交给原有的报错修正流程。
+        """
+        contents = self.generate_candidates(api_messages, k, trace, attempt)
+        codes = [extract_code(c) for c in contents]
+        candidates = [i for i, code in enumerate(codes) if code]
+        if not candidates:
+            return contents[0], "", None
+
+        # 静态检查不通过的候选不进入沙箱
+        with maybe_span(trace, "validate", attempt=attempt):
+            checked = {i: validate_code(codes[i]) for i in candidates}
+        runnable = [i for i in candidates if checked[i][0]]
+        if not runnable:
+            idx = candidates[0]
+            return contents[idx], codes[idx], validation_failure(checked[idx][2])
+
+        logger.info(f"Racing {len(runnable)} speculative candidates...")
+        with maybe_span(trace, "sandbox_race", attempt=attempt, candidates=len(runnable)):
+            winner, results = self.sandbox_pool.race([checked[i][1] for i in runnable], workdir, OUTPUT_FILE)
+        pick = winner if winner is not None else 0
+        idx = runnable[pick]
+        if winner is not None:
+            logger.info(f"Candidate {idx + 1}/{k} won the race.")
+        results[pick].update(code=checked[idx][1], fixes=checked[idx][3])
+        return contents[idx], codes[idx], unpack_exec_result(results[pick])
+
+    def stream_generate_and_execute(self, api_messages, run_code, trace=None, attempt=None, hooks=None):
+        """
+        流式调用 LLM：
+        1. 通过 hooks.on_stream 实时汇报模型输出的文本；
+        2. 一旦检测到 python 代码块闭合，立即在后台线程中执行代码，
+           模型后续的解释文字仍在继续流式输出；
+        3. run_code(code) 负责实际执行 (普通模式或增量会话)；
+           返回 (完整回复, 提取的代码, 执行结果)。
+           若回复中没有闭合的代码块，执行结果为 None，由调用方按原流程处理。
+        首个 token 之前的耗时记为 prefill，之后到流结束记为 decode。
+        """
+        hooks = hooks or PipelineHooks()
+        executor = ThreadPoolExecutor(max_workers=1)
+        exec_future = None
+        code = ""
+        llm_content = ""
+        last_render = 0.0
+        usage = None
+        first_token_at = None
+
+        try:
+            t0 = time.perf_counter()
+            stream = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=api_messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                llm_content += delta
+
+                # 只有新片段里出现反引号时才需要重新检测代码块是否闭合
+                if exec_future is None and "`" in delta:
+                    code = extract_closed_code_block(llm_content)
+                    if code:
+                        logger.info("Code block closed, executing while the reply is still streaming...")
+                        exec_future = executor.submit(run_code, code)
+
+                now = time.monotonic()
+                if now - last_render >= STREAM_RENDER_INTERVAL:
+                    hooks.on_stream(llm_content, False)
+                    last_render = now
+
+            hooks.on_stream(llm_content, True)
+            stream_end = time.perf_counter()
+            if trace is not None:
+                first_token_at = first_token_at or stream_end
+                trace.add_span("llm.prefill", first_token_at - t0, attempt=attempt)
+                trace.add_span("llm.decode", stream_end - first_token_at, attempt=attempt)
+                trace.record_usage(usage, decode_seconds=stream_end - first_token_at, ttft=first_token_at - t0, attempt=attempt)
+            exec_result = exec_future.result() if exec_future else None
+        finally:
+            executor.shutdown(wait=True)
+
+        if exec_future is None:
+            code = extract_code(llm_content)
+        return llm_content, code, exec_result
+
+    # ---------- 完整流程 ----------
+
+    def run(self, ui_messages, workdir, hooks=None, trace=None, stream=True, speculative_k=1,
+            compactor=None, use_cache=True, session=None, seed_dxf=None, drawing_digest=None, tools=None):
+        """
+        处理一次用户请求 (ui_messages 为不含隐藏指令的对话历史，最后一条是本轮需求)。
+        session 不为 None 时进入增量模式：在会话常驻的图纸上执行增量代码，seed_dxf 用于 worker 重启后恢复图纸。
+        drawing_digest 为上一轮返回的图纸概况：附加到本轮需求后，代替历史代码告诉模型图纸里实际有什么
+        (增量模式下全部历史代码都折叠为摘要，整图重新生成时保留最近一份代码原文)。
+        tools 为工具箱 (如当前图纸的 spatial_index.SpatialIndex)：给定时模型可先调用查询工具再写代码，
+        此时使用非流式的函数调用循环，流式与投机模式不生效。
+        返回结果字典：
+          status       "cache_hit" / "success" / "failed"
+          success      是否成功 (模型未输出代码时直接把回复当作答案，也视为成功)
+          reply        展示给用户并写入对话历史的最终回复文本
+          message      最后一次失败的报错信息
+          attempts     调用模型的轮数 (命中缓存时为 0)
+          dxf / png    DXF 字节串与预览 PNG 字节串
+          delta        增量模式下的变更统计
+          digest       执行成功后图纸的概况 (drawing_summary)，下一轮作为 drawing_digest 传入
+          worker_rss_kb  执行代码的 worker 进程峰值内存 (KB，平台不支持时为 None)
+          trace        本次请求的 RequestTrace (由调用方决定何时 finish)
+        """
+        hooks = hooks or PipelineHooks()
+        incremental = session is not None
+        if trace is None:
+            trace = RequestTrace("pipeline", model=self.model_name, stream=stream, speculative=speculative_k, incremental=incremental)
+
+        result = {
+            "status": "failed", "success": False, "reply": "",
+            "message": "未知错误 (未收到代码或执行被中断)",
+            "attempts": 0, "dxf": None, "png": None, "delta": None, "digest": None, "worker_rss_kb": None, "trace": trace,
+        }
+
+        # 构建发送给 API 的消息 (包含隐藏指令)
+        instruction = INCREMENTAL_INSTRUCTION if incremental else HIDDEN_INSTRUCTION
+        with trace.span("build_messages"):
+            current_api_messages = build_api_messages(ui_messages, instruction)
+            if drawing_digest:
+                current_api_messages = inject_digest(current_api_messages, drawing_digest, keep_latest_code=not incremental)
+            if tools is not None:
+                current_api_messages = append_to_last_user(current_api_messages, tools.TOOL_HINT)
+
+        # 执行方式：增量模式在会话常驻的图纸上执行，否则每次从头执行
+        if incremental:
+            run_code = lambda c: self.execute_incremental_code(c, session, workdir, seed_dxf)
+        else:
+            run_code = lambda c: self.execute_ezdxf_code(c, workdir)
+
+        # === 缓存查询：命中则跳过 LLM、执行与渲染 (增量模式的结果依赖会话状态，不缓存) ===
+        with trace.span("cache_lookup"):
+            use_cache = use_cache and self.result_cache is not None and not incremental
+            use_cache = use_cache and tools is None  # 工具的回答依赖图纸内容，不在缓存键中
+            cache_key = make_cache_key(current_api_messages, self.model_name, HIDDEN_INSTRUCTION) if use_cache else None
+            cache_hit = self.result_cache.get(cache_key) if cache_key else None
+        if cache_hit:
+            logger.info(f"Cache hit: {cache_key[:12]}")
+            result.update(
+                status="cache_hit", success=True, dxf=cache_hit["dxf"], png=cache_hit["png"],
+                reply=f"✅ 绘图成功！(命中缓存)\n\n*生成的代码逻辑：*\n```python\n{cache_hit['code']}\n```",
+            )
+            return result
+
+        attempt = 0
+        while attempt < self.max_retries:
+            exec_result = None
+            result["attempts"] = attempt + 1
+
+            try:
+                logger.info(f"--- Attempt {attempt + 1} Start ---")
+
+                # 按 token 预算压缩历史 (完整历史仍保留在 current_api_messages 中)
+                if compactor:
+                    with trace.span("compact_context", attempt=attempt + 1):
+                        request_messages, ctx_stats = compactor.compact(current_api_messages)
+                else:
+                    request_messages, ctx_stats = current_api_messages, None
+
+                # 调用 LLM
+                if tools is not None:
+                    llm_content = self.request_with_tools(request_messages, tools, trace, attempt + 1)
+                    with trace.span("extract_code", attempt=attempt + 1):
+                        code = extract_code(llm_content)
+                elif speculative_k > 1 and not incremental:
+                    llm_content, code, exec_result = self.speculative_generate_and_execute(
+                        request_messages, speculative_k, workdir, trace, attempt + 1)
+                elif stream:
+                    llm_content, code, exec_result = self.stream_generate_and_execute(
+                        request_messages, run_code, trace, attempt + 1, hooks)
+                else:
+                    llm_content = self.request_completion(request_messages, trace, attempt + 1)
+                    with trace.span("extract_code", attempt=attempt + 1):
+                        code = extract_code(llm_content)
+
+                hooks.on_reply(attempt + 1, request_messages, ctx_stats, llm_content, code)
+
+                if not code:
+                    logger.info("No code found in response.")
+                    result.update(status="success", success=True, reply=llm_content)
+                    break
+
+                # 执行代码 (流式模式下代码块闭合时已经开始执行)
+                if exec_result is None:
+                    hooks.on_status(f"⚙️ 正在执行代码 (第 {attempt + 1} 次尝试)...")
+                    exec_result = run_code(code)
+                exec_success, msg, logs, artifacts = exec_result
+                trace.add_timings(artifacts["timings"], attempt=attempt + 1)
+                if artifacts["peak_rss_kb"]:
+                    result["worker_rss_kb"] = max(result["worker_rss_kb"] or 0, artifacts["peak_rss_kb"])
+                hooks.on_exec(attempt + 1, exec_success, msg, logs)
+
+                if exec_success:
+                    code = artifacts["code"] or code  # 可能包含执行前检查的自动修补
+                    reply = f"✅ 绘图成功！\n\n*生成的代码逻辑：*\n```python\n{code}\n```"
+                    if artifacts["fixes"]:
+                        reply += "\n\n*执行前自动修补：* " + "；".join(artifacts["fixes"])
+
+                    # 预览图已由 worker 直接从内存中的图纸渲染
+                    delta = artifacts.get("delta")
+                    if delta:
+                        reply += f"\n\n*本轮变更：新增 {delta['added']} / 修改 {delta['modified']} / 删除 {delta['deleted']} 个图元*"
+                    if artifacts["png"]:
+                        if cache_key:
+                            self.result_cache.put(cache_key, code, artifacts["dxf"], artifacts["png"])
+                    else:
+                        img_err = artifacts["render_error"]
+                        logger.error(f"Preview failed: {img_err}")
+                        reply += f"\n\n⚠️ 预览生成失败: {img_err}"
+                    result.update(status="success", success=True, reply=reply,
+                                  dxf=artifacts["dxf"], png=artifacts["png"], delta=delta, digest=artifacts["digest"])
+                    break # 成功跳出循环
+                else:
+                    # === 自动修正逻辑 ===
+                    logger.warning(f"Attempt {attempt + 1} failed.")
+                    result["message"] = msg
+                    if incremental:
+                        error_feedback = f"执行代码报错：\n{msg}\n本轮修改已回滚，请基于现有的 doc/msp 重新输出增量代码。"
+                    else:
+                        error_feedback = f"执行代码报错：\n{msg}\n请修复代码并确保最终图纸赋值给变量 doc。"
+
+                    # 将本次失败的对话加入到临时的 API 上下文中
+                    current_api_messages.append({"role": "assistant", "content": llm_content})
+                    current_api_messages.append({"role": "user", "content": error_feedback})
+
+                    attempt += 1
+
+            except Exception as e:
+                # 捕获系统级异常 (如 API 连接断开)
+                logger.exception("Pipeline error")
+                result["message"] = f"系统错误: {str(e)}"
+                hooks.on_error(e)
+                break
+
+        if not result["success"]:
+            logger.error("Task failed after retries.")
+        return result
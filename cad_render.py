@@ -0,0 +1,100 @@
+import io
+import time
+import logging
+import matplotlib
+matplotlib.use("Agg")  # 服务端/子进程中渲染，不需要 GUI 后端
+import matplotlib.pyplot as plt
+import ezdxf
+from ezdxf import recover
+from ezdxf.addons.drawing import RenderContext, Frontend
+from ezdxf.addons.drawing.matplotlib import MatplotlibBackend
+
+logger = logging.getLogger("CAD_Agent")
+
+
+def render_doc_to_image(doc, dpi=150, timings=None):
+    """
+    将内存中的 ezdxf 图纸对象直接渲染为 PNG 图片流，无需先存盘再读取。
+    传入 timings 字典时，记录 draw_layout / savefig 两个阶段的耗时。
+    """
+    try:
+        t0 = time.perf_counter()
+        msp = doc.modelspace()
+
+        # 创建图形上下文
+        fig = plt.figure(dpi=dpi) # DPI 这里的清晰度
+        ax = fig.add_axes([0, 0, 1, 1])
+        ctx = RenderContext(doc)
+        out = MatplotlibBackend(ax)
+
+        # 渲染
+        Frontend(ctx, out).draw_layout(msp, finalize=True)
+        t1 = time.perf_counter()
+
+        # 保存到内存
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', bbox_inches='tight')
+        plt.close(fig) # 释放内存
+        img_buffer.seek(0)
+        if timings is not None:
+            timings["draw_layout"] = t1 - t0
+            timings["savefig"] = time.perf_counter() - t1
+        return img_buffer, None
+    except Exception as e:
+        logger.error(f"Image rendering failed: {e}")
+        return None, str(e)
+
+
+def render_region_to_image(doc, entities, region, dpi=150, margin=0.05):
+    """
+    只渲染给定区域内的图元 (增量模式下用于预览本轮的变更区域)。
+    region 为 (xmin, ymin, xmax, ymax)，四周留出 margin 比例的空白。
+    """
+    try:
+        msp = doc.modelspace()
+        fig = plt.figure(dpi=dpi)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ctx = RenderContext(doc)
+        ctx.set_current_layout(msp)
+        out = MatplotlibBackend(ax)
+
+        Frontend(ctx, out).draw_entities(entities)
+        out.finalize()
+
+        xmin, ymin, xmax, ymax = region
+        pad = max(xmax - xmin, ymax - ymin, 1e-6) * margin
+        ax.set_xlim(xmin - pad, xmax + pad)
+        ax.set_ylim(ymin - pad, ymax + pad)
+        ax.set_aspect('equal', 'datalim')
+
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', bbox_inches='tight')
+        plt.close(fig)
+        img_buffer.seek(0)
+        return img_buffer, None
+    except Exception as e:
+        logger.error(f"Region rendering failed: {e}")
+        return None, str(e)
+
+
+def render_dxf_to_image(dxf_path, dpi=150):
+    """将 DXF 文件渲染为 matplotlib 图片流"""
+    try:
+        doc = ezdxf.readfile(dxf_path)
+    except Exception as e:
+        logger.error(f"Reading DXF failed: {e}")
+        return None, str(e)
+    return render_doc_to_image(doc, dpi=dpi)
+
+
+def serialize_doc(doc):
+    """将图纸对象一次性序列化为 DXF 字节串 (供下载按钮和缓存使用)"""
+    stream = io.StringIO()
+    doc.write(stream)
+    return stream.getvalue().encode(doc.output_encoding, errors="dxfreplace")
+
+
+def load_doc_from_bytes(dxf_bytes):
+    """从内存中的 DXF 字节串恢复图纸对象 (自动识别编码)"""
+    doc, _auditor = recover.read(io.BytesIO(dxf_bytes))
+    return doc
@@ -0,0 +1,567 @@
+import re
+import ast
+import math
+import json
+import inspect
+import logging
+from typing import List, Literal, Tuple, Union, get_args, get_origin, get_type_hints
+
+from cad_pipeline import build_api_messages, run_tool_loop
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+MAX_DRAW_ROUNDS = 8            # 工具绘图时模型最多发起几轮工具调用
+CONTEXT_PARAM = "cad"          # 工具函数的第一个参数：由引擎注入的绘图后端，不出现在 schema 中
+
+# 工具绘图模式的隐藏指令 (代替 HIDDEN_INSTRUCTION，模型不再输出代码)
+TOOL_INSTRUCTION = """
+你是一个 CAD 绘图助手，通过调用绘图工具直接在图纸上作图，不要输出 Python 代码。
+1. 坐标单位为图纸单位，角度单位为度，逆时针为正。
+2. 同一轮中互不依赖的图元请一次发起多个工具调用，系统会批量执行。
+3. 每个绘图工具返回新图元的句柄 (handle)；阵列等需要引用已有图元的操作，请使用之前返回的句柄。
+4. 工具返回 {"error": ...} 时根据报错修正参数后重试。
+5. 全部绘制完成后，用一两句话说明画了什么。
+--------------------------------------------------
+用户需求：
+"""
+
+TOOL_HINT = "请直接调用绘图工具完成需求，互不依赖的图元在同一轮中一次性调用。"
+
+Point = Tuple[float, float]
+
+_SIMPLE_TYPES = {float: "number", int: "integer", str: "string", bool: "boolean"}
+_ARG_LINE = re.compile(r"^\s*(\w+)\s*(?:\([^)]*\))?\s*:\s*(.*)$")
+_CHOICES = re.compile(r"\s*\(choices:\s*(\[.*?\])\)")
+
+
+class ToolError(ValueError):
+    """工具名不存在、参数不合法或引用的图元不存在：作为 {"error": ...} 返回给模型修正"""
+
+
+# ================= 由函数签名生成 schema =================
+
+def _json_schema(annotation):
+    """Python 类型注解 → JSON Schema (支持基本类型、Literal、Optional、List、定长 Tuple)"""
+    if annotation in _SIMPLE_TYPES:
+        return {"type": _SIMPLE_TYPES[annotation]}
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin is Literal:
+        return {"type": _SIMPLE_TYPES[type(args[0])], "enum": list(args)}
+    if origin is Union:
+        options = [a for a in args if a is not type(None)]
+        if len(options) == 1:
+            return _json_schema(options[0])
+    if origin in (list, List):
+        return {"type": "array", "items": _json_schema(args[0]) if args else {}}
+    if origin in (tuple, Tuple):
+        if len(args) == 2 and args[1] is Ellipsis:
+            return {"type": "array", "items": _json_schema(args[0])}
+        return {"type": "array", "items": _json_schema(args[0]), "minItems": len(args), "maxItems": len(args)}
+    raise TypeError(f"工具参数不支持的类型注解: {annotation!r}")
+
+
+def _parse_docstring(doc):
+    """
+    解析 Google 风格的 docstring (与 tool_vllm_qwen.py 中示例函数的写法相同)：
+    返回 (摘要, {参数名: (说明, choices)})，说明中的 "(choices: [...])" 被提取为枚举值。
+    """
+    lines = inspect.cleandoc(doc or "").splitlines()
+    summary, params = [], {}
+    section, current = None, None
+    for line in lines:
+        stripped = line.strip()
+        if stripped in ("Args:", "Arguments:", "Parameters:", "Returns:", "Raises:"):
+            section = stripped
+            continue
+        if section is None:
+            if stripped:
+                summary.append(stripped)
+            continue
+        if section == "Returns:" or section == "Raises:":
+            continue
+        match = _ARG_LINE.match(line)
+        if match and not line.startswith("        "):
+            current = match.group(1)
+            params[current] = match.group(2).strip()
+        elif current and stripped:
+            params[current] += " " + stripped
+
+    parsed = {}
+    for name, text in params.items():
+        choices = None
+        match = _CHOICES.search(text)
+        if match:
+            choices = ast.literal_eval(match.group(1))
+            text = _CHOICES.sub("", text).strip()
+        parsed[name] = (text, choices)
+    return " ".join(summary), parsed
+
+
+def function_schema(fn, name=None, skip=()):
+    """由函数签名与 docstring 生成 OpenAI function calling 的工具定义；有默认值的参数为可选"""
+    hints = get_type_hints(fn)
+    summary, docs = _parse_docstring(fn.__doc__)
+    properties, required = {}, []
+    for param in inspect.signature(fn).parameters.values():
+        if param.name in skip:
+            continue
+        if param.name not in hints:
+            raise TypeError(f"工具 {fn.__name__} 的参数 {param.name} 缺少类型注解")
+        prop = _json_schema(hints[param.name])
+        text, choices = docs.get(param.name, ("", None))
+        if text:
+            prop["description"] = text
+        if choices:
+            prop["enum"] = list(choices)
+        properties[param.name] = prop
+        if param.default is inspect.Parameter.empty:
+            required.append(param.name)
+    return {
+        "type": "function",
+        "function": {
+            "name": name or fn.__name__,
+            "description": summary,
+            "parameters": {"type": "object", "properties": properties, "required": required},
+        },
+    }
+
+
+class ToolRegistry:
+    """
+    工具注册表：@registry.tool 注册带类型注解的函数，schema 由签名和 docstring 自动生成。
+    context_param 不为 None 时，函数的同名参数由调用方注入 (例如绘图后端)，不暴露给模型。
+    """
+
+    def __init__(self, context_param=None):
+        self.context_param = context_param
+        self._tools = {}
+
+    def tool(self, fn=None, name=None):
+        def register(f):
+            tool_name = name or f.__name__
+            skip = (self.context_param,) if self.context_param else ()
+            self._tools[tool_name] = (f, function_schema(f, tool_name, skip))
+            return f
+        return register(fn) if fn is not None else register
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    def __len__(self):
+        return len(self._tools)
+
+    @property
+    def TOOLS(self):
+        """全部工具定义 (OpenAI function calling 格式)；注册表本身可作为 run_tool_loop 的工具箱"""
+        return [schema for _fn, schema in self._tools.values()]
+
+    def invoke(self, name, arguments, context=None):
+        """按名称调用工具 (arguments 为 JSON 字符串或字典)，参数错误抛出 ToolError"""
+        if name not in self._tools:
+            raise ToolError(f"未知工具: {name}")
+        fn, _schema = self._tools[name]
+        try:
+            args = json.loads(arguments) if isinstance(arguments, str) else dict(arguments or {})
+        except json.JSONDecodeError as e:
+            raise ToolError(f"参数不是合法的 JSON: {e}")
+        if self.context_param:
+            args[self.context_param] = context
+        try:
+            bound = inspect.signature(fn).bind(**args)
+        except TypeError as e:
+            raise ToolError(f"参数错误: {e}")
+        return fn(*bound.args, **bound.kwargs)
+
+    def call(self, name, arguments, context=None):
+        """调用工具并把结果序列化为 JSON 字符串；错误以 {"error": ...} 返回"""
+        try:
+            result = self.invoke(name, arguments, context)
+        except ToolError as e:
+            result = {"error": str(e)}
+        return json.dumps(result, ensure_ascii=False)
+
+
+# ================= 绘图后端 =================
+
+def _polar_step(count, angle):
+    """阵列相邻副本的角度间隔：整圆时均分 360°，否则首尾副本分别位于 0° 和 angle"""
+    if abs(abs(angle) - 360) < 1e-9 or count < 2:
+        return angle / max(count, 1)
+    return angle / (count - 1)
+
+
+class EzdxfBackend:
+    """在 ezdxf 图纸的模型空间上作图；run() 直接在当前线程执行，commit() 无需操作"""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.msp = doc.modelspace()
+
+    def run(self, job):
+        return job(self)
+
+    def commit(self):
+        pass
+
+    def handle_of(self, entity):
+        return entity.dxf.handle
+
+    def entity(self, handle):
+        entity = self.doc.entitydb.get(handle)
+        if entity is None or not entity.is_alive or entity.dxf.owner != self.msp.layout_key:
+            raise ToolError(f"模型空间中找不到句柄为 {handle} 的图元")
+        return entity
+
+    def add_line(self, start, end, layer):
+        return self.msp.add_line(start, end, dxfattribs={"layer": layer})
+
+    def add_circle(self, center, radius, layer):
+        return self.msp.add_circle(center, radius, dxfattribs={"layer": layer})
+
+    def add_arc(self, center, radius, start_angle, end_angle, layer):
+        return self.msp.add_arc(center, radius, start_angle, end_angle, dxfattribs={"layer": layer})
+
+    def add_polyline(self, points, closed, layer):
+        return self.msp.add_lwpolyline(points, close=closed, dxfattribs={"layer": layer})
+
+    def add_text(self, text, insert, height, rotation, layer):
+        return self.msp.add_text(text, dxfattribs={"insert": insert, "height": height, "rotation": rotation, "layer": layer})
+
+    def insert_block(self, name, insert, scale, rotation, layer):
+        if name not in self.doc.blocks:
+            raise ToolError(f"块定义不存在: {name}")
+        return self.msp.add_blockref(name, insert, dxfattribs={
+            "xscale": scale, "yscale": scale, "zscale": scale, "rotation": rotation, "layer": layer})
+
+    def _copy(self, handles, transforms):
+        copies = []
+        for handle in handles:
+            entity = self.entity(handle)
+            for m in transforms:
+                copy = entity.copy_to_layout(self.msp)
+                copy.transform(m)
+                copies.append(copy)
+        return copies
+
+    def polar_array(self, handles, center, count, angle):
+        from ezdxf.math import Matrix44
+
+        step = math.radians(_polar_step(count, angle))
+        cx, cy = center
+        transforms = [Matrix44.chain(Matrix44.translate(-cx, -cy, 0), Matrix44.z_rotate(step * i), Matrix44.translate(cx, cy, 0))
+                      for i in range(1, count)]
+        return self._copy(handles, transforms)
+
+    def rect_array(self, handles, rows, columns, row_spacing, column_spacing):
+        from ezdxf.math import Matrix44
+
+        transforms = [Matrix44.translate(c * column_spacing, r * row_spacing, 0)
+                      for r in range(rows) for c in range(columns) if r or c]
+        return self._copy(handles, transforms)
+
+
+class ComBackend:
+    """
+    通过常驻 COM 线程在 AutoCAD / 中望CAD 中作图：一批工具调用在一个 ComWorker 任务中执行，
+    绘图调用经 BatchingAcad 记录后在 commit() 时一次性提交 (一个撤销单元)；
+    mirror (cad_mirror.ModelMirror) 不为 None 时，提交的写入同步到镜像。
+    """
+
+    def __init__(self, worker, backend="autocad", session_id="default", mirror=None):
+        self.worker = worker
+        self.backend = backend
+        self.session_id = session_id
+        self.mirror = mirror
+        self._acad = None
+        self._proxy = None
+        self._point = self._array = None
+        self._layers = set()
+
+    def run(self, job):
+        from com_batch import BatchingAcad
+        from com_worker import scope_helpers
+
+        def com_job(acad):
+            helpers = scope_helpers(self.backend)
+            self._point, self._array = helpers["APoint"], helpers["aDouble"]
+            self._acad = acad
+            self._proxy = BatchingAcad(acad, make_array=self._array, observer=self.mirror)
+            try:
+                return job(self)
+            except Exception:
+                self._proxy.discard()
+                raise
+            finally:
+                self._layers.clear()
+
+        result, _info = self.worker.run(com_job, self.session_id)
+        return result
+
+    def commit(self):
+        self._proxy.flush()
+        logger.info(f"COM batch stats: {self._proxy.stats}")
+        try:
+            self._acad.app.ZoomExtents()
+            self._acad.app.Update()
+        except Exception:
+            pass
+
+    def handle_of(self, obj):
+        return obj.Handle
+
+    def entity(self, handle):
+        try:
+            return self._proxy.doc.HandleToObject(handle)
+        except Exception:
+            raise ToolError(f"图纸中找不到句柄为 {handle} 的图元")
+
+    def _p(self, point):
+        return self._point(point[0], point[1], 0)
+
+    def _on_layer(self, obj, layer):
+        if layer and layer != "0":
+            if layer not in self._layers:
+                # 图层表直接访问原始文档：新建图层不影响积压的绘图调用，无需先提交
+                self._acad.doc.Layers.Add(layer)
+                self._layers.add(layer)
+            obj.Layer = layer
+        return obj
+
+    def add_line(self, start, end, layer):
+        return self._on_layer(self._proxy.model.AddLine(self._p(start), self._p(end)), layer)
+
+    def add_circle(self, center, radius, layer):
+        return self._on_layer(self._proxy.model.AddCircle(self._p(center), radius), layer)
+
+    def add_arc(self, center, radius, start_angle, end_angle, layer):
+        return self._on_layer(self._proxy.model.AddArc(
+            self._p(center), radius, math.radians(start_angle), math.radians(end_angle)), layer)
+
+    def add_polyline(self, points, closed, layer):
+        polyline = self._proxy.model.AddLightWeightPolyline(self._array([v for x, y in points for v in (x, y)]))
+        if closed:
+            polyline.Closed = True
+        return self._on_layer(polyline, layer)
+
+    def add_text(self, text, insert, height, rotation, layer):
+        obj = self._proxy.model.AddText(text, self._p(insert), height)
+        if rotation:
+            obj.Rotation = math.radians(rotation)
+        return self._on_layer(obj, layer)
+
+    def insert_block(self, name, insert, scale, rotation, layer):
+        return self._on_layer(self._proxy.model.InsertBlock(self._p(insert), name, scale, scale, scale, math.radians(rotation)), layer)
+
+    def polar_array(self, handles, center, count, angle):
+        copies = []
+        for handle in handles:
+            copies.extend(self.entity(handle).ArrayPolar(count, math.radians(angle), self._point(center[0], center[1], 0)))
+        return copies
+
+    def rect_array(self, handles, rows, columns, row_spacing, column_spacing):
+        copies = []
+        for handle in handles:
+            copies.extend(self.entity(handle).ArrayRectangular(rows, columns, 1, row_spacing, column_spacing, 0))
+        return copies
+
+
+# ================= 绘图工具 =================
+
+CAD_TOOLS = ToolRegistry(context_param=CONTEXT_PARAM)
+
+
+def _check_positive(**values):
+    for name, value in values.items():
+        if value <= 0:
+            raise ToolError(f"{name} 必须大于 0，收到 {value}")
+
+
+@CAD_TOOLS.tool
+def draw_line(cad, start: Point, end: Point, layer: str = "0"):
+    """绘制一条直线段。
+
+    Args:
+        start: 起点 [x, y]。
+        end: 终点 [x, y]。
+        layer: 图层名，默认 "0"。
+    """
+    return {"handle": cad.add_line(start, end, layer)}
+
+
+@CAD_TOOLS.tool
+def draw_circle(cad, center: Point, radius: float, layer: str = "0"):
+    """绘制一个圆。
+
+    Args:
+        center: 圆心 [x, y]。
+        radius: 半径，大于 0。
+        layer: 图层名，默认 "0"。
+    """
+    _check_positive(radius=radius)
+    return {"handle": cad.add_circle(center, radius, layer)}
+
+
+@CAD_TOOLS.tool
+def draw_arc(cad, center: Point, radius: float, start_angle: float, end_angle: float, layer: str = "0"):
+    """绘制一段圆弧，从起始角逆时针画到终止角。
+
+    Args:
+        center: 圆心 [x, y]。
+        radius: 半径，大于 0。
+        start_angle: 起始角 (度)。
+        end_angle: 终止角 (度)。
+        layer: 图层名，默认 "0"。
+    """
+    _check_positive(radius=radius)
+    return {"handle": cad.add_arc(center, radius, start_angle, end_angle, layer)}
+
+
+@CAD_TOOLS.tool
+def draw_polyline(cad, points: List[Point], closed: bool = False, layer: str = "0"):
+    """绘制经过各顶点的二维多段线 (多边形、矩形请使用 closed=true)。
+
+    Args:
+        points: 顶点列表 [[x, y], ...]，至少 2 个。
+        closed: 是否首尾闭合，默认 false。
+        layer: 图层名，默认 "0"。
+    """
+    if len(points) < 2:
+        raise ToolError("多段线至少需要 2 个顶点")
+    return {"handle": cad.add_polyline([tuple(p[:2]) for p in points], closed, layer)}
+
+
+@CAD_TOOLS.tool
+def draw_text(cad, text: str, insert: Point, height: float = 2.5, rotation: float = 0.0, layer: str = "0"):
+    """放置一行单行文字。
+
+    Args:
+        text: 文字内容。
+        insert: 插入点 (左下角) [x, y]。
+        height: 字高，默认 2.5。
+        rotation: 旋转角 (度)，默认 0。
+        layer: 图层名，默认 "0"。
+    """
+    _check_positive(height=height)
+    return {"handle": cad.add_text(text, insert, height, rotation, layer)}
+
+
+@CAD_TOOLS.tool
+def insert_block(cad, name: str, insert: Point, scale: float = 1.0, rotation: float = 0.0, layer: str = "0"):
+    """插入图纸中已有的块定义。
+
+    Args:
+        name: 块名 (必须已存在于图纸中)。
+        insert: 插入点 [x, y]。
+        scale: 统一缩放比例，默认 1。
+        rotation: 旋转角 (度)，默认 0。
+        layer: 图层名，默认 "0"。
+    """
+    _check_positive(scale=scale)
+    return {"handle": cad.insert_block(name, insert, scale, rotation, layer)}
+
+
+@CAD_TOOLS.tool
+def polar_array(cad, handles: List[str], center: Point, count: int, angle: float = 360.0):
+    """环形阵列：把已有图元绕中心点复制，原图元算作第一项。
+
+    Args:
+        handles: 要复制的图元句柄 (绘图工具返回的 handle)。
+        center: 阵列中心 [x, y]。
+        count: 包括原图元在内的总项数，至少 2。
+        angle: 填充角度 (度)，默认 360 (整圆均布)。
+    """
+    if count < 2:
+        raise ToolError("count 至少为 2")
+    return {"handles": cad.polar_array(handles, center, count, angle)}
+
+
+@CAD_TOOLS.tool
+def rect_array(cad, handles: List[str], rows: int, columns: int, row_spacing: float, column_spacing: float):
+    """矩形阵列：把已有图元按行列复制，原图元位于左下角。
+
+    Args:
+        handles: 要复制的图元句柄 (绘图工具返回的 handle)。
+        rows: 行数，至少 1。
+        columns: 列数，至少 1。
+        row_spacing: 行间距 (沿 Y 方向，负值向下)。
+        column_spacing: 列间距 (沿 X 方向，负值向左)。
+    """
+    _check_positive(rows=rows, columns=columns)
+    return {"handles": cad.rect_array(handles, rows, columns, row_spacing, column_spacing)}
+
+
+# ================= 工具箱 (供 run_tool_loop 使用) =================
+
+class CadToolbox:
+    """
+    绑定了绘图后端的工具箱：TOOLS 交给模型，模型一轮中的全部工具调用由 call_batch() 作为一批执行
+    (COM 后端：一个 COM 任务、一次提交)。单个调用的参数错误只影响它自己的结果；
+    提交失败时整批回退，每个调用都收到报错。log 记录全部调用 (工具名, 参数, 结果)。
+    """
+
+    TOOL_HINT = TOOL_HINT
+
+    def __init__(self, backend, registry=CAD_TOOLS):
+        self.backend = backend
+        self.registry = registry
+        self.log = []
+
+    @property
+    def TOOLS(self):
+        return self.registry.TOOLS
+
+    def _export(self, value):
+        """把结果中的图元对象换成句柄，得到可以 JSON 序列化的结构"""
+        if isinstance(value, dict):
+            return {k: self._export(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._export(v) for v in value]
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return self.backend.handle_of(value)
+
+    def call_batch(self, calls):
+        """执行一批 (工具名, 参数) 调用，返回对应的 JSON 字符串列表"""
+        def job(cad):
+            outputs = []
+            for name, arguments in calls:
+                try:
+                    outputs.append(self.registry.invoke(name, arguments, cad))
+                except ToolError as e:
+                    outputs.append(ToolError(str(e)))
+                except Exception as e:
+                    outputs.append(ToolError(f"{type(e).__name__}: {e}"))
+            try:
+                cad.commit()
+            except Exception as e:
+                logger.exception("Tool batch commit failed")
+                return [{"error": f"批量提交失败，本轮绘制已回退: {e}"} for _ in calls]
+            return [{"error": str(o)} if isinstance(o, ToolError) else self._export(o) for o in outputs]
+
+        results = self.backend.run(job)
+        for (name, arguments), result in zip(calls, results):
+            self.log.append((name, arguments, result))
+        return [json.dumps(r, ensure_ascii=False) for r in results]
+
+    def call(self, name, arguments):
+        return self.call_batch([(name, arguments)])[0]
+
+    @property
+    def created(self):
+        """成功执行的调用次数"""
+        return sum(1 for _name, _args, result in self.log if "error" not in result)
+
+
+def draw_with_tools(client, model_name, ui_messages, backend, trace=None, temperature=0.1, max_tokens=2048,
+                    max_rounds=MAX_DRAW_ROUNDS):
+    """
+    工具绘图：模型通过 CAD_TOOLS 直接在 backend (EzdxfBackend / ComBackend) 上作图，不生成、不执行代码。
+    ui_messages 为不含隐藏指令的对话历史。返回 (模型的最终回复, 工具箱)，toolbox.log 为全部调用记录。
+    """
+    api_messages = build_api_messages(ui_messages, TOOL_INSTRUCTION)
+    toolbox = CadToolbox(backend)
+    reply, n_calls = run_tool_loop(client, model_name, api_messages, toolbox, temperature, max_tokens,
+                                   trace, max_rounds=max_rounds)
+    logger.info(f"Tool drawing finished: {n_calls} tool calls, {toolbox.created} succeeded.")
+    return reply, toolbox
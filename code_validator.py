@@ -0,0 +1,278 @@
+import ast
+import difflib
+import logging
+import importlib.util
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 规则配置 =================
+
+# 会阻塞等待或危及服务器的内置调用
+FORBIDDEN_BUILTINS = {
+    "input": "不能等待键盘输入",
+    "exit": "不能退出解释器",
+    "quit": "不能退出解释器",
+    "breakpoint": "不能进入调试器",
+    "eval": "不能动态执行代码",
+    "exec": "不能动态执行代码",
+    "__import__": "不能动态导入模块",
+}
+
+# 模块级的危险/阻塞调用 (模块名, 函数名)，函数名为 None 表示整个模块都禁止调用
+FORBIDDEN_CALLS = {
+    ("os", "system"): "不能执行系统命令",
+    ("os", "popen"): "不能执行系统命令",
+    ("os", "remove"): "不能删除文件",
+    ("os", "unlink"): "不能删除文件",
+    ("os", "rmdir"): "不能删除目录",
+    ("os", "_exit"): "不能退出进程",
+    ("shutil", "rmtree"): "不能删除目录",
+    ("sys", "exit"): "不能退出解释器",
+    ("time", "sleep"): "不能阻塞等待",
+    ("plt", "show"): "不能弹出窗口，预览由系统自动生成",
+    ("subprocess", None): "不能执行系统命令",
+}
+
+FORBIDDEN_MODULES = {
+    "subprocess", "socket", "requests", "urllib", "http", "ctypes",
+    "multiprocessing", "tkinter", "pyautogui", "win32api", "winreg",
+}
+
+# pyautocad 中 Autocad 对象的常用属性/方法
+PYAUTOCAD_ACAD_ATTRS = {
+    "app", "doc", "model", "ActiveDocument", "Application", "best_interface",
+    "iter_objects", "iter_objects_fast", "find_one", "get_selection", "prompt",
+}
+
+# ActiveX ModelSpace 的方法 → (最少参数个数, 最多参数个数)，None 表示不检查参数个数
+ACTIVEX_MODEL_METHODS = {
+    "AddLine": (2, 2), "AddCircle": (2, 2), "AddArc": (4, 4), "AddText": (3, 3),
+    "AddMText": (3, 3), "AddPoint": (1, 1), "AddEllipse": (3, 3), "AddSpline": (3, 3),
+    "AddLightWeightPolyline": (1, 1), "AddPolyline": (1, 1), "Add3DPoly": (1, 1),
+    "AddRay": (2, 2), "AddXline": (2, 2), "AddSolid": (4, 4), "AddTrace": (1, 1),
+    "AddHatch": (3, 4), "AddRegion": (1, 1), "AddLeader": (3, 3), "AddMLine": (1, 1),
+    "AddDimAligned": (3, 3), "AddDimRotated": (4, 4), "AddDimRadial": (3, 3),
+    "AddDimDiametric": (3, 3), "AddDimAngular": (4, 4), "AddDimOrdinate": (3, 3),
+    "AddTable": (5, 5), "AddBox": (4, 4), "AddCylinder": (3, 3), "AddSphere": (2, 2),
+    "InsertBlock": (6, 7), "AddMInsertBlock": (10, 11), "AddRaster": (4, 4),
+    "Item": (1, 1), "AddDim3PointAngular": None, "AddDimArc": None, "AddDimRadialLarge": None,
+    "AddAttribute": None, "AddShape": None, "AddTolerance": None, "AddMLeader": None,
+    "Add3DFace": None, "Add3DMesh": None, "AddPolyfaceMesh": None, "AddCone": None,
+    "AddEllipticalCone": None, "AddEllipticalCylinder": None, "AddTorus": None, "AddWedge": None,
+    "AddExtrudedSolid": None, "AddExtrudedSolidAlongPath": None, "AddRevolvedSolid": None,
+}
+
+
+# ================= ezdxf API 探针 =================
+
+_EZDXF_PROBES = None
+
+
+def _ezdxf_probes():
+    """
+    构造真实的 ezdxf 对象作为 API 探针 (只构造一次)：
+    很多属性 (如 doc.layers) 是在 __init__ 里赋值的实例属性，只能在实例上检查。
+    ezdxf 不可用时返回空字典，跳过 API 检查。
+    """
+    global _EZDXF_PROBES
+    if _EZDXF_PROBES is None:
+        try:
+            import ezdxf
+            doc = ezdxf.new()
+            _EZDXF_PROBES = {
+                "module": ezdxf,
+                "Drawing": doc,
+                "Modelspace": doc.modelspace(),
+                "BlockLayout": doc.blocks.new("__VALIDATOR_PROBE__"),
+                "Paperspace": doc.paperspace(),
+            }
+        except Exception as e:
+            logger.warning(f"ezdxf API probes unavailable: {e}")
+            _EZDXF_PROBES = {}
+    return _EZDXF_PROBES
+
+
+def _infer_ezdxf_type(node, types):
+    """推断一个表达式的 ezdxf 类型 (只覆盖绘图代码中最常见的几种写法)"""
+    if isinstance(node, ast.Name):
+        return types.get(node.id)
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+        return None
+    func = node.func
+    owner = func.value
+    if isinstance(owner, ast.Name) and owner.id == "ezdxf" and func.attr in ("new", "readfile", "read"):
+        return "Drawing"
+    owner_type = _infer_ezdxf_type(owner, types)
+    if owner_type == "Drawing":
+        if func.attr == "modelspace":
+            return "Modelspace"
+        if func.attr in ("paperspace", "layout"):
+            return "Paperspace"
+    # doc.blocks.new(...)
+    if (func.attr == "new" and isinstance(owner, ast.Attribute) and owner.attr == "blocks"
+            and _infer_ezdxf_type(owner.value, types) == "Drawing"):
+        return "BlockLayout"
+    return None
+
+
+def _module_available(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _suggest(name, candidates):
+    matches = difflib.get_close_matches(name, candidates, n=1)
+    return f"，是否想用 `{matches[0]}`？" if matches else ""
+
+
+# ================= 校验器 =================
+
+class _Checker(ast.NodeVisitor):
+    def __init__(self, api, predefined_types):
+        self.api = api
+        self.errors = []
+        self.types = dict(predefined_types)
+        self.probes = _ezdxf_probes() if api == "ezdxf" else {}
+        self.imported_aliases = {}  # 本地别名 → 模块名
+        self.ezdxf_submodules = set()  # 代码中 import ezdxf.xxx 显式导入的子模块
+
+    def error(self, node, text):
+        self.errors.append(f"第 {getattr(node, 'lineno', '?')} 行: {text}")
+
+    # ---------- 导入 ----------
+
+    def _check_module(self, node, module):
+        root = module.split(".")[0]
+        if root in FORBIDDEN_MODULES:
+            self.error(node, f"禁止导入模块 `{module}`。")
+        elif not _module_available(root):
+            self.error(node, f"运行环境中没有模块 `{module}`，请只使用 ezdxf、math 等可用的库。")
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._check_module(node, alias.name)
+            self.imported_aliases[alias.asname or alias.name.split(".")[0]] = alias.name.split(".")[0]
+            parts = alias.name.split(".")
+            if parts[0] == "ezdxf" and len(parts) > 1 and not alias.asname:
+                self.ezdxf_submodules.add(parts[1])
+        self.generic_visit(node)
+
+    def _ezdxf_has(self, attr):
+        """
+        ezdxf.<attr> 是否可用：模块属性，或者存在的子模块 (ezdxf.bbox 等)。
+        子模块只有被导入过才会成为模块属性，不能只看 hasattr，否则结果取决于本进程之前导入过什么。
+        """
+        return (hasattr(self.probes["module"], attr) or attr in self.ezdxf_submodules
+                or _module_available(f"ezdxf.{attr}"))
+
+    def visit_ImportFrom(self, node):
+        if node.module and node.level == 0:
+            self._check_module(node, node.module)
+        self.generic_visit(node)
+
+    # ---------- 变量类型跟踪 ----------
+
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        inferred = _infer_ezdxf_type(node.value, self.types) if self.probes else None
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                if inferred:
+                    self.types[target.id] = inferred
+                else:
+                    self.types.pop(target.id, None)
+
+    # ---------- 调用 ----------
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Name) and func.id in FORBIDDEN_BUILTINS:
+            self.error(node, f"禁止调用 `{func.id}()`：{FORBIDDEN_BUILTINS[func.id]}。")
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            module = self.imported_aliases.get(func.value.id, func.value.id)
+            reason = FORBIDDEN_CALLS.get((module, func.attr)) or FORBIDDEN_CALLS.get((module, None))
+            if reason:
+                self.error(node, f"禁止调用 `{func.value.id}.{func.attr}()`：{reason}。")
+        if self.api == "pyautocad":
+            self._check_pyautocad_call(node)
+        self.generic_visit(node)
+
+    def _check_pyautocad_call(self, node):
+        func = node.func
+        if isinstance(func, ast.Name) and func.id == "APoint":
+            if not 1 <= len(node.args) <= 3 and not node.keywords:
+                self.error(node, f"`APoint` 接受 1~3 个参数 (x, y[, z])，实际传入了 {len(node.args)} 个。")
+        # acad.model.AddXxx(...)
+        if (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Attribute)
+                and func.value.attr == "model" and isinstance(func.value.value, ast.Name)
+                and func.value.value.id == "acad"):
+            if func.attr not in ACTIVEX_MODEL_METHODS:
+                self.error(node, f"ModelSpace 没有方法 `{func.attr}`{_suggest(func.attr, ACTIVEX_MODEL_METHODS)}")
+                return
+            spec = ACTIVEX_MODEL_METHODS[func.attr]
+            if spec and not node.keywords and not any(isinstance(a, ast.Starred) for a in node.args):
+                low, high = spec
+                if not low <= len(node.args) <= high:
+                    expected = low if low == high else f"{low}~{high}"
+                    self.error(node, f"`acad.model.{func.attr}` 需要 {expected} 个参数，实际传入了 {len(node.args)} 个。")
+
+    # ---------- 属性访问 ----------
+
+    def visit_Attribute(self, node):
+        owner = node.value
+        if isinstance(owner, ast.Name):
+            if self.probes:
+                if owner.id == "ezdxf" and owner.id not in self.types:
+                    if not self._ezdxf_has(node.attr):
+                        probe = self.probes["module"]
+                        self.error(node, f"ezdxf 模块没有 `{node.attr}`{_suggest(node.attr, dir(probe))}")
+                kind = self.types.get(owner.id)
+                if kind and isinstance(node.ctx, ast.Load) and not hasattr(self.probes[kind], node.attr):
+                    self.error(node, f"`{owner.id}` ({kind}) 没有属性或方法 `{node.attr}`{_suggest(node.attr, dir(self.probes[kind]))}")
+            if self.api == "pyautocad" and owner.id == "acad" and node.attr not in PYAUTOCAD_ACAD_ATTRS:
+                self.error(node, f"`acad` 没有属性 `{node.attr}`{_suggest(node.attr, PYAUTOCAD_ACAD_ATTRS)}")
+        self.generic_visit(node)
+
+
+def _module_level_drawing(tree, types):
+    """返回模块顶层最后一个被赋值为 Drawing 的变量名"""
+    name = None
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign) and _infer_ezdxf_type(stmt.value, types) == "Drawing":
+            for target in stmt.targets:
+                if isinstance(target, ast.Name):
+                    name = target.id
+    return name
+
+
+def validate_code(code, api="ezdxf", predefined=None):
+    """
+    执行前的静态校验 (毫秒级)：
+    - 语法错误、禁止的阻塞/危险调用、不可用或禁止的模块；
+    - ezdxf：检查 ezdxf 模块、doc/msp/块 等对象上的属性与方法是否真实存在；
+    - pyautocad：检查 acad.model.Add* 方法名与参数个数、APoint 的参数个数；
+    - 自动修补：ezdxf 图纸赋给了其他变量名时，补上 `doc = <变量>` 交接语句。
+    predefined 为执行环境中预置的变量及其类型，例如增量模式下的 {"doc": "Drawing", "msp": "Modelspace"}。
+    返回 (是否通过, 修补后的代码, 给模型的错误说明, 自动修补说明列表)。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = (e.text or "").rstrip()
+        return False, code, f"语法错误 (第 {e.lineno} 行): {e.msg}\n    {line}", []
+
+    checker = _Checker(api, predefined or {})
+    checker.visit(tree)
+    if checker.errors:
+        message = "代码未通过执行前检查：\n" + "\n".join(checker.errors)
+        return False, code, message, []
+
+    fixes = []
+    if api == "ezdxf" and checker.probes and not predefined:
+        drawing_var = _module_level_drawing(tree, {})
+        if drawing_var and drawing_var != "doc":
+            code = f"{code.rstrip()}\n\n# 系统自动追加：交接图纸对象\ndoc = {drawing_var}\n"
+            fixes.append(f"已自动追加 `doc = {drawing_var}`")
+    return True, code, "", fixes
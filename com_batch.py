@@ -0,0 +1,376 @@
+import logging
+import weakref
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+POINT_TOLERANCE = 1e-9       # 判断两条直线首尾相接的坐标容差
+MIN_CHAIN_LENGTH = 2         # 至少这么多条首尾相接的直线才合并为多段线
+SCRIPT_COMMANDS = {"AddLine", "AddCircle", "AddPoint"}  # 脚本模式下可以改写为命令行的调用
+# 只读访问不会改变图纸，不需要通知观察者 (如 cad_mirror.ModelMirror) 重新同步
+READ_ONLY_NAMES = {
+    "app", "Application", "prompt", "Name", "Count", "ObjectName", "Handle", "Layer", "Length", "Area",
+    "Center", "Radius", "StartPoint", "EndPoint", "InsertionPoint", "TextString", "Coordinates",
+    "GetBoundingBox",
+}
+# 按句柄/ID 取已有图元：查询本身只读，返回的对象被修改时才通知观察者
+LOOKUP_NAMES = {"HandleToObject", "ObjectIdToObject"}
+DOCUMENT_NAMES = {"doc", "ActiveDocument"}
+
+
+def _coords(point):
+    """把 APoint / VARIANT / 序列统一为 (x, y, z) 浮点元组"""
+    if hasattr(point, "value"):  # win32com.client.VARIANT
+        point = point.value
+    values = [float(v) for v in point]
+    return tuple((values + [0.0, 0.0, 0.0])[:3])
+
+
+def _same_point(a, b):
+    return all(abs(p - q) <= POINT_TOLERANCE for p, q in zip(a, b))
+
+
+def _fmt(v):
+    return repr(round(v, 10))
+
+
+class _PendingEntity:
+    """
+    Add* 调用的占位返回值：
+    - 设置属性 (line.Layer = "墙") 会被记录下来，在图元真正创建后依次应用；
+    - 读取属性或调用方法 (line.Length、line.Rotate(...)) 会立即提交此前积压的调用，
+      然后转发给真实的 COM 对象，保证语义与逐个调用一致。
+    """
+
+    def __init__(self, batch, record):
+        object.__setattr__(self, "_batch", batch)
+        object.__setattr__(self, "_record", record)
+
+    def _resolve(self):
+        record = self._record
+        if record["real"] is None:
+            self._batch.flush()
+        if record["real"] is None:
+            raise RuntimeError(f"{record['method']} 的图元已被撤销 (批量提交失败或被丢弃)")
+        return record["real"]
+
+    def __getattr__(self, name):
+        real = self._resolve()
+        self._batch._passthrough(name)
+        attr = getattr(real, name)
+        if not callable(attr):
+            return attr
+        batch = self._batch
+
+        def call(*args, **kwargs):
+            # hatch.AppendOuterLoop(aDouble([line, arc])) 等方法的参数中可能还有其他占位对象
+            if _has_pending(args) or _has_pending(kwargs.values()):
+                batch.flush()
+            return attr(*_unwrap(args), **{k: _unwrap(v) for k, v in kwargs.items()})
+        return call
+
+    def __setattr__(self, name, value):
+        record = self._record
+        if record["real"] is not None:
+            self._batch._passthrough(f"{name}=")
+            setattr(record["real"], name, value)
+        else:
+            record["ops"].append((name, _unwrap(value)))
+
+    def __repr__(self):
+        state = "pending" if self._record["real"] is None else "created"
+        return f"<{self._record['method']} ({state})>"
+
+
+class _TrackedObject:
+    """
+    acad.doc.HandleToObject(...) 取到的已有图元：读取只读属性 (Layer、Center、GetBoundingBox...) 不影响镜像，
+    调用其他方法或设置属性 (Move、Delete、.Color = ...) 视为绕过代理的修改，通知观察者重新同步。
+    """
+
+    def __init__(self, batch, obj):
+        object.__setattr__(self, "_batch", batch)
+        object.__setattr__(self, "_obj", obj)
+
+    def __getattr__(self, name):
+        self._batch._passthrough(name)
+        return getattr(self._obj, name)
+
+    def __setattr__(self, name, value):
+        self._batch._passthrough(f"{name}=")
+        setattr(self._obj, name, _unwrap(value))
+
+    def __repr__(self):
+        return f"<tracked {self._obj!r}>"
+
+
+def _unwrap(value):
+    """参数中出现占位对象时替换为真实 COM 对象 (调用方需先保证已提交)"""
+    if isinstance(value, _PendingEntity):
+        return value._resolve()
+    if isinstance(value, _TrackedObject):
+        return value._obj
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+
+def _has_pending(values):
+    for v in values:
+        if isinstance(v, _PendingEntity) and v._record["real"] is None:
+            return True
+        if isinstance(v, (list, tuple)) and _has_pending(v):
+            return True
+    return False
+
+
+class _BatchingSpace:
+    """模型空间代理：Add* 与 InsertBlock 调用只做记录，其余访问先提交再转发"""
+
+    def __init__(self, batch, space):
+        self._batch = batch
+        self._space = space
+
+    def __getattr__(self, name):
+        if name.startswith("Add") or name == "InsertBlock":
+            def record_call(*args):
+                if _has_pending(args):
+                    self._batch.flush()
+                return self._batch.record(self._space, name, _unwrap(args))
+            return record_call
+        self._batch.flush()
+        self._batch._passthrough(name)
+        return getattr(self._space, name)
+
+
+class _BatchingBlocks:
+    """块表代理：Blocks.Add 定义的是块 (不是模型空间图元)，作为非模型写入告知观察者，不让镜像过期"""
+
+    def __init__(self, batch, blocks):
+        self._batch = batch
+        self._blocks = blocks
+
+    def Add(self, insertion_point, name):
+        block = self._blocks.Add(insertion_point, name)
+        self._batch._record_non_model("Blocks.Add", (name,))
+        return block
+
+    def __getattr__(self, name):
+        # Item / Count 以及块定义内部的读写都不涉及模型空间
+        return getattr(self._blocks, name)
+
+
+class _BatchingDocument:
+    """acad.doc 的代理：按句柄取图元与定义块不会让镜像过期，其余访问照旧转发并通知观察者"""
+
+    def __init__(self, batch, doc):
+        object.__setattr__(self, "_batch", batch)
+        object.__setattr__(self, "_doc", doc)
+
+    def __getattr__(self, name):
+        self._batch.flush()
+        attr = getattr(self._doc, name)
+        if name in LOOKUP_NAMES:
+            return lambda *args: _TrackedObject(self._batch, attr(*args))
+        if name == "Blocks":
+            return _BatchingBlocks(self._batch, attr)
+        self._batch._passthrough(name)
+        return attr
+
+    def __setattr__(self, name, value):
+        self._batch.flush()
+        self._batch._passthrough(f"{name}=")
+        setattr(self._doc, name, _unwrap(value))
+
+
+class BatchingAcad:
+    """
+    pyautocad.Autocad 的批量代理，放进 exec 的 local_scope 中代替原始的 acad：
+    生成的代码照常调用 acad.model.AddLine / AddCircle ...，调用先被记录，
+    在 flush() 时一次性提交，跨进程 COM 往返次数大幅减少：
+    1. 首尾相接、且返回值没有被代码引用的连续直线合并为一条轻量多段线 (一次调用)；
+    2. use_script=True (默认关闭) 时，未被引用的直线/圆/点改写为一条 SendCommand 命令脚本 (一次调用)；
+    3. 提交包在 StartUndoMark/EndUndoMark 中，用户一次撤销即可回退整张图；
+       提交中途出错时删除本次已创建的图元并重新抛出异常，不留下半张图。
+    脚本模式的限制：SendCommand 是异步的，脚本在本次 COM 调用返回之后才由 CAD 执行，
+    因此恢复 OSMODE 与结束撤销组 (UNDO 结束) 都写在脚本末尾，由 CAD 按顺序执行；
+    但脚本内部的错误不会反馈给调用方，脚本画出的图元也不在出错回退的范围内。
+    代码执行报错时调用 discard() 丢弃积压的调用，图纸保持不变。
+    observer (可选) 需提供 record_writes(writes) 与 mark_stale(reason)：
+    提交成功后收到本次写入的 (方法, 参数, 属性设置) 列表；代码绕过代理直接操作图纸时收到 mark_stale。
+    """
+
+    def __init__(self, acad, merge_lines=True, use_script=False, make_array=None, observer=None):
+        self._acad = acad
+        self._model = None
+        self.merge_lines = merge_lines
+        self.use_script = use_script
+        if make_array is None:
+            from pyautocad import aDouble
+            make_array = aDouble
+        self._make_array = make_array
+        self._pending = []
+        self._undo_closed_by_script = False
+        self.observer = observer
+        self.stats = {"recorded": 0, "com_calls": 0, "merged_lines": 0, "scripted": 0}
+
+    # ---------- 代理接口 ----------
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = _BatchingSpace(self, self._acad.model)
+        return self._model
+
+    def __getattr__(self, name):
+        # acad.doc / acad.app / acad.iter_objects 等都会读取图纸状态，先提交积压的调用
+        self.flush()
+        if name in DOCUMENT_NAMES:
+            return _BatchingDocument(self, getattr(self._acad, name))
+        self._passthrough(name)
+        return getattr(self._acad, name)
+
+    def _passthrough(self, name):
+        if self.observer is not None and name not in READ_ONLY_NAMES:
+            self.observer.mark_stale(name)
+
+    def _record_non_model(self, method, args):
+        """不涉及模型空间的写入 (块定义等)：立即告知观察者，观察者无需重新同步"""
+        if self.observer is not None:
+            self.observer.record_writes([(method, args, [])])
+
+    def record(self, space, method, args):
+        record = {"space": space, "method": method, "args": args, "ops": [], "real": None, "ref": None}
+        placeholder = _PendingEntity(self, record)
+        # 只保存弱引用：提交时引用已失效，说明代码没有保留返回值，可以安全地合并或改写
+        record["ref"] = weakref.ref(placeholder)
+        self._pending.append(record)
+        self.stats["recorded"] += 1
+        return placeholder
+
+    # ---------- 提交 ----------
+
+    def discard(self):
+        """丢弃尚未提交的调用 (生成的代码执行报错时使用)"""
+        if self._pending:
+            logger.info(f"Discarded {len(self._pending)} pending COM calls.")
+        self._pending = []
+
+    def flush(self):
+        """把积压的调用一次性提交到 CAD，返回本次实际发出的 COM 调用次数"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, []
+        created = []
+        writes = []
+        calls = 0
+        doc = self._acad.doc
+        doc.StartUndoMark()
+        # 脚本组总在最后提交，发送成功后由脚本自己结束撤销组 (见 _submit)
+        self._undo_closed_by_script = False
+        try:
+            for group in self._plan(pending):
+                calls += self._submit(group, created, writes)
+        except Exception:
+            # 提交中途失败：回退本次已创建的图元，保证整体提交要么全部生效、要么不生效
+            for obj in reversed(created):
+                try:
+                    obj.Delete()
+                except Exception:
+                    pass
+            for record in pending:
+                record["real"] = None
+            raise
+        finally:
+            if not self._undo_closed_by_script:
+                doc.EndUndoMark()
+        self.stats["com_calls"] += calls
+        if self.observer is not None:
+            self.observer.record_writes(writes)
+        logger.info(f"Flushed {len(pending)} recorded calls as {calls} COM calls.")
+        return calls
+
+    def _mergeable(self, record):
+        return record["ref"]() is None and not record["ops"]
+
+    def _plan(self, pending):
+        """把积压的调用分组：("chain", [直线...]) / ("script", [...]) / ("single", record)"""
+        groups = []
+        script = []
+        chain = []
+
+        def close_chain():
+            if len(chain) >= MIN_CHAIN_LENGTH:
+                groups.append(("chain", list(chain)))
+            else:
+                groups.extend(("single", r) for r in chain)
+            chain.clear()
+
+        for record in pending:
+            if self.merge_lines and record["method"] == "AddLine" and self._mergeable(record):
+                start, end = (_coords(p) for p in record["args"][:2])
+                if start[2] == 0 and end[2] == 0:
+                    if chain and not _same_point(_coords(chain[-1]["args"][1]), start):
+                        close_chain()
+                    chain.append(record)
+                    continue
+            close_chain()
+            if self.use_script and record["method"] in SCRIPT_COMMANDS and self._mergeable(record):
+                script.append(record)
+            else:
+                groups.append(("single", record))
+        close_chain()
+
+        # 脚本中的图元彼此独立、也没有被代码引用，放在最后统一发送不影响结果
+        if script:
+            groups.append(("script", script))
+        return groups
+
+    def _submit(self, group, created, writes):
+        kind, payload = group
+        if kind == "single":
+            record = payload
+            obj = getattr(record["space"], record["method"])(*record["args"])
+            record["real"] = obj
+            created.append(obj)
+            for name, value in record["ops"]:
+                setattr(obj, name, value)
+            writes.append((record["method"], record["args"], record["ops"]))
+            return 1 + len(record["ops"])
+
+        if kind == "chain":
+            points = [_coords(payload[0]["args"][0])] + [_coords(r["args"][1]) for r in payload]
+            closed = _same_point(points[0], points[-1])
+            if closed:
+                points = points[:-1]
+            flat = [v for x, y, _z in points for v in (x, y)]
+            polyline = payload[0]["space"].AddLightWeightPolyline(self._make_array(flat))
+            created.append(polyline)
+            calls = 1
+            if closed:
+                polyline.Closed = True
+                calls += 1
+            self.stats["merged_lines"] += len(payload)
+            writes.append(("AddLightWeightPolyline", (flat,), [("Closed", True)] if closed else []))
+            return calls
+
+        # kind == "script"
+        lines = []
+        for record in payload:
+            args = record["args"]
+            if record["method"] == "AddLine":
+                lines.append("_.LINE " + " ".join(",".join(map(_fmt, _coords(p))) for p in args[:2]) + " ")
+            elif record["method"] == "AddCircle":
+                lines.append("_.CIRCLE " + ",".join(map(_fmt, _coords(args[0]))) + " " + _fmt(float(args[1])))
+            else:
+                lines.append("_.POINT " + ",".join(map(_fmt, _coords(args[0]))))
+        doc = self._acad.doc
+        # 脚本按命令行输入执行，需要临时关闭对象捕捉，否则坐标会被吸附到附近的图元上。
+        # SendCommand 异步执行：关闭/恢复 OSMODE 与结束撤销组都放进脚本，保证在画图命令前后按顺序生效
+        osmode = int(doc.GetVariable("OSMODE"))
+        script = ["_.SETVAR OSMODE 0"] + lines + [f"_.SETVAR OSMODE {osmode}", "_.UNDO _E"]
+        doc.SendCommand("\n".join(script) + "\n")
+        self._undo_closed_by_script = True
+        self.stats["scripted"] += len(payload)
+        writes.extend((r["method"], r["args"], []) for r in payload)
+        return 2
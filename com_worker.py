@@ -0,0 +1,259 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+DEFAULT_JOB_TIMEOUT = 120      # 等待单个 COM 任务完成的超时 (秒)
+BACKENDS = ("autocad", "zwcad")
+
+
+class ComConnectionError(RuntimeError):
+    """无法连接到 CAD 软件 (软件未打开或 COM 服务不可用)"""
+
+
+class ComSessionBusy(RuntimeError):
+    """该会话上一个超时的任务仍在 CAD 中执行，结束前拒绝新任务 (否则旧任务稍后仍会画出重复或残缺的图形)"""
+
+
+# ================= COM 初始化 (非 Windows 上为空操作) =================
+
+def _co_initialize():
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    pythoncom.CoInitialize()
+
+
+def _co_uninitialize():
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    try:
+        pythoncom.CoUninitialize()
+    except Exception:
+        pass
+
+
+# ================= 连接工厂 =================
+
+class ZwcadApplication:
+    """
+    中望CAD 的连接对象，提供与 pyautocad.Autocad 相同的 app / doc / model 属性，
+    连接方式与 demo_zwcad_com.py 一致 (先附着已打开的实例，失败再启动)。
+    """
+
+    def __init__(self, prog_id="ZwCAD.Application"):
+        import win32com.client
+        try:
+            self.app = win32com.client.GetActiveObject(prog_id)
+        except Exception:
+            self.app = win32com.client.Dispatch(prog_id)
+        self.app.Visible = True
+
+    @property
+    def doc(self):
+        return self.app.ActiveDocument
+
+    @property
+    def model(self):
+        return self.app.ActiveDocument.ModelSpace
+
+
+def connect_autocad():
+    from pyautocad import Autocad
+    return Autocad(create_if_not_exists=True)
+
+
+def connect_zwcad():
+    return ZwcadApplication()
+
+
+def get_connect_factory(backend):
+    return {"autocad": connect_autocad, "zwcad": connect_zwcad}[backend]
+
+
+def scope_helpers(backend):
+    """生成代码中使用的 APoint / aDouble：AutoCAD 用 pyautocad 的实现，中望CAD 需要 VT_R8 数组的 VARIANT"""
+    if backend == "autocad":
+        from pyautocad import APoint, aDouble
+        return {"APoint": APoint, "aDouble": aDouble}
+
+    import pythoncom
+    import win32com.client
+
+    def APoint(x, y, z=0):
+        return win32com.client.VARIANT(pythoncom.VT_ARRAY | pythoncom.VT_R8, (x, y, z))
+
+    def aDouble(*values):
+        if len(values) == 1 and isinstance(values[0], (list, tuple)):
+            values = values[0]
+        return win32com.client.VARIANT(pythoncom.VT_ARRAY | pythoncom.VT_R8, tuple(values))
+
+    return {"APoint": APoint, "aDouble": aDouble}
+
+
+# ================= 常驻 COM 线程 =================
+
+class ComWorker:
+    """
+    持有 CAD COM 连接的常驻 STA 线程：
+    - 线程启动时 CoInitialize 一次，连接建立后一直复用，只有连接失效时才重连；
+    - 所有 COM 调用都在这一个线程中执行，任务通过 submit() 投递，返回 Future；
+    - 每个会话一个队列，线程按会话轮转取任务，某个会话连续提交多个任务时不会饿死其他会话；
+    - run() 超时时，仍在排队的任务被取消；已在执行的任务无法中断，该会话被标记为忙碌，
+      任务结束前 submit() 抛出 ComSessionBusy，调用方不应再重试。
+    connect 为返回 acad 风格对象 (有 app / doc / model 属性) 的工厂函数，测试时可注入假对象。
+    """
+
+    def __init__(self, connect=connect_autocad, name="cad-com-worker"):
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # session_id → deque[(fn, future, 提交时间)]
+        self._busy = {}               # session_id → 超时后仍在执行的任务的 Future
+        self._closed = False
+        self._acad = None
+        self.doc_name = None
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    # ---------- 调用方接口 ----------
+
+    def submit(self, fn, session_id="default"):
+        """
+        投递任务 fn(acad)，返回 Future；
+        其结果为 (fn 的返回值, info)，info 包含 queue_wait、reconnected 以及重连时的 com_connect 耗时。
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("ComWorker 已关闭")
+            if session_id in self._busy:
+                raise ComSessionBusy("上一个超时的 CAD 任务仍在执行，请等待其结束后再试")
+            self._queues.setdefault(session_id, deque()).append((fn, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def run(self, fn, session_id="default", timeout=DEFAULT_JOB_TIMEOUT):
+        """
+        同步执行：等待任务完成并返回 (结果, info)；超时抛出 concurrent.futures.TimeoutError。
+        超时时仍在排队的任务会被取消 (不会再执行)，已开始执行的任务使该会话进入忙碌状态 (见 busy)。
+        """
+        future = self.submit(fn, session_id)
+        try:
+            return future.result(timeout)
+        except FuturesTimeout:
+            self._abandon(future, session_id)
+            raise
+
+    def busy(self, session_id="default"):
+        """该会话是否有超时后仍在执行的任务"""
+        with self._cond:
+            return session_id in self._busy
+
+    def _abandon(self, future, session_id):
+        if future.cancel():
+            # 还在队列中：移出队列，保证它不会在调用方重试之后才执行
+            with self._cond:
+                jobs = self._queues.get(session_id)
+                if jobs is not None:
+                    for job in list(jobs):
+                        if job[1] is future:
+                            jobs.remove(job)
+                    if not jobs:
+                        del self._queues[session_id]
+            logger.warning(f"COM job for session {session_id} timed out in queue and was cancelled.")
+            return
+        with self._cond:
+            self._busy[session_id] = future
+        logger.warning(f"COM job for session {session_id} timed out while running; session blocked until it finishes.")
+
+        def release(_f):
+            with self._cond:
+                if self._busy.get(session_id) is future:
+                    del self._busy[session_id]
+            logger.info(f"Timed-out COM job for session {session_id} finished; session released.")
+        future.add_done_callback(release)
+
+    def pending(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._closed = True
+            for jobs in self._queues.values():
+                for _fn, future, _t in jobs:
+                    future.cancel()
+            self._queues.clear()
+            self._cond.notify_all()
+        if wait:
+            self._thread.join(timeout=5)
+
+    # ---------- 线程内部 ----------
+
+    def _next_job(self):
+        with self._cond:
+            while not self._closed and not self._queues:
+                self._cond.wait()
+            if self._closed:
+                return None
+            session_id, jobs = next(iter(self._queues.items()))
+            job = jobs.popleft()
+            # 轮转：本会话还有任务就排到最后，下一次先服务其他会话
+            del self._queues[session_id]
+            if jobs:
+                self._queues[session_id] = jobs
+            return job
+
+    def _ensure_connection(self, info):
+        if self._acad is not None:
+            try:
+                # 一次轻量的属性读取即可判断连接是否存活 (CAD 被关闭后会抛出 RPC 错误)
+                self.doc_name = self._acad.doc.Name
+                return self._acad
+            except Exception as e:
+                logger.warning(f"COM connection lost ({e}), reconnecting...")
+                self._acad = None
+
+        logger.info("Connecting to CAD...")
+        t0 = time.perf_counter()
+        try:
+            acad = self._connect()
+            self.doc_name = acad.doc.Name
+        except Exception as e:
+            logger.error(f"Connection error: {e}")
+            raise ComConnectionError(str(e)) from e
+        info["com_connect"] = time.perf_counter() - t0
+        info["reconnected"] = True
+        self._acad = acad
+        logger.info(f"Connected to: {self.doc_name}")
+        return acad
+
+    def _loop(self):
+        _co_initialize()
+        try:
+            while True:
+                job = self._next_job()
+                if job is None:
+                    break
+                fn, future, submitted = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                info = {"queue_wait": time.perf_counter() - submitted, "reconnected": False}
+                try:
+                    acad = self._ensure_connection(info)
+                    value = fn(acad)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result((value, info))
+        finally:
+            # COM 对象必须在本线程内释放
+            self._acad = None
+            _co_uninitialize()
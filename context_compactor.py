@@ -0,0 +1,148 @@
+import re
+import logging
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+DEFAULT_TOKEN_BUDGET = 6000      # 发送给模型的历史上下文 token 上限
+TRACEBACK_KEEP_FRAMES = 2        # 报错信息中保留的调用帧数 (优先保留生成代码 <string> 中的帧)
+SUMMARY_MAX_CHARS = 120          # 旧消息折叠后摘要的最大长度
+# 重试时追加的报错反馈 (cad_pipeline / app2.py) 的开头：它们是程序生成的，不是用户的真实请求
+ERROR_FEEDBACK_PREFIXES = ("执行代码报错", "代码执行出错")
+
+CODE_BLOCK_PATTERN = re.compile(r"```python\s*(.*?)\s*```", re.DOTALL)
+TRACEBACK_HEADER = "Traceback (most recent call last):"
+_CJK_PATTERN = re.compile(r"[⺀-鿿가-힯＀-￯]")
+_CALL_PATTERN = re.compile(r"\.(add_\w+|Add\w+|saveas|new)\s*\(")
+
+
+def count_tokens(text):
+    """
+    粗略估计 token 数 (不依赖分词器)：
+    中日韩字符约 1 token/字，其余文本约 4 字符/token。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_message_tokens(messages, tokenizer=count_tokens):
+    # 每条消息额外计入少量 role/分隔符开销
+    return sum(tokenizer(m.get("content") or "") + 4 for m in messages)
+
+
+def truncate_traceback(text, keep_frames=TRACEBACK_KEEP_FRAMES):
+    """
+    截断 Python 报错信息：只保留生成代码 (File "<string>") 中的帧，
+    没有这类帧时保留最后 keep_frames 帧，再加上最终的异常行。
+    """
+    start = text.find(TRACEBACK_HEADER)
+    if start < 0:
+        return text
+
+    prefix = text[:start]
+    lines = text[start:].splitlines()[1:]
+
+    frames = []
+    tail = []
+    for line in lines:
+        if line.startswith("  File "):
+            frames.append([line])
+        elif line.startswith("    ") and frames and not tail:
+            frames[-1].append(line)
+        else:
+            tail.append(line)
+
+    user_frames = [f for f in frames if '"<string>"' in f[0]]
+    kept = (user_frames or frames)[-keep_frames:]
+    dropped = len(frames) - len(kept)
+
+    out = [TRACEBACK_HEADER]
+    if dropped > 0:
+        out.append(f"  ... (省略 {dropped} 个无关调用帧)")
+    for frame in kept:
+        out.extend(frame)
+    out.extend(line for line in tail if line.strip())
+    return prefix + "\n".join(out)
+
+
+def summarize_code(code):
+    """把一段旧代码折叠为一行摘要：行数 + 主要的绘图调用"""
+    calls = {}
+    for name in _CALL_PATTERN.findall(code):
+        calls[name] = calls.get(name, 0) + 1
+    top = ", ".join(f"{name}×{n}" for name, n in sorted(calls.items(), key=lambda x: -x[1])[:6])
+    n_lines = code.count("\n") + 1
+    return f"[已省略早前的代码：{n_lines} 行{'，主要调用 ' + top if top else ''}]"
+
+
+def is_error_feedback(message):
+    return message["role"] == "user" and (message.get("content") or "").startswith(ERROR_FEEDBACK_PREFIXES)
+
+
+def _has_code(message):
+    return message["role"] == "assistant" and bool(CODE_BLOCK_PATTERN.search(message.get("content") or ""))
+
+
+def _summarize_text(text):
+    text = " ".join(text.split())
+    if len(text) <= SUMMARY_MAX_CHARS:
+        return text
+    return text[:SUMMARY_MAX_CHARS] + "…"
+
+
+class ContextCompactor:
+    """
+    按 token 预算压缩发送给模型的历史消息：
+    1. 所有报错信息截断到关键调用帧；
+    2. 只有最近一份执行成功的代码 (以及当前报错所针对的那次尝试) 保持原文，其余代码块折叠为摘要；
+    3. 仍然超出预算时，从最早的轮次开始把整条消息折叠为简短摘要；
+    首条消息 (包含隐藏指令)、最后一条消息与最近一条真实的用户请求始终保留原文。
+    """
+
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, tokenizer=count_tokens):
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer
+
+    def compact(self, api_messages):
+        """返回 (压缩后的消息列表, 统计信息)，不修改传入的列表"""
+        before = count_message_tokens(api_messages, self.tokenizer)
+        messages = [m.copy() for m in api_messages]
+
+        # 1. 截断报错信息
+        for m in messages:
+            if m["role"] == "user" and TRACEBACK_HEADER in (m.get("content") or ""):
+                m["content"] = truncate_traceback(m["content"])
+
+        # 2. 只保留最近一份可用代码的原文：后面紧跟报错反馈的是失败的尝试，不算
+        last = len(messages) - 1
+        latest_working_idx = max(
+            (i for i, m in enumerate(messages) if _has_code(m) and not (i < last and is_error_feedback(messages[i + 1]))),
+            default=-1,
+        )
+        # 正在重试时，最后一条报错针对的是上一次尝试的代码，模型需要看到原文才能修复
+        failed_attempt_idx = last - 1 if last >= 1 and is_error_feedback(messages[last]) and _has_code(messages[last - 1]) else -1
+        keep_code = {latest_working_idx, failed_attempt_idx}
+        for i, m in enumerate(messages):
+            if i not in keep_code and m["role"] == "assistant":
+                m["content"] = CODE_BLOCK_PATTERN.sub(lambda mt: summarize_code(mt.group(1)), m.get("content") or "")
+
+        # 3. 超出预算时从最早的轮次开始折叠
+        latest_request_idx = max(
+            (i for i, m in enumerate(messages) if m["role"] == "user" and not is_error_feedback(m)), default=-1)
+        protected = {0, last, latest_request_idx} | keep_code
+        for i, m in enumerate(messages):
+            if count_message_tokens(messages, self.tokenizer) <= self.token_budget:
+                break
+            if i in protected:
+                continue
+            summary = f"[早前对话摘要] {_summarize_text(m.get('content') or '')}"
+            if self.tokenizer(summary) < self.tokenizer(m.get("content") or ""):
+                m["content"] = summary
+
+        after = count_message_tokens(messages, self.tokenizer)
+        stats = {"tokens_before": before, "tokens_after": after, "tokens_saved": before - after}
+        if stats["tokens_saved"] > 0:
+            logger.info(f"Context compacted: {before} -> {after} tokens (saved {stats['tokens_saved']})")
+        return messages, stats
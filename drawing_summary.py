@@ -0,0 +1,224 @@
+import logging
+from itertools import islice
+from collections import Counter
+
+from context_compactor import count_tokens, summarize_code, CODE_BLOCK_PATTERN
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+DIGEST_TOKEN_BUDGET = 600      # 图纸概况的 token 上限 (与图元数量无关)
+DIGEST_MAX_ITEMS = 12          # 各分项 (图层、块参照、文字...) 最多列出的条数，超出预算时逐步减半
+DIGEST_HEADER = "--- 当前图纸概况 (系统根据图纸实际内容生成) ---"
+LABEL_MAX_CHARS = 40           # 文字内容在概况中的最大长度
+
+
+def _fmt(v):
+    return f"{v:.6g}"
+
+
+def _fmt_box(box):
+    return "(" + ", ".join(_fmt(v) for v in box) + ")"
+
+
+class DrawingSummary:
+    """
+    图纸内容的增量摘要：按图元 key (句柄或本地编号) 保存一条精简记录，
+    同时维护按类型、图层、块名、半径的计数，add()/remove() 都是 O(1)，
+    digest() 只做 top-k 选择，因此十万级图元的图纸也能在每轮请求前快速生成固定大小的概况。
+    记录字段：type、layer、bbox (xmin, ymin, xmax, ymax)、label (文字内容/块名)、
+    measure (圆和圆弧的半径、尺寸标注的测量值)、handle。
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._types = Counter()
+        self._layers = Counter()
+        self._blocks = Counter()
+        self._radii = Counter()
+        self._labeled = {}          # 有文字/块名的记录，按加入顺序
+        self._dimensions = {}       # 尺寸标注的测量值
+        self._extents = None
+        self._extents_dirty = False
+
+    def __len__(self):
+        return len(self._records)
+
+    # ---------- 增量维护 ----------
+
+    def add(self, key, dxftype, layer="0", bbox=None, label=None, measure=None, handle=None):
+        if key in self._records:
+            self.remove(key)
+        record = (dxftype, layer, bbox, label, measure, handle)
+        self._records[key] = record
+        self._types[dxftype] += 1
+        self._layers[layer] += 1
+        if dxftype == "INSERT" and label:
+            self._blocks[label] += 1
+        if label and dxftype != "DIMENSION":
+            self._labeled[key] = record
+        if measure is not None:
+            if dxftype == "DIMENSION":
+                self._dimensions[key] = measure
+            else:
+                self._radii[round(measure, 6)] += 1
+        if bbox is not None and not self._extents_dirty:
+            e = self._extents
+            self._extents = bbox if e is None else (
+                min(e[0], bbox[0]), min(e[1], bbox[1]), max(e[2], bbox[2]), max(e[3], bbox[3]))
+
+    def remove(self, key):
+        record = self._records.pop(key, None)
+        if record is None:
+            return
+        dxftype, layer, bbox, label, measure, _handle = record
+        for counter, value in ((self._types, dxftype), (self._layers, layer)):
+            counter[value] -= 1
+            if counter[value] <= 0:
+                del counter[value]
+        if dxftype == "INSERT" and label:
+            self._blocks[label] -= 1
+            if self._blocks[label] <= 0:
+                del self._blocks[label]
+        self._labeled.pop(key, None)
+        self._dimensions.pop(key, None)
+        if measure is not None and dxftype != "DIMENSION":
+            r = round(measure, 6)
+            self._radii[r] -= 1
+            if self._radii[r] <= 0:
+                del self._radii[r]
+        if bbox is not None:
+            # 删除可能使范围缩小，下次读取时再重新计算
+            self._extents_dirty = True
+
+    def extents(self):
+        if self._extents_dirty:
+            boxes = [r[2] for r in self._records.values() if r[2] is not None]
+            self._extents = (
+                min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+            ) if boxes else None
+            self._extents_dirty = False
+        return self._extents
+
+    # ---------- ezdxf 图纸 ----------
+
+    def add_entity(self, entity, bbox=None):
+        """从 ezdxf 图元加入一条记录 (bbox 可由调用方传入已算好的值，否则现算)"""
+        if bbox is None:
+            bbox = entity_bbox(entity)
+        dxftype = entity.dxftype()
+        label = measure = None
+        try:
+            if dxftype == "INSERT":
+                label = entity.dxf.name
+            elif dxftype == "TEXT":
+                label = entity.dxf.text
+            elif dxftype == "MTEXT":
+                label = entity.plain_text()
+            elif dxftype in ("CIRCLE", "ARC"):
+                measure = entity.dxf.radius
+            elif dxftype == "DIMENSION":
+                measure = entity.get_measurement()
+                if not isinstance(measure, (int, float)):
+                    measure = None
+        except Exception:
+            pass
+        self.add(entity.dxf.handle, dxftype, entity.dxf.get("layer", "0"), bbox, label, measure, entity.dxf.handle)
+
+    def update_from_doc(self, doc, added=(), modified=(), deleted=(), bboxes=None):
+        """按一轮执行的变更集增量更新 (handle 集合)；bboxes 为调用方已有的 handle → 包围盒缓存"""
+        for handle in deleted:
+            self.remove(handle)
+        for handle in list(added) + list(modified):
+            entity = doc.entitydb.get(handle)
+            if entity is not None and entity.is_alive:
+                self.add_entity(entity, (bboxes or {}).get(handle))
+
+    @classmethod
+    def from_doc(cls, doc, bboxes=None):
+        summary = cls()
+        for entity in doc.modelspace():
+            summary.add_entity(entity, (bboxes or {}).get(entity.dxf.handle))
+        return summary
+
+    # ---------- 输出 ----------
+
+    def _render(self, max_items, title):
+        lines = [DIGEST_HEADER]
+        n = len(self._records)
+        if n == 0:
+            lines.append(f"{title}模型空间为空。")
+            return "\n".join(lines)
+        ext = self.extents()
+        size = f"，尺寸 {_fmt(ext[2] - ext[0])} × {_fmt(ext[3] - ext[1])}" if ext else ""
+        lines.append(f"{title}共 {n} 个图元" + (f"，范围 {_fmt_box(ext)}{size}" if ext else "") + "。")
+
+        def counted(name, counter, fmt=str):
+            if not counter or max_items <= 0:
+                return
+            top = counter.most_common(max_items)
+            rest = len(counter) - len(top)
+            lines.append(f"{name}：" + "，".join(f"{fmt(k)}×{c}" for k, c in top) + (f"，…另有 {rest} 种" if rest > 0 else ""))
+
+        counted("图元类型", self._types)
+        counted("图层", self._layers)
+        counted("块参照", self._blocks)
+        counted("圆/圆弧半径", self._radii, lambda r: f"R{_fmt(r)}")
+        if self._dimensions and max_items > 0:
+            values = list(islice(self._dimensions.values(), max_items))
+            lines.append("尺寸标注：" + "，".join(_fmt(v) for v in values)
+                         + (f"，…共 {len(self._dimensions)} 个" if len(self._dimensions) > len(values) else ""))
+        if self._labeled and max_items > 0:
+            lines.append("文字与块参照：")
+            for key, (dxftype, layer, bbox, label, _measure, handle) in islice(self._labeled.items(), max_items):
+                text = label if len(label) <= LABEL_MAX_CHARS else label[:LABEL_MAX_CHARS] + "…"
+                where = f" @ {_fmt_box(bbox)}" if bbox else ""
+                ref = f" handle={handle}" if handle else ""
+                lines.append(f"- {dxftype} \"{text}\" layer={layer}{ref}{where}")
+            if len(self._labeled) > max_items:
+                lines.append(f"- …另有 {len(self._labeled) - max_items} 条")
+        return "\n".join(lines)
+
+    def digest(self, token_budget=DIGEST_TOKEN_BUDGET, title="当前图纸"):
+        """生成结构化的图纸概况文本，保证不超过 token_budget (超出时逐步减少各分项的条数)"""
+        max_items = DIGEST_MAX_ITEMS
+        text = self._render(max_items, title)
+        while count_tokens(text) > token_budget and max_items > 0:
+            max_items //= 2
+            text = self._render(max_items, title)
+        if count_tokens(text) > token_budget:
+            # 只剩总览行仍超出 (预算设得过小)：按字符截断
+            text = text[:token_budget]
+        return text
+
+
+def entity_bbox(entity):
+    from ezdxf import bbox
+
+    box = bbox.extents([entity], fast=True)
+    if not box.has_data:
+        return None
+    return (box.extmin.x, box.extmin.y, box.extmax.x, box.extmax.y)
+
+
+def inject_digest(api_messages, digest, keep_latest_code=True):
+    """
+    用图纸概况代替历史代码：助手消息中的代码块折叠为一行摘要，概况附加到最后一条用户消息。
+    keep_latest_code=True 时保留最近一份代码原文 (整图重新生成的模式需要在它的基础上修改)。
+    返回新的消息列表，不修改传入的列表。
+    """
+    messages = [m.copy() for m in api_messages]
+    latest_code_idx = -1
+    if keep_latest_code:
+        latest_code_idx = max(
+            (i for i, m in enumerate(messages) if m["role"] == "assistant" and CODE_BLOCK_PATTERN.search(m.get("content") or "")),
+            default=-1,
+        )
+    for i, m in enumerate(messages):
+        if m["role"] == "assistant" and i != latest_code_idx:
+            m["content"] = CODE_BLOCK_PATTERN.sub(lambda mt: summarize_code(mt.group(1)), m.get("content") or "")
+    for m in reversed(messages):
+        if m["role"] == "user":
+            m["content"] = f"{m['content']}\n\n{digest}"
+            break
+    return messages
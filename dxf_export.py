@@ -0,0 +1,178 @@
+import io
+import os
+import gzip
+import zipfile
+import logging
+import tempfile
+
+import ezdxf
+
+from cad_render import serialize_doc, load_doc_from_bytes
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+DEFAULT_FILE_STEM = "drawing"
+COMPRESSIONS = (None, "gzip", "zip")
+# 精简表时始终保留的条目 (DXF 规范要求，或 AutoCAD 打开图纸时依赖)
+REQUIRED_LINETYPES = {"byblock", "bylayer", "continuous"}
+REQUIRED_STYLES = {"standard"}
+REQUIRED_DIMSTYLES = {"standard"}
+BINARY_SENTINEL = b"AutoCAD Binary DXF\r\n\x1a\x00"
+MIME_TYPES = {None: "application/dxf", "gzip": "application/gzip", "zip": "application/zip"}
+
+
+# ================= 精简表 =================
+
+def used_table_names(doc):
+    """
+    收集图纸中实际引用到的线型、文字样式与标注样式 (小写名称)：
+    遍历全部图元 (模型空间、图纸空间与块定义) 和图层、标注样式表项的名称/句柄引用，
+    以及 XDATA 中的句柄 (标注的样式覆盖以 1005 句柄引用文字样式与线型)。
+    """
+    used = {"linetypes": set(REQUIRED_LINETYPES), "styles": set(REQUIRED_STYLES), "dimstyles": set(REQUIRED_DIMSTYLES)}
+    xdata_handles = set()
+    for entity in doc.entitydb.values():
+        if not entity.is_alive:
+            continue
+        dxf = entity.dxf
+        if dxf.hasattr("linetype"):
+            used["linetypes"].add(dxf.linetype.lower())
+        if entity.dxftype() in ("TEXT", "MTEXT", "ATTRIB", "ATTDEF") and dxf.hasattr("style"):
+            used["styles"].add(dxf.style.lower())
+        if dxf.hasattr("dimstyle"):
+            used["dimstyles"].add(dxf.dimstyle.lower())
+        if entity.xdata is not None:
+            for appid in list(entity.xdata.data):
+                xdata_handles.update(tag.value for tag in entity.get_xdata(appid) if tag.code == 1005)
+
+    # 保留下来的标注样式所引用的文字样式与线型：ezdxf 以名称保存 (dimtxsty 等)，句柄属性只在个别文件中出现
+    for dimstyle in doc.dimstyles:
+        if dimstyle.dxf.name.lower() not in used["dimstyles"]:
+            continue
+        dxf = dimstyle.dxf
+        if dxf.hasattr("dimtxsty"):
+            used["styles"].add(dxf.dimtxsty.lower())
+        for key in ("dimltype", "dimltex1", "dimltex2"):
+            if dxf.hasattr(key):
+                used["linetypes"].add(dxf.get(key).lower())
+        for key in ("dimtxsty_handle", "dimltype_handle", "dimltex1_handle", "dimltex2_handle"):
+            if dxf.hasattr(key):
+                xdata_handles.add(dxf.get(key))
+
+    for handle in xdata_handles:
+        entity = doc.entitydb.get(handle)
+        if entity is None or not entity.is_alive:
+            continue
+        if entity.dxftype() == "LTYPE":
+            used["linetypes"].add(entity.dxf.name.lower())
+        elif entity.dxftype() == "STYLE":
+            used["styles"].add(entity.dxf.name.lower())
+    return used
+
+
+def strip_unused_tables(doc):
+    """
+    删除未被引用的线型、文字样式与标注样式 (ezdxf.new(setup=True) 预置的那一大批)，就地修改 doc。
+    形文件样式 (复杂线型引用的 .shx) 一律保留。返回各表删除的条目数。
+    """
+    used = used_table_names(doc)
+    removed = {}
+    for key, table in (("dimstyles", doc.dimstyles), ("linetypes", doc.linetypes), ("styles", doc.styles)):
+        names = []
+        for entry in table:
+            name = entry.dxf.name
+            if name.lower() in used[key]:
+                continue
+            if key == "styles" and entry.dxf.get("flags", 0) & 1:
+                continue
+            names.append(name)
+        for name in names:
+            table.remove(name)
+        removed[key] = len(names)
+    return removed
+
+
+# ================= 导出 =================
+
+def write_dxf(doc, binary=False):
+    """序列化为 DXF 字节串：ASCII (与 cad_render.serialize_doc 相同) 或二进制 DXF"""
+    if not binary:
+        return serialize_doc(doc)
+    stream = io.BytesIO()
+    doc.write(stream, fmt="bin")
+    return stream.getvalue()
+
+
+def compress(data, compression, inner_name):
+    """gzip：单文件压缩；zip：压缩包中放一个名为 inner_name 的 DXF"""
+    if compression is None:
+        return data
+    if compression == "gzip":
+        # mtime 固定为 0：同一张图纸的压缩结果逐字节相同
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == "zip":
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            zf.writestr(inner_name, data)
+        return buffer.getvalue()
+    raise ValueError(f"compression 必须是 {COMPRESSIONS} 之一")
+
+
+def download_name(binary=False, compression=None, file_stem=DEFAULT_FILE_STEM):
+    """下载文件名与 MIME 类型：drawing.dxf / drawing.dxf.gz / drawing.zip (二进制 DXF 的扩展名同样是 .dxf)"""
+    name = f"{file_stem}.dxf"
+    if compression == "gzip":
+        name += ".gz"
+    elif compression == "zip":
+        name = f"{file_stem}.zip"
+    return name, MIME_TYPES[compression]
+
+
+def export_doc(doc, binary=False, compression=None, minimal=False, file_stem=DEFAULT_FILE_STEM):
+    """
+    按输出选项导出图纸，返回 (字节串, 文件名, MIME 类型)。
+    minimal=True 时先删除未引用的样式与线型 (就地修改 doc，需要保留原图纸时请传入副本)。
+    """
+    if minimal:
+        removed = strip_unused_tables(doc)
+        logger.info(f"Stripped unused table entries: {removed}")
+    data = write_dxf(doc, binary)
+    return (compress(data, compression, f"{file_stem}.dxf"),) + download_name(binary, compression, file_stem)
+
+
+def export_dxf_bytes(dxf_bytes, binary=False, compression=None, minimal=False, file_stem=DEFAULT_FILE_STEM):
+    """
+    由流水线产出的 ASCII DXF 字节串得到下载内容 (全程在内存中)：
+    只压缩时直接压缩原字节串，需要二进制或精简表时才重新解析图纸。
+    """
+    if not binary and not minimal:
+        return (compress(dxf_bytes, compression, f"{file_stem}.dxf"),) + download_name(binary, compression, file_stem)
+    return export_doc(load_doc_from_bytes(dxf_bytes), binary, compression, minimal, file_stem)
+
+
+def decompress(data):
+    """按文件头识别 gzip / zip 并解压 (zip 取其中第一个 .dxf)，其余原样返回"""
+    if data[:2] == b"\x1f\x8b":
+        return gzip.decompress(data)
+    if data[:4] == b"PK\x03\x04":
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            name = next((n for n in zf.namelist() if n.lower().endswith(".dxf")), zf.namelist()[0])
+            return zf.read(name)
+    return data
+
+
+def read_dxf_bytes(data):
+    """读取任意一种导出格式 (ASCII / 二进制，可压缩) 的字节串，返回图纸对象"""
+    data = decompress(data)
+    if not data.startswith(BINARY_SENTINEL):
+        return load_doc_from_bytes(data)
+    # ezdxf 从文件读取二进制 DXF：写入临时文件后读取
+    fd, path = tempfile.mkstemp(suffix=".dxf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return ezdxf.readfile(path)
+    finally:
+        os.remove(path)
+
@@ -0,0 +1,686 @@
+"""
+pyautocad 接口 (acad / APoint / aDouble) 的离线替身，所有绘图调用写入内存中的 ezdxf 图纸。
+
+app2.py 在连接真实 CAD 之前先用它试运行生成的代码 (毫秒级)：
+参数个数/类型错误、方法名错误、数学错误等在这里就会暴露，不会在 CAD 里留下半张图；
+通过后还能顺便渲染一张预览图。也可以作为 com_worker.ComWorker 的假连接用于测试。
+替身无法模拟的功能会抛出 DryRunUnsupported，调用方应据此跳过试运行、直接交给真实 CAD。
+替身从空图纸开始，查找真实图纸中已有的图层/块/图元时无法给出答案：这类查找会被记录下来，
+代码因这类查找而失败时同样视为"无法模拟"，而不是代码错误。
+"""
+import io
+import math
+import array
+import logging
+import contextlib
+import traceback
+
+import ezdxf
+from ezdxf.math import Matrix44
+
+from code_validator import ACTIVEX_MODEL_METHODS
+
+logger = logging.getLogger("CAD_Agent")
+
+
+class DryRunUnsupported(BaseException):
+    """
+    试运行替身没有实现的 ActiveX 功能 (不代表代码有错)。
+    继承 BaseException：生成的代码常用 try/except Exception 兜底，不能把它吞掉。
+    """
+
+
+# ================= APoint / aDouble =================
+
+class APoint(array.array):
+    """与 pyautocad.APoint 一致：三个 double 的数组，支持 x/y/z 属性与向量运算"""
+
+    def __new__(cls, x_or_seq=0.0, y=0.0, z=0.0):
+        if isinstance(x_or_seq, (array.array, list, tuple)):
+            values = list(x_or_seq)
+            if len(values) == 2:
+                values.append(0.0)
+            if len(values) != 3:
+                raise TypeError(f"APoint 需要 2 或 3 个坐标，实际为 {len(values)} 个")
+        else:
+            values = [x_or_seq, y, z]
+        return super().__new__(cls, "d", [float(v) for v in values])
+
+    x = property(lambda self: self[0], lambda self, v: self.__setitem__(0, v))
+    y = property(lambda self: self[1], lambda self, v: self.__setitem__(1, v))
+    z = property(lambda self: self[2], lambda self, v: self.__setitem__(2, v))
+
+    def _other(self, other):
+        return other if isinstance(other, (array.array, list, tuple)) else (other, other, other)
+
+    def __add__(self, other):
+        o = self._other(other)
+        return APoint(self[0] + o[0], self[1] + o[1], self[2] + o[2])
+
+    def __sub__(self, other):
+        o = self._other(other)
+        return APoint(self[0] - o[0], self[1] - o[1], self[2] - o[2])
+
+    def __mul__(self, other):
+        o = self._other(other)
+        return APoint(self[0] * o[0], self[1] * o[1], self[2] * o[2])
+
+    def __truediv__(self, other):
+        o = self._other(other)
+        return APoint(self[0] / o[0], self[1] / o[1], self[2] / o[2])
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return APoint(-self[0], -self[1], -self[2])
+
+    def distance_to(self, other):
+        return math.dist(self, _point(other))
+
+    def __repr__(self):
+        return f"APoint({self[0]:.2f}, {self[1]:.2f}, {self[2]:.2f})"
+
+    __str__ = __repr__
+
+
+def aDouble(*seq):
+    """与 pyautocad.aDouble 一致：接受多个数值或一个序列，返回 double 数组"""
+    if len(seq) == 1 and isinstance(seq[0], (list, tuple, array.array)):
+        seq = seq[0]
+    return tuple(float(v) for v in seq)
+
+
+def _point(value, name="点"):
+    """ActiveX 要求点为 3 个 double 的数组，其余输入在真实 CAD 中同样会报类型不匹配"""
+    try:
+        values = [float(v) for v in value]
+    except TypeError:
+        raise TypeError(f"{name}必须是 APoint(x, y[, z])，实际传入了 {type(value).__name__}") from None
+    if len(values) != 3:
+        raise TypeError(f"{name}必须包含 3 个坐标 (请使用 APoint)，实际为 {len(values)} 个")
+    return tuple(values)
+
+
+def _flat(value, stride, minimum):
+    values = [float(v) for v in value]
+    if len(values) % stride or len(values) < minimum * stride:
+        raise ValueError(f"坐标数组长度必须是 {stride} 的倍数且至少 {minimum} 个顶点，实际为 {len(values)} 个数")
+    return [tuple(values[i:i + stride]) for i in range(0, len(values), stride)]
+
+
+def _positive(value, name):
+    value = float(value)
+    if value <= 0:
+        raise ValueError(f"{name}必须大于 0，实际为 {value}")
+    return value
+
+
+# ================= 图元 =================
+
+_OBJECT_NAMES = {
+    "LINE": "AcDbLine", "CIRCLE": "AcDbCircle", "ARC": "AcDbArc", "TEXT": "AcDbText",
+    "MTEXT": "AcDbMText", "POINT": "AcDbPoint", "LWPOLYLINE": "AcDbPolyline",
+    "POLYLINE": "AcDb2dPolyline", "ELLIPSE": "AcDbEllipse", "SPLINE": "AcDbSpline",
+    "INSERT": "AcDbBlockReference", "HATCH": "AcDbHatch", "SOLID": "AcDbTrace",
+    "XLINE": "AcDbXline", "RAY": "AcDbRay", "DIMENSION": "AcDbRotatedDimension",
+}
+
+
+def _lw_points(e):
+    return [(p[0], p[1]) for p in e.get_points("xy")]
+
+
+def _polyline_length(points, closed):
+    pts = points + points[:1] if closed else points
+    return sum(math.dist(a, b) for a, b in zip(pts, pts[1:]))
+
+
+def _shoelace(points):
+    return abs(sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]))) / 2
+
+
+# 各类型图元的 ActiveX 属性 → (读取, 写入)
+_PROPERTIES = {
+    "LINE": {
+        "StartPoint": (lambda e: APoint(e.dxf.start), lambda e, v: setattr(e.dxf, "start", _point(v))),
+        "EndPoint": (lambda e: APoint(e.dxf.end), lambda e, v: setattr(e.dxf, "end", _point(v))),
+        "Length": (lambda e: math.dist(e.dxf.start, e.dxf.end), None),
+        "Angle": (lambda e: math.atan2(e.dxf.end[1] - e.dxf.start[1], e.dxf.end[0] - e.dxf.start[0]) % math.tau, None),
+        "Delta": (lambda e: APoint(e.dxf.end) - APoint(e.dxf.start), None),
+    },
+    "CIRCLE": {
+        "Center": (lambda e: APoint(e.dxf.center), lambda e, v: setattr(e.dxf, "center", _point(v))),
+        "Radius": (lambda e: e.dxf.radius, lambda e, v: setattr(e.dxf, "radius", _positive(v, "半径"))),
+        "Diameter": (lambda e: e.dxf.radius * 2, lambda e, v: setattr(e.dxf, "radius", _positive(v, "直径") / 2)),
+        "Area": (lambda e: math.pi * e.dxf.radius ** 2, None),
+        "Circumference": (lambda e: math.tau * e.dxf.radius, None),
+    },
+    "ARC": {
+        "Center": (lambda e: APoint(e.dxf.center), lambda e, v: setattr(e.dxf, "center", _point(v))),
+        "Radius": (lambda e: e.dxf.radius, lambda e, v: setattr(e.dxf, "radius", _positive(v, "半径"))),
+        "StartAngle": (lambda e: math.radians(e.dxf.start_angle), lambda e, v: setattr(e.dxf, "start_angle", math.degrees(v))),
+        "EndAngle": (lambda e: math.radians(e.dxf.end_angle), lambda e, v: setattr(e.dxf, "end_angle", math.degrees(v))),
+        "ArcLength": (lambda e: e.dxf.radius * math.radians((e.dxf.end_angle - e.dxf.start_angle) % 360), None),
+    },
+    "TEXT": {
+        "TextString": (lambda e: e.dxf.text, lambda e, v: setattr(e.dxf, "text", str(v))),
+        "Height": (lambda e: e.dxf.height, lambda e, v: setattr(e.dxf, "height", _positive(v, "字高"))),
+        "InsertionPoint": (lambda e: APoint(e.dxf.insert), lambda e, v: setattr(e.dxf, "insert", _point(v))),
+        "Rotation": (lambda e: math.radians(e.dxf.rotation), lambda e, v: setattr(e.dxf, "rotation", math.degrees(v))),
+    },
+    "MTEXT": {
+        "TextString": (lambda e: e.text, lambda e, v: setattr(e, "text", str(v))),
+        "Height": (lambda e: e.dxf.char_height, lambda e, v: setattr(e.dxf, "char_height", _positive(v, "字高"))),
+        "InsertionPoint": (lambda e: APoint(e.dxf.insert), lambda e, v: setattr(e.dxf, "insert", _point(v))),
+        "Width": (lambda e: e.dxf.width, lambda e, v: setattr(e.dxf, "width", float(v))),
+    },
+    "POINT": {
+        "Coordinates": (lambda e: APoint(e.dxf.location), lambda e, v: setattr(e.dxf, "location", _point(v))),
+    },
+    "LWPOLYLINE": {
+        "Closed": (lambda e: e.closed, lambda e, v: setattr(e, "closed", bool(v))),
+        "Coordinates": (lambda e: tuple(c for p in _lw_points(e) for c in p), lambda e, v: e.set_points(_flat(v, 2, 2), format="xy")),
+        "Length": (lambda e: _polyline_length(_lw_points(e), e.closed), None),
+        "Area": (lambda e: _shoelace(_lw_points(e)), None),
+    },
+    "INSERT": {
+        "InsertionPoint": (lambda e: APoint(e.dxf.insert), lambda e, v: setattr(e.dxf, "insert", _point(v))),
+        "Name": (lambda e: e.dxf.name, None),
+        "Rotation": (lambda e: math.radians(e.dxf.rotation), lambda e, v: setattr(e.dxf, "rotation", math.degrees(v))),
+    },
+}
+
+# 所有图元共有的属性
+_COMMON_PROPERTIES = {
+    "Layer": (lambda e: e.dxf.layer, lambda e, v: setattr(e.dxf, "layer", str(v))),
+    "Color": (lambda e: e.dxf.color, lambda e, v: setattr(e.dxf, "color", int(v))),
+    "Linetype": (lambda e: e.dxf.linetype, lambda e, v: setattr(e.dxf, "linetype", str(v))),
+    "Lineweight": (lambda e: e.dxf.lineweight, lambda e, v: setattr(e.dxf, "lineweight", int(v))),
+    "Handle": (lambda e: e.dxf.handle, None),
+    "ObjectName": (lambda e: _OBJECT_NAMES.get(e.dxftype(), "AcDb" + e.dxftype().title()), None),
+}
+
+
+class FakeEntity:
+    """ezdxf 图元的 ActiveX 风格包装：支持常用属性与 Move/Rotate/Copy/Delete 等方法"""
+
+    def __init__(self, space, entity):
+        object.__setattr__(self, "_space", space)
+        object.__setattr__(self, "_entity", entity)
+
+    def _prop(self, name):
+        props = _PROPERTIES.get(self._entity.dxftype(), {})
+        return props.get(name) or _COMMON_PROPERTIES.get(name)
+
+    def __getattr__(self, name):
+        prop = self._prop(name)
+        if prop is None:
+            raise DryRunUnsupported(f"{self.ObjectName}.{name}")
+        return prop[0](self._entity)
+
+    def __setattr__(self, name, value):
+        prop = self._prop(name)
+        if prop is None:
+            raise DryRunUnsupported(f"{self.ObjectName}.{name} (赋值)")
+        if prop[1] is None:
+            raise AttributeError(f"{self.ObjectName}.{name} 是只读属性")
+        prop[1](self._entity, value)
+
+    # ---------- 编辑方法 ----------
+
+    def Update(self):
+        pass
+
+    def Highlight(self, flag=True):
+        pass
+
+    def Delete(self):
+        self._space._layout.delete_entity(self._entity)
+
+    def Move(self, from_point, to_point):
+        delta = APoint(_point(to_point)) - APoint(_point(from_point))
+        self._entity.translate(*delta)
+
+    def Rotate(self, base_point, angle):
+        b = _point(base_point, "基点")
+        self._entity.transform(Matrix44.chain(
+            Matrix44.translate(-b[0], -b[1], -b[2]), Matrix44.z_rotate(float(angle)), Matrix44.translate(*b)))
+
+    def ScaleEntity(self, base_point, factor):
+        b = _point(base_point, "基点")
+        s = _positive(factor, "缩放比例")
+        self._entity.transform(Matrix44.chain(
+            Matrix44.translate(-b[0], -b[1], -b[2]), Matrix44.scale(s, s, s), Matrix44.translate(*b)))
+
+    def Copy(self):
+        clone = self._entity.copy()
+        self._space._layout.add_entity(clone)
+        return FakeEntity(self._space, clone)
+
+    def Mirror(self, point1, point2):
+        p1, p2 = _point(point1, "镜像线起点"), _point(point2, "镜像线终点")
+        a = math.atan2(p2[1] - p1[1], p2[0] - p1[0])
+        clone = self.Copy()
+        clone._entity.transform(Matrix44.chain(
+            Matrix44.translate(-p1[0], -p1[1], 0), Matrix44.z_rotate(-a), Matrix44.scale(1, -1, 1),
+            Matrix44.z_rotate(a), Matrix44.translate(p1[0], p1[1], 0)))
+        return clone
+
+    def ArrayPolar(self, number_of_objects, angle_to_fill, center_point):
+        c = _point(center_point, "阵列中心")
+        n = int(number_of_objects)
+        fill = float(angle_to_fill)
+        # 与 AutoCAD 一致：整圆时均分，否则首尾两项分别位于 0 与 angle_to_fill
+        step = fill / n if abs(abs(fill) - 2 * math.pi) < 1e-9 or n < 2 else fill / (n - 1)
+        copies = []
+        for i in range(1, n):
+            clone = self.Copy()
+            clone.Rotate(c, step * i)
+            copies.append(clone)
+        return tuple(copies)
+
+    def ArrayRectangular(self, rows, columns, levels, row_distance, column_distance, level_distance):
+        copies = []
+        for r in range(int(rows)):
+            for c in range(int(columns)):
+                for l in range(int(levels)):
+                    if r or c or l:
+                        clone = self.Copy()
+                        clone._entity.translate(c * float(column_distance), r * float(row_distance), l * float(level_distance))
+                        copies.append(clone)
+        return tuple(copies)
+
+    def GetBoundingBox(self):
+        from ezdxf import bbox
+        box = bbox.extents([self._entity])
+        if not box.has_data:
+            raise DryRunUnsupported(f"{self.ObjectName}.GetBoundingBox")
+        return APoint(*box.extmin), APoint(*box.extmax)
+
+    def __repr__(self):
+        return f"<Fake {self.ObjectName} {self._entity.dxf.handle}>"
+
+
+class FakeHatch(FakeEntity):
+    """填充：边界对象只支持多段线和圆 (最常见的两种)"""
+
+    def _append_loop(self, objects, flags):
+        from ezdxf.lldxf.const import BOUNDARY_PATH_EXTERNAL
+        for obj in objects:
+            e = obj._entity if isinstance(obj, FakeEntity) else None
+            if e is None:
+                raise TypeError("填充边界必须是图元对象数组")
+            if e.dxftype() == "LWPOLYLINE":
+                self._entity.paths.add_polyline_path(_lw_points(e), is_closed=True, flags=flags or BOUNDARY_PATH_EXTERNAL)
+            elif e.dxftype() == "CIRCLE":
+                path = self._entity.paths.add_edge_path(flags=flags or BOUNDARY_PATH_EXTERNAL)
+                path.add_arc(e.dxf.center.vec2, e.dxf.radius, 0, 360)
+            else:
+                raise DryRunUnsupported(f"以 {e.dxftype()} 作为填充边界")
+
+    def AppendOuterLoop(self, objects):
+        self._append_loop(objects, 0)
+
+    def AppendInnerLoop(self, objects):
+        from ezdxf.lldxf.const import BOUNDARY_PATH_DEFAULT
+        self._append_loop(objects, BOUNDARY_PATH_DEFAULT)
+
+    def Evaluate(self):
+        pass
+
+
+# ================= 模型空间 / 块 =================
+
+class FakeSpace:
+    """ModelSpace 与 Block 共用的 Add* 方法，参数检查尽量与 ActiveX 保持一致"""
+
+    def __init__(self, doc, layout):
+        self._doc = doc
+        self._layout = layout
+
+    def _wrap(self, entity):
+        return FakeEntity(self, entity)
+
+    def __getattr__(self, name):
+        if name in ACTIVEX_MODEL_METHODS:
+            raise DryRunUnsupported(f"ModelSpace.{name}")
+        raise AttributeError(f"ModelSpace 没有方法 {name}")
+
+    @property
+    def Count(self):
+        return len(self._layout)
+
+    def Item(self, index):
+        entities = list(self._layout)
+        index = int(index)
+        if not -len(entities) <= index < len(entities):
+            # 真实图纸中可能已有这些图元，替身从空图纸开始无法回答
+            raise self._doc._unanswered(f"ModelSpace.Item({index})", IndexError(f"图元索引 {index} 超出范围"))
+        return self._wrap(entities[index])
+
+    def __iter__(self):
+        return (self._wrap(e) for e in self._layout)
+
+    # ---------- 基本图元 ----------
+
+    def AddLine(self, start_point, end_point):
+        return self._wrap(self._layout.add_line(_point(start_point, "起点"), _point(end_point, "终点")))
+
+    def AddCircle(self, center, radius):
+        return self._wrap(self._layout.add_circle(_point(center, "圆心"), _positive(radius, "半径")))
+
+    def AddArc(self, center, radius, start_angle, end_angle):
+        return self._wrap(self._layout.add_arc(
+            _point(center, "圆心"), _positive(radius, "半径"), math.degrees(float(start_angle)), math.degrees(float(end_angle))))
+
+    def AddPoint(self, point):
+        return self._wrap(self._layout.add_point(_point(point)))
+
+    def AddText(self, text, insertion_point, height):
+        return self._wrap(self._layout.add_text(str(text), dxfattribs={
+            "insert": _point(insertion_point, "插入点"), "height": _positive(height, "字高")}))
+
+    def AddMText(self, insertion_point, width, text):
+        return self._wrap(self._layout.add_mtext(str(text), dxfattribs={
+            "insert": _point(insertion_point, "插入点"), "width": float(width)}))
+
+    def AddLightWeightPolyline(self, vertices):
+        return self._wrap(self._layout.add_lwpolyline(_flat(vertices, 2, 2), format="xy"))
+
+    def AddPolyline(self, vertices):
+        return self._wrap(self._layout.add_lwpolyline([p[:2] for p in _flat(vertices, 3, 2)], format="xy"))
+
+    def Add3DPoly(self, vertices):
+        return self._wrap(self._layout.add_polyline3d(_flat(vertices, 3, 2)))
+
+    def AddEllipse(self, center, major_axis, radius_ratio):
+        ratio = float(radius_ratio)
+        if not 0 < ratio <= 1:
+            raise ValueError(f"短轴/长轴比例必须在 (0, 1] 之间，实际为 {ratio}")
+        return self._wrap(self._layout.add_ellipse(_point(center, "圆心"), _point(major_axis, "长轴"), ratio))
+
+    def AddSpline(self, points, start_tangent, end_tangent):
+        _point(start_tangent, "起点切向")
+        _point(end_tangent, "终点切向")
+        return self._wrap(self._layout.add_spline(_flat(points, 3, 2)))
+
+    def AddSolid(self, p1, p2, p3, p4):
+        return self._wrap(self._layout.add_solid([_point(p) for p in (p1, p2, p3, p4)]))
+
+    def AddXline(self, point1, point2):
+        p1, p2 = _point(point1), _point(point2)
+        return self._wrap(self._layout.add_xline(p1, APoint(p2) - APoint(p1)))
+
+    def AddRay(self, point1, point2):
+        p1, p2 = _point(point1), _point(point2)
+        return self._wrap(self._layout.add_ray(p1, APoint(p2) - APoint(p1)))
+
+    def AddHatch(self, pattern_type, pattern_name, associativity, object_type=None):
+        hatch = self._layout.add_hatch()
+        if str(pattern_name).upper() == "SOLID":
+            hatch.set_solid_fill()
+        else:
+            hatch.set_pattern_fill(str(pattern_name))
+        return FakeHatch(self, hatch)
+
+    def AddDimAligned(self, ext_line1_point, ext_line2_point, text_position):
+        p1, p2, loc = _point(ext_line1_point), _point(ext_line2_point), _point(text_position)
+        # 文字位置到尺寸基线的距离即为尺寸线偏移
+        dx, dy = p2[0] - p1[0], p2[1] - p1[1]
+        length = math.hypot(dx, dy) or 1.0
+        distance = ((loc[0] - p1[0]) * -dy + (loc[1] - p1[1]) * dx) / length
+        dim = self._layout.add_aligned_dim(p1=p1, p2=p2, distance=distance)
+        dim.render()
+        return self._wrap(dim.dimension)
+
+    def AddDimRotated(self, ext_line1_point, ext_line2_point, dim_line_location, rotation_angle):
+        dim = self._layout.add_linear_dim(
+            base=_point(dim_line_location), p1=_point(ext_line1_point), p2=_point(ext_line2_point),
+            angle=math.degrees(float(rotation_angle)))
+        dim.render()
+        return self._wrap(dim.dimension)
+
+    # ---------- 块参照 ----------
+
+    def _check_block(self, name):
+        if name not in self._doc._doc.blocks:
+            raise self._doc._unanswered(f"InsertBlock({name!r})", KeyError(f"块定义 {name} 不存在 (请先用 acad.doc.Blocks.Add 创建)"))
+
+    def InsertBlock(self, insertion_point, name, xscale, yscale, zscale, rotation, password=None):
+        self._check_block(name)
+        return self._wrap(self._layout.add_blockref(name, _point(insertion_point, "插入点"), dxfattribs={
+            "xscale": float(xscale), "yscale": float(yscale), "zscale": float(zscale),
+            "rotation": math.degrees(float(rotation))}))
+
+    def AddMInsertBlock(self, insertion_point, name, xscale, yscale, zscale, rotation,
+                        num_rows, num_columns, row_spacing, column_spacing, password=None):
+        self._check_block(name)
+        return self._wrap(self._layout.add_blockref(name, _point(insertion_point, "插入点"), dxfattribs={
+            "xscale": float(xscale), "yscale": float(yscale), "zscale": float(zscale),
+            "rotation": math.degrees(float(rotation)),
+            "row_count": int(num_rows), "column_count": int(num_columns),
+            "row_spacing": float(row_spacing), "column_spacing": float(column_spacing)}))
+
+
+# ================= 文档 / 应用 =================
+
+class _FakeLayer:
+    def __init__(self, layer):
+        object.__setattr__(self, "_layer", layer)
+
+    _PROPS = {"Name": "name", "Color": "color", "Linetype": "linetype", "Lineweight": "lineweight"}
+
+    def __getattr__(self, name):
+        if name in self._PROPS:
+            return getattr(self._layer.dxf, self._PROPS[name])
+        if name in ("LayerOn", "Freeze", "Lock"):
+            return False if name != "LayerOn" else self._layer.is_on()
+        raise DryRunUnsupported(f"Layer.{name}")
+
+    def __setattr__(self, name, value):
+        if name in ("Color", "Lineweight"):
+            setattr(self._layer.dxf, self._PROPS[name], int(value))
+        elif name == "Linetype":
+            self._layer.dxf.linetype = str(value)
+        elif name in ("LayerOn", "Freeze", "Lock"):
+            pass
+        else:
+            raise DryRunUnsupported(f"Layer.{name} (赋值)")
+
+
+class _FakeLayers:
+    def __init__(self, fake_doc):
+        self._fake_doc = fake_doc
+
+    def Add(self, name):
+        layers = self._fake_doc._doc.layers
+        return _FakeLayer(layers.get(name) if name in layers else layers.add(name))
+
+    def Item(self, name):
+        layers = self._fake_doc._doc.layers
+        if name not in layers:
+            raise self._fake_doc._unanswered(f"Layers.Item({name!r})", KeyError(f"图层 {name} 不存在"))
+        return _FakeLayer(layers.get(name))
+
+    @property
+    def Count(self):
+        return len(self._fake_doc._doc.layers)
+
+
+class _FakeBlocks:
+    def __init__(self, fake_doc):
+        self._fake_doc = fake_doc
+
+    def Add(self, insertion_point, name):
+        doc = self._fake_doc._doc
+        block = doc.blocks.get(name) if name in doc.blocks else doc.blocks.new(name, base_point=_point(insertion_point, "基点"))
+        return FakeSpace(self._fake_doc, block)
+
+    def Item(self, name):
+        block = self._fake_doc._doc.blocks.get(name)
+        if block is None:
+            # 与 ActiveX 一致：不存在时报错 (生成的代码用 try: Blocks.Item(...) 判断块是否已定义)
+            raise self._fake_doc._unanswered(f"Blocks.Item({name!r})", KeyError(f"块定义 {name} 不存在"))
+        return FakeSpace(self._fake_doc, block)
+
+    @property
+    def Count(self):
+        return len(self._fake_doc._doc.blocks)
+
+
+class FakeDocument:
+    def __init__(self, doc, name="DryRun.dwg"):
+        self._doc = doc
+        self.Name = name
+        self.ModelSpace = FakeSpace(self, doc.modelspace())
+        self.Layers = _FakeLayers(self)
+        self.Blocks = _FakeBlocks(self)
+        self._variables = {"OSMODE": 0}
+        self._unanswered_errors = []  # (查找说明, 抛出的异常)：替身中找不到、但真实图纸里可能存在的对象
+
+    def _unanswered(self, what, error):
+        """记录一次替身无法回答的查找，返回要抛出的异常 (代码自己捕获并处理时不影响试运行结果)"""
+        self._unanswered_errors.append((what, error))
+        return error
+
+    def unanswered_cause(self, error):
+        """error (或引发它的异常链) 来自一次无法回答的查找时返回该查找的说明，否则返回 None"""
+        seen = set()
+        while error is not None and id(error) not in seen:
+            seen.add(id(error))
+            for what, recorded in self._unanswered_errors:
+                if recorded is error:
+                    return what
+            error = error.__cause__ or error.__context__
+        return None
+
+    @property
+    def ActiveLayer(self):
+        return _FakeLayer(self._doc.layers.get("0"))
+
+    def StartUndoMark(self):
+        pass
+
+    def EndUndoMark(self):
+        pass
+
+    def Regen(self, which=None):
+        pass
+
+    def GetVariable(self, name):
+        return self._variables.get(name.upper(), 0)
+
+    def SetVariable(self, name, value):
+        self._variables[name.upper()] = value
+
+    def SendCommand(self, command):
+        raise DryRunUnsupported("Document.SendCommand")
+
+    def HandleToObject(self, handle):
+        # 句柄指向在线图纸中已有的图元 (来自 mirror.query)，替身图纸里不存在
+        raise DryRunUnsupported("Document.HandleToObject")
+
+
+class _FakeApplication:
+    def __init__(self, fake_doc):
+        self.ActiveDocument = fake_doc
+        self.Visible = True
+
+    def ZoomExtents(self):
+        pass
+
+    def ZoomAll(self):
+        pass
+
+    def Update(self):
+        pass
+
+
+class FakeAcad:
+    """pyautocad.Autocad 的替身：app / doc / model / iter_objects 等接口写入内存中的 ezdxf 图纸"""
+
+    def __init__(self, doc=None):
+        self.dxf_doc = doc or ezdxf.new(setup=True)
+        self.doc = FakeDocument(self.dxf_doc)
+        self.app = _FakeApplication(self.doc)
+        self.ActiveDocument = self.doc
+        self.Application = self.app
+
+    @property
+    def model(self):
+        return self.doc.ModelSpace
+
+    @property
+    def best_interface(self):
+        return lambda obj: obj
+
+    def iter_objects(self, object_name_or_list=None, block=None, limit=None, dont_cast=False):
+        names = object_name_or_list
+        if isinstance(names, str):
+            names = [names]
+        space = block or self.model
+        found = 0
+        for obj in list(space):
+            if names and not any(n.lower() in obj.ObjectName.lower() for n in names):
+                continue
+            yield obj
+            found += 1
+            if limit and found >= limit:
+                return
+
+    iter_objects_fast = iter_objects
+
+    def find_one(self, object_name_or_list, container=None, predicate=None):
+        for obj in self.iter_objects(object_name_or_list, container):
+            if predicate is None or predicate(obj):
+                return obj
+        return None
+
+    def prompt(self, text):
+        print(text)
+
+    def get_selection(self, text="Select objects"):
+        raise DryRunUnsupported("acad.get_selection")
+
+
+# ================= 试运行 =================
+
+def dry_run(code_str, render=True, dpi=100, scope=None):
+    """
+    在替身上执行生成的 pyautocad 代码 (变量与 app2.py 的执行环境相同，scope 为额外注入的变量)。
+    返回 (是否通过, 报错信息, stdout, 产物)，产物包含：
+      entities     模型空间中生成的图元数
+      unsupported  用到了替身未实现的功能时的说明 (此时视为通过，交给真实 CAD 验证)
+      png          预览图字节串 (render=True 且渲染成功时)
+      render_error 渲染失败的原因
+    """
+    fake = FakeAcad()
+    # 与 app2.py 的真实执行一样使用单一命名空间：代码中定义的函数与推导式也能访问 acad 等变量
+    exec_scope = {"__name__": "__main__", "acad": fake, "APoint": APoint, "aDouble": aDouble, "math": math}
+    exec_scope.update(scope or {})
+    stdout = io.StringIO()
+    artifacts = {"entities": 0, "unsupported": None, "png": None, "render_error": None}
+    try:
+        with contextlib.redirect_stdout(stdout):
+            exec(code_str, exec_scope)
+    except DryRunUnsupported as e:
+        artifacts["unsupported"] = str(e)
+        logger.info(f"Dry run skipped: fake acad does not support {e}")
+        return True, "", stdout.getvalue(), artifacts
+    except Exception as e:
+        lookup = fake.doc.unanswered_cause(e)
+        if lookup is not None:
+            # 代码读取了真实图纸中的已有状态，替身无从判断，失败不能算作代码错误
+            artifacts["unsupported"] = f"{lookup} (真实图纸中可能存在)"
+            logger.info(f"Dry run skipped: fake acad cannot answer {lookup}")
+            return True, "", stdout.getvalue(), artifacts
+        return False, traceback.format_exc(), stdout.getvalue(), artifacts
+
+    artifacts["entities"] = len(fake.dxf_doc.modelspace())
+    if render:
+        from cad_render import render_doc_to_image
+        image, err = render_doc_to_image(fake.dxf_doc, dpi=dpi)
+        artifacts["png"] = image.getvalue() if image else None
+        artifacts["render_error"] = err
+    return True, "", stdout.getvalue(), artifacts
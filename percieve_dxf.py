@@ -1,18 +1,289 @@
 import os
+import json
+import shutil
+import hashlib
+import tempfile
+import multiprocessing as mp
 import matplotlib.pyplot as plt
 import ezdxf
 from ezdxf.addons.drawing import RenderContext, Frontend
 from ezdxf.addons.drawing.matplotlib import MatplotlibBackend
 
+# ================= 配置区域 =================
+BLOCK_DPI = 300
+CHUNK_SIZE = 4        # 并行模式下每次分给一个进程的块数 (块大小不均时小一些负载更均衡)
+MANIFEST_SUFFIX = ".manifest.json"   # 清单文件放在输出目录旁边：<output_dir>.manifest.json
+RENDER_VERSION = 1    # 渲染逻辑 (render_block) 改变输出时加一，使旧清单全部失效
+ATLAS_CELL_PX = 256   # 图集模式下每个块占用的正方形格子边长 (像素)
+ATLAS_COLUMNS = 16
+ATLAS_MAX_ROWS = 16   # 每页最多行数，超出后分页 (单页默认 4096×4096 像素)
+ATLAS_PADDING_PX = 8  # 格子内留白
+ATLAS_INDEX_FILE = "atlas.json"
+IGNORED_GROUP_CODES = {5, 105, 330, 360}  # 句柄与所属对象指针：重新保存图纸会变，与图形内容无关
+
+# 并行模式的进程内状态：fork 时由父进程直接继承 (写时复制)，spawn 时由 _init_worker 各自读取
+_worker_doc = None
+_worker_ctx = None
+
+
 def sanitize_filename(name):
     """清理文件名，防止保存时出错"""
     return "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
 
-def extract_blocks_to_images(dxf_path, output_dir="block_images"):
+
+def render_block(ctx, block, output_path, dpi=BLOCK_DPI):
+    """把一个块的图元渲染为 PNG (串行与并行模式共用，保证输出完全一致)；失败时抛出异常"""
+    # 创建绘图对象
+    fig = plt.figure()
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off() # 隐藏坐标轴
+
+    try:
+        # 设置后端
+        out = MatplotlibBackend(ax)
+        frontend = Frontend(ctx, out)
+
+        # ---【核心修改点】---
+        # 原来的 draw_layout 会找打印设置导致报错
+        # 改用 draw_entities，直接画里面的线条，不处理打印属性
+        frontend.draw_entities(block)
+        # --------------------
+
+        # 结束绘制
+        out.finalize()
+        ax.autoscale(True)
+
+        # 保持比例 (防止空块报错)
+        xlim = ax.get_xlim()
+        ylim = ax.get_ylim()
+        if xlim[1] > xlim[0] and ylim[1] > ylim[0]:
+            ax.set_aspect('equal', 'datalim')
+
+        # 保存图片
+        fig.savefig(output_path, dpi=dpi, bbox_inches='tight', pad_inches=0.1)
+    finally:
+        plt.close(fig)
+
+
+# ================= 增量提取：内容哈希清单 =================
+
+def manifest_path_for(output_dir):
+    return os.path.normpath(output_dir) + MANIFEST_SUFFIX
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"blocks": {}}
+
+
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _entity_tags(entity, dxfversion):
+    """图元的 DXF 组码序列 (去掉句柄类组码)，用作内容哈希的输入"""
+    from ezdxf.lldxf.tagwriter import TagCollector
+    collector = TagCollector(dxfversion=dxfversion)
+    try:
+        entity.export_dxf(collector)
+    except Exception:
+        return repr(sorted(entity.dxfattribs().items()))
+    return "\n".join(f"{tag.code}:{tag.value!r}" for tag in collector.tags if tag.code not in IGNORED_GROUP_CODES)
+
+
+class BlockHasher:
+    """
+    计算块的内容哈希：块内全部图元的定义 + 用到的图层属性 + 渲染参数。
+    嵌套的块参照 (INSERT) 计入被引用块的哈希，子块改了父块的图片也会重新渲染。
+    """
+
+    def __init__(self, doc, params):
+        self.doc = doc
+        self.params = json.dumps(params, sort_keys=True)
+        self._hashes = {}
+
+    def _layer_key(self, name):
+        layer = self.doc.layers.get(name) if self.doc.layers.has_entry(name) else None
+        if layer is None:
+            return name
+        return f"{name}:{layer.dxf.color}:{layer.dxf.linetype}:{layer.is_on()}:{layer.is_frozen()}"
+
+    def __call__(self, block_name):
+        if block_name in self._hashes:
+            return self._hashes[block_name]
+        self._hashes[block_name] = None  # 防止异常的循环引用导致无限递归
+        h = hashlib.sha256(self.params.encode("utf-8"))
+        block = self.doc.blocks.get(block_name)
+        if block is not None:
+            layers = set()
+            for e in block:
+                h.update(_entity_tags(e, self.doc.dxfversion).encode("utf-8"))
+                layers.add(e.dxf.get("layer", "0"))
+                if e.dxftype() == "INSERT":
+                    h.update((self(e.dxf.name) or "").encode("utf-8"))
+            for name in sorted(layers):
+                h.update(self._layer_key(name).encode("utf-8"))
+        self._hashes[block_name] = h.hexdigest()
+        return self._hashes[block_name]
+
+
+def referenced_blocks(doc, roots=None):
+    """
+    从模型空间和图纸空间出发，沿 INSERT (含嵌套) 能到达的全部块名。
+    roots 为直接被布局引用的块名 (低内存模式没有加载布局中的图元，由 load_blocks_only 提供)。
+    """
+    found = set()
+    if roots is None:
+        stack = list(doc.layouts)  # 模型空间与各图纸空间布局本身可以直接遍历其中的图元
+    else:
+        found.update(roots)
+        stack = [doc.blocks.get(name) for name in roots if doc.blocks.get(name) is not None]
+    while stack:
+        for e in stack.pop():
+            if e.dxftype() == "INSERT" and e.dxf.name not in found:
+                found.add(e.dxf.name)
+                block = doc.blocks.get(e.dxf.name)
+                if block is not None:
+                    stack.append(block)
+    return found
+
+
+# ================= 低内存模式：只加载 BLOCKS =================
+
+def _iter_pairs(f):
+    """逐对读取 ASCII DXF 的 (组码行, 值行) 原始字节，不把整个文件读入内存"""
+    while True:
+        code = f.readline()
+        if not code:
+            return
+        yield code, f.readline()
+
+
+def _copy_blocks_only(src, dst):
+    """
+    流式复制 DXF，丢掉 ENTITIES 段和 *Model_Space / *Paper_Space 布局块中的图元 (保留段和块的框架)，
+    其余段 (HEADER、TABLES、BLOCKS、OBJECTS ...) 原样保留。
+    返回被布局直接引用的块名 (原始字节)，代替未加载的布局图元作为引用关系的起点。
+    """
+    roots = set()
+    section = None
+    skipping = False        # 正在丢弃布局中的图元
+    entity = None           # 当前图元类型 (只在需要记录 INSERT 块名时用到)
+    block_header = None     # 正在读取的 BLOCK 记录的组码，读到块名后才知道是否为布局块
+    pairs = _iter_pairs(src)
+    for pair in pairs:
+        code, value = pair[0].strip(), pair[1].strip()
+        if code == b"0":
+            if block_header is not None:
+                dst.writelines(p for header_pair in block_header for p in header_pair)
+                block_header = None
+            if value == b"SECTION":
+                name_pair = next(pairs)
+                section = name_pair[1].strip().upper()
+                dst.writelines(pair + name_pair)
+                skipping = section == b"ENTITIES"
+                continue
+            if value == b"ENDSEC":
+                section, skipping = None, False
+            elif section == b"BLOCKS":
+                if value == b"BLOCK":
+                    block_header = [pair]
+                    continue
+                if value == b"ENDBLK":
+                    skipping = False
+            entity = value
+        elif block_header is not None:
+            block_header.append(pair)
+            if code == b"2":
+                skipping = value.upper().startswith((b"*MODEL_SPACE", b"*PAPER_SPACE"))
+            continue
+        elif skipping and code == b"2" and entity == b"INSERT":
+            roots.add(value)
+        if not skipping:
+            dst.writelines(pair)
+    return roots
+
+
+def load_blocks_only(dxf_path):
+    """
+    低内存读取：只为块渲染加载需要的部分 (HEADER、TABLES 中的图层/线型等、BLOCKS、OBJECTS)，
+    模型空间与图纸空间的图元在流式复制时直接丢弃，从不进入内存。
+    峰值内存取决于块定义的总大小，而不是整个文件；二进制 DXF 不支持流式过滤，回退为完整读取。
+    返回 (doc, 被布局直接引用的块名集合)。
+    """
+    with open(dxf_path, "rb") as src:
+        if src.read(22) == b"AutoCAD Binary DXF\r\n\x1a\x00":
+            doc = ezdxf.readfile(dxf_path)
+            return doc, None
+        src.seek(0)
+        fd, tmp_path = tempfile.mkstemp(suffix=".dxf")
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                raw_roots = _copy_blocks_only(src, dst)
+            doc = ezdxf.readfile(tmp_path)
+        finally:
+            os.remove(tmp_path)
+    return doc, {name.decode(doc.encoding, errors="replace") for name in raw_roots}
+
+
+def load_drawing(dxf_path, low_memory=False):
+    """读取 DXF，返回 (doc, roots)；完整读取时 roots 为 None (引用关系直接从布局中获得)"""
+    if low_memory:
+        return load_blocks_only(dxf_path)
+    return ezdxf.readfile(dxf_path), None
+
+
+def _init_worker(dxf_path, low_memory=False):
+    global _worker_doc, _worker_ctx
+    plt.switch_backend("Agg")  # 子进程没有界面，只需要离屏渲染
+    if _worker_doc is None:
+        # spawn 模式：每个进程自己读取一次 DXF
+        _worker_doc, _roots = load_drawing(dxf_path, low_memory)
+    _worker_ctx = RenderContext(_worker_doc)
+
+
+def _render_job(job):
+    """子进程任务：(序号, 块名, 临时输出路径, dpi) → (序号, 错误信息或 None)"""
+    index, block_name, tmp_path, dpi = job
+    try:
+        render_block(_worker_ctx, _worker_doc.blocks.get(block_name), tmp_path, dpi)
+        return index, None
+    except Exception as e:
+        return index, str(e)
+
+
+def _render_parallel(doc, dxf_path, block_names, tmp_dir, workers, low_memory=False, dpi=BLOCK_DPI):
+    """按块分配给多个进程渲染到临时文件，返回 {序号: 错误信息或 None}"""
+    global _worker_doc
+    jobs = [(i, name, os.path.join(tmp_dir, f"{i}.png"), dpi) for i, name in enumerate(block_names)]
+    if "fork" in mp.get_all_start_methods():
+        # 文档只在父进程读取一次，子进程通过 fork 共享内存页
+        context = mp.get_context("fork")
+        _worker_doc = doc
+    else:
+        context = mp.get_context("spawn")
+    results = {}
+    try:
+        with context.Pool(workers, initializer=_init_worker, initargs=(dxf_path, low_memory)) as pool:
+            for index, error in pool.imap_unordered(_render_job, jobs, chunksize=CHUNK_SIZE):
+                results[index] = error
+    finally:
+        _worker_doc = None
+    return results
+
+
+def _open_drawing(dxf_path, output_dir, low_memory=False):
+    """检查文件、创建输出目录、读取 DXF 并准备渲染上下文，返回 (doc, ctx, roots)；失败时打印原因并返回 None"""
     # 1. 检查文件
     if not os.path.exists(dxf_path):
         print(f"错误: 找不到文件 {dxf_path}")
-        return
+        return None
 
     # 2. 创建输出目录
     if not os.path.exists(output_dir):
@@ -21,78 +292,242 @@ def extract_blocks_to_images(dxf_path, output_dir="block_images"):
 
     # 3. 读取DXF
     try:
-        doc = ezdxf.readfile(dxf_path)
-        print(f"成功读取文件: {dxf_path}")
+        doc, roots = load_drawing(dxf_path, low_memory)
+        print(f"成功读取文件: {dxf_path}" + (" (仅块定义)" if low_memory else ""))
     except Exception as e:
         print(f"读取DXF文件失败: {e}")
-        return
+        return None
 
     # 准备渲染上下文
     try:
         ctx = RenderContext(doc)
     except Exception as e:
         print(f"初始化渲染上下文失败: {e}")
+        return None
+    return doc, ctx, roots
+
+
+def select_blocks(doc, skip_unreferenced=False, roots=None):
+    """需要提取的块名 (按文档顺序)：过滤掉布局和匿名块（以*开头），可选只保留被引用的块"""
+    block_names = [block.name for block in doc.blocks if not block.name.startswith('*')]
+    if skip_unreferenced:
+        referenced = {name.lower() for name in referenced_blocks(doc, roots)}
+        unreferenced = [name for name in block_names if name.lower() not in referenced]
+        block_names = [name for name in block_names if name.lower() in referenced]
+        print(f"跳过 {len(unreferenced)} 个未被引用的块")
+    return block_names
+
+
+def extract_blocks_to_images(dxf_path, output_dir="block_images", workers=1, incremental=True,
+                             skip_unreferenced=False, dpi=BLOCK_DPI, low_memory=False):
+    """
+    把 DXF 中每个命名块渲染为一张 PNG。
+    workers > 1 时多进程并行渲染：文档只读取一次 (支持 fork 的平台上子进程写时复制共享)，
+    各块先渲染到临时文件，再按块顺序统一命名落盘，输出文件集合与串行模式完全相同。
+    incremental=True 时读取输出目录旁的清单 (<output_dir>.manifest.json)：
+    内容哈希 (块定义 + 渲染参数) 未变且图片仍在的块直接跳过，已不存在的块的图片会被删除。
+    skip_unreferenced=True 时只提取被 INSERT (含嵌套) 实际引用的块。
+    low_memory=True 时只加载块定义 (见 load_blocks_only)，适合几百 MB 的大图。
+    返回 {块名: 错误信息}，全部成功时为空字典；文件或文档无法读取时返回 None。
+    """
+    opened = _open_drawing(dxf_path, output_dir, low_memory)
+    if opened is None:
         return
-    
+    doc, ctx, roots = opened
+    block_names = select_blocks(doc, skip_unreferenced, roots)
+
+    # 4. 对比清单，找出需要重新渲染的块
+    manifest_path = manifest_path_for(output_dir)
+    old_blocks = load_manifest(manifest_path).get("blocks", {})
+    hasher = BlockHasher(doc, {"dpi": dpi, "render_version": RENDER_VERSION, "ezdxf": ezdxf.__version__})
+    hashes = {name: hasher(name) for name in block_names}
+    safe_names = [sanitize_filename(name) for name in block_names]
+    # 文件名冲突 (串行时后者覆盖前者) 和未命名块 (编号依赖前面的块) 每次都重新渲染，保证结果与全量提取一致
+    shared = {n for n in safe_names if not n or safe_names.count(n) > 1}
+
+    def unchanged(name, safe_name):
+        entry = old_blocks.get(name)
+        return (incremental and entry is not None and safe_name not in shared and entry["hash"] == hashes[name]
+                and os.path.exists(os.path.join(output_dir, entry["file"])))
+
+    keep = {name for name, safe_name in zip(block_names, safe_names) if unchanged(name, safe_name)}
+    todo = [name for name in block_names if name not in keep]
+
     count = 0
-    print("开始提取元件块...")
+    failures = {}
+    new_blocks = {}
+    print(f"开始提取元件块... (需要渲染 {len(todo)} 个，未变化跳过 {len(keep)} 个)")
 
-    # 4. 遍历所有块 (Blocks)
-    for block in doc.blocks:
-        # 过滤掉布局和匿名块（以*开头）
-        if block.name.startswith('*'):
-            continue
-        
-        block_name = block.name
-        safe_name = sanitize_filename(block_name)
+    def finish(block_name, safe_name):
+        nonlocal count
         if not safe_name:
             safe_name = f"unknown_block_{count}"
+        new_blocks[block_name] = {"hash": hashes[block_name], "file": f"{safe_name}.png"}
+        count += 1
+        return os.path.join(output_dir, f"{safe_name}.png")
+
+    if workers > 1 and len(todo) > 1:
+        print(f"并行渲染 {len(todo)} 个块 ({workers} 个进程)...")
+        tmp_dir = tempfile.mkdtemp(prefix=".blocks_", dir=output_dir)
+        try:
+            results = _render_parallel(doc, dxf_path, todo, tmp_dir, workers, low_memory, dpi)
+            # 按块顺序命名并移动到输出目录：未命名块的编号、同名覆盖的先后都与串行模式一致
+            todo_index = {name: i for i, name in enumerate(todo)}
+            for block_name, safe_name in zip(block_names, safe_names):
+                if block_name in keep:
+                    new_blocks[block_name] = old_blocks[block_name]
+                    count += 1
+                    continue
+                i = todo_index[block_name]
+                error = results.get(i, "渲染进程异常退出")
+                if error is not None:
+                    print(f"处理: {block_name} ... 失败 ({error})")
+                    failures[block_name] = error
+                    continue
+                os.replace(os.path.join(tmp_dir, f"{i}.png"), finish(block_name, safe_name))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        # 5. 遍历所有块 (Blocks)
+        for block_name, safe_name in zip(block_names, safe_names):
+            if block_name in keep:
+                new_blocks[block_name] = old_blocks[block_name]
+                count += 1
+                continue
+
+            print(f"正在处理: {block_name} ...", end="")
+            try:
+                output_path = os.path.join(output_dir, f"{safe_name or f'unknown_block_{count}'}.png")
+                render_block(ctx, doc.blocks.get(block_name), output_path, dpi)
+                finish(block_name, safe_name)
+                print(f" 成功")
+            except Exception as e:
+                # 打印具体的错误信息，方便调试
+                print(f" 失败 ({e})")
+                failures[block_name] = str(e)
+
+    # 6. 删除已不存在 (或本次失败、被跳过) 的块留下的旧图片，并写回清单
+    in_use = {entry["file"] for entry in new_blocks.values()}
+    removed = 0
+    for block_name, entry in old_blocks.items():
+        if block_name not in new_blocks and entry["file"] not in in_use:
+            try:
+                os.remove(os.path.join(output_dir, entry["file"]))
+                removed += 1
+            except OSError:
+                pass
+    save_manifest(manifest_path, {"source": os.path.abspath(dxf_path), "blocks": new_blocks})
+
+    print(f"\n全部完成! 共保存了 {count} 张元件图片 (新渲染 {count - len(keep)}，删除旧图片 {removed})。")
+    if failures:
+        print(f"失败 {len(failures)} 个块: {', '.join(failures)}")
+    return failures
+
 
-        print(f"正在处理: {block_name} ...", end="")
+# ================= 图集模式 =================
 
-        # 创建绘图对象
-        fig = plt.figure()
-        ax = fig.add_axes([0, 0, 1, 1])
-        ax.set_axis_off() # 隐藏坐标轴
+def _cell_view(extents, cell_px, padding_px):
+    """
+    块在格子中的显示范围：等比缩放、居中，返回 (xlim, ylim, 每绘图单位的像素数)。
+    两个方向的像素/单位相同，下游可按 px = (x - xlim[0]) * scale 直接换算。
+    """
+    (xmin, ymin), (xmax, ymax) = extents
+    size = max(xmax - xmin, ymax - ymin) or 1.0
+    scale = (cell_px - 2 * padding_px) / size
+    half = cell_px / 2 / scale
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    return (cx - half, cx + half), (cy - half, cy + half), scale
 
+
+def _save_page(fig, path, image_format):
+    if image_format == "npy":
+        # 原始 RGBA 数组，下游可用 numpy.load(path, mmap_mode="r") 直接内存映射
+        import numpy as np
+        fig.canvas.draw()
+        np.save(path, np.asarray(fig.canvas.buffer_rgba()))
+    else:
+        fig.savefig(path)
+
+
+def extract_blocks_to_atlas(dxf_path, output_dir="block_atlas", cell_px=ATLAS_CELL_PX, columns=ATLAS_COLUMNS,
+                            max_rows=ATLAS_MAX_ROWS, padding_px=ATLAS_PADDING_PX, image_format="png",
+                            skip_unreferenced=False, low_memory=False):
+    """
+    图集模式：把所有块渲染到少数几张大图上 (每页一个 figure、一次保存)，而不是每个块一张小图。
+    每个块占一个 cell_px×cell_px 的格子，按文档顺序逐行排列，超过 max_rows 行时分页：
+      <output_dir>/atlas_000.png (image_format="npy" 时为可内存映射的 RGBA 数组 .npy)
+      <output_dir>/atlas.json    {块名: {page, file, rect: [x, y, w, h] (像素，左上角为原点),
+                                  extents: [xmin, ymin, xmax, ymax] (DXF 坐标)，view 与 scale 为格子的坐标换算}}
+    skip_unreferenced / low_memory 与 extract_blocks_to_images 相同。
+    返回 {块名: 错误信息}；文件或文档无法读取时返回 None。
+    """
+    from ezdxf import bbox
+
+    opened = _open_drawing(dxf_path, output_dir, low_memory)
+    if opened is None:
+        return
+    doc, ctx, roots = opened
+    block_names = select_blocks(doc, skip_unreferenced, roots)
+
+    per_page = columns * max_rows
+    pages = []
+    index = {}
+    failures = {}
+    cache = bbox.Cache()
+    print(f"开始生成图集: {len(block_names)} 个块，每页最多 {per_page} 个")
+
+    for page_no, start in enumerate(range(0, len(block_names), per_page)):
+        names = block_names[start:start + per_page]
+        rows = (len(names) + columns - 1) // columns
+        width, height = columns * cell_px, rows * cell_px
+        # dpi=100 时 figsize (英寸) × 100 即像素，格子的像素位置是精确的 (不能用 bbox_inches='tight' 裁剪)
+        fig = plt.figure(figsize=(width / 100, height / 100), dpi=100)
+        file_name = f"atlas_{page_no:03d}.{image_format}"
         try:
-            # 设置后端
-            out = MatplotlibBackend(ax)
-            frontend = Frontend(ctx, out)
-
-            # ---【核心修改点】---
-            # 原来的 draw_layout 会找打印设置导致报错
-            # 改用 draw_entities，直接画里面的线条，不处理打印属性
-            frontend.draw_entities(block)
-            # --------------------
-            
-            # 结束绘制
-            out.finalize()
-            ax.autoscale(True)
-            
-            # 保持比例 (防止空块报错)
-            xlim = ax.get_xlim()
-            ylim = ax.get_ylim()
-            if xlim[1] > xlim[0] and ylim[1] > ylim[0]:
-                ax.set_aspect('equal', 'datalim')
-
-            # 保存图片
-            output_path = os.path.join(output_dir, f"{safe_name}.png")
-            fig.savefig(output_path, dpi=300, bbox_inches='tight', pad_inches=0.1)
-            print(f" 成功")
-            count += 1
-
-        except Exception as e:
-            # 打印具体的错误信息，方便调试
-            print(f" 失败 ({e})")
+            for slot, block_name in enumerate(names):
+                row, col = divmod(slot, columns)
+                x, y = col * cell_px, row * cell_px
+                ax = fig.add_axes([x / width, 1 - (y + cell_px) / height, cell_px / width, cell_px / height])
+                ax.set_axis_off()
+                block = doc.blocks.get(block_name)
+                try:
+                    ext = bbox.extents(block, cache=cache)
+                    # adjust_figure=False：共用画布，不能让后端按单个块的比例改动整张图的尺寸
+                    out = MatplotlibBackend(ax, adjust_figure=False)
+                    Frontend(ctx, out).draw_entities(block)
+                    out.finalize()
+                except Exception as e:
+                    ax.remove()
+                    print(f"处理: {block_name} ... 失败 ({e})")
+                    failures[block_name] = str(e)
+                    continue
+
+                entry = {"page": page_no, "file": file_name, "rect": [x, y, cell_px, cell_px], "extents": None}
+                if ext.has_data:
+                    xlim, ylim, scale = _cell_view(((ext.extmin.x, ext.extmin.y), (ext.extmax.x, ext.extmax.y)),
+                                                   cell_px, padding_px)
+                    ax.set_xlim(*xlim)
+                    ax.set_ylim(*ylim)
+                    entry.update(extents=[ext.extmin.x, ext.extmin.y, ext.extmax.x, ext.extmax.y],
+                                 view=[xlim[0], ylim[0], xlim[1], ylim[1]], scale=scale)
+                index[block_name] = entry
+            _save_page(fig, os.path.join(output_dir, file_name), image_format)
         finally:
             plt.close(fig)
+        pages.append({"file": file_name, "width": width, "height": height})
+        print(f"已保存第 {page_no + 1} 页: {file_name} ({len(names)} 个格子)")
 
-    print(f"\n全部完成! 共保存了 {count} 张元件图片。")
+    atlas = {"source": os.path.abspath(dxf_path), "cell_px": cell_px, "columns": columns,
+             "pages": pages, "blocks": index}
+    save_manifest(os.path.join(output_dir, ATLAS_INDEX_FILE), atlas)
+    print(f"\n全部完成! {len(index)} 个块写入 {len(pages)} 页图集。")
+    if failures:
+        print(f"失败 {len(failures)} 个块: {', '.join(failures)}")
+    return failures
 
 
 if __name__ == "__main__":
     # 请在这里修改您的DXF文件路径
     dxf_file = r"D:\work\power\daquan\A21232_0322_一次系统图.dxf"
-    
-    extract_blocks_to_images(dxf_file,'output')
\ No newline at end of file
+
+    extract_blocks_to_images(dxf_file, 'output', workers=os.cpu_count() or 1)
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+TRACE_DIR = "traces"
+TRACE_FILE = os.path.join(TRACE_DIR, "agent_trace.jsonl")   # 每个请求一行的结构化耗时记录
+METRICS_FILE = os.path.join(TRACE_DIR, "metrics.prom")      # Prometheus 文本格式 (textfile collector)
+
+# 各阶段耗时直方图的桶边界 (秒)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+
+# ================= Prometheus 指标 =================
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+
+class MetricsRegistry:
+    """进程内的计数器与直方图，按 Prometheus 文本格式导出 (不依赖 prometheus_client)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counters = {}    # name → {labels_key: value}
+        self._histograms = {}  # name → {labels_key: [bucket_counts, sum, count]}
+        self._buckets = {}
+        self._help = {}
+
+    def inc(self, name, value=1.0, help_text="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help_text)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, help_text="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help_text)
+            self._buckets.setdefault(name, tuple(buckets))
+            series = self._histograms.setdefault(name, {})
+            state = series.setdefault(key, [[0] * len(self._buckets[name]), 0.0, 0])
+            idx = bisect.bisect_left(self._buckets[name], value)
+            if idx < len(self._buckets[name]):
+                state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_label_str(dict(key))} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, (bucket_counts, total, count) in sorted(series.items()):
+                    labels = dict(key)
+                    cumulative = 0
+                    for bound, n in zip(self._buckets[name], bucket_counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_label_str({**labels, 'le': bound})} {cumulative}")
+                    lines.append(f"{name}_bucket{_label_str({**labels, 'le': '+Inf'})} {count}")
+                    lines.append(f"{name}_sum{_label_str(labels)} {total}")
+                    lines.append(f"{name}_count{_label_str(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path=METRICS_FILE):
+        """
+        原子地写出指标文件：先写同目录下的唯一临时文件再 os.replace，
+        多个线程 (批量 CLI 并发) 或多个进程 (多个 Streamlit 会话) 同时写出时不会产生残缺的文件。
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with self._write_lock:  # 同一进程内按顺序写出，后完成的请求总是覆盖先完成的
+            fd, tmp_path = tempfile.mkstemp(prefix=".metrics_", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(self.render_prometheus())
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+
+METRICS = MetricsRegistry()
+_TRACE_LOCK = threading.Lock()
+
+
+# ================= 请求级追踪 =================
+
+def maybe_span(trace, stage, **attrs):
+    """trace 为 None 时不记录，方便在可选追踪的函数中统一写法"""
+    return trace.span(stage, **attrs) if trace is not None else nullcontext({})
+
+
+class RequestTrace:
+    """
+    单个请求的结构化耗时记录：
+    - span() 记录流水线的每个阶段 (可带 attempt 等属性)；
+    - add_span() 记录在 worker 进程中测得的子阶段耗时；
+    - record_usage() 记录 token 用量与解码速度；
+    - finish() 写入 JSONL 追踪文件，并更新 Prometheus 指标。
+    """
+
+    def __init__(self, app, **attrs):
+        self.app = app
+        self.request_id = uuid.uuid4().hex[:12]
+        self.attrs = attrs
+        self.spans = []
+        self.usage = []
+        self._t0 = time.perf_counter()
+        self._started_at = time.time()
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        start = time.perf_counter()
+        record = {"stage": stage, "start": round(start - self._t0, 6), **attrs}
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            self.spans.append(record)
+
+    def add_span(self, stage, seconds, **attrs):
+        self.spans.append({"stage": stage, "seconds": round(seconds, 6), **attrs})
+
+    def add_timings(self, timings, prefix="", **attrs):
+        """批量记录子阶段耗时，例如沙箱 worker 返回的 {"exec": 0.1, "savefig": 0.3}"""
+        for stage, seconds in (timings or {}).items():
+            self.add_span(f"{prefix}{stage}", seconds, **attrs)
+
+    def record_usage(self, usage, decode_seconds=None, ttft=None, **attrs):
+        """记录一次 LLM 调用的 token 用量；decode_seconds 用于计算解码速度 tokens/s"""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        record = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, **attrs}
+        if ttft is not None:
+            record["ttft"] = round(ttft, 6)
+        if decode_seconds:
+            record["tokens_per_second"] = round(completion_tokens / decode_seconds, 2)
+        self.usage.append(record)
+
+    def breakdown(self):
+        """供调试面板展示的表格数据"""
+        rows = [
+            {"阶段": s["stage"], "尝试": s.get("attempt", ""), "耗时 (s)": s["seconds"]}
+            for s in self.spans
+        ]
+        rows.append({"阶段": "total", "尝试": "", "耗时 (s)": round(time.perf_counter() - self._t0, 6)})
+        return rows
+
+    def finish(self, status, trace_file=TRACE_FILE, metrics_file=METRICS_FILE):
+        total = time.perf_counter() - self._t0
+        record = {
+            "request_id": self.request_id,
+            "app": self.app,
+            "timestamp": self._started_at,
+            "status": status,
+            "total_seconds": round(total, 6),
+            "spans": self.spans,
+            "usage": self.usage,
+            **self.attrs,
+        }
+
+        METRICS.inc("cad_agent_requests_total", help_text="Agent requests by final status", app=self.app, status=status)
+        METRICS.observe("cad_agent_request_seconds", total, help_text="End-to-end request latency", app=self.app)
+        for span in self.spans:
+            METRICS.observe("cad_agent_stage_seconds", span["seconds"], help_text="Pipeline stage latency", app=self.app, stage=span["stage"])
+        for usage in self.usage:
+            METRICS.inc("cad_agent_tokens_total", usage["prompt_tokens"], help_text="LLM tokens", app=self.app, kind="prompt")
+            METRICS.inc("cad_agent_tokens_total", usage["completion_tokens"], help_text="LLM tokens", app=self.app, kind="completion")
+            if "tokens_per_second" in usage:
+                METRICS.observe("cad_agent_decode_tokens_per_second", usage["tokens_per_second"], buckets=TOKENS_PER_SECOND_BUCKETS,
+                                help_text="LLM decode throughput", app=self.app)
+
+        try:
+            os.makedirs(os.path.dirname(trace_file) or ".", exist_ok=True)
+            with _TRACE_LOCK:
+                with open(trace_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            METRICS.write_textfile(metrics_file)
+        except OSError as e:
+            logger.warning(f"Writing trace failed: {e}")
+        return record
@@ -1,5 +1,5 @@
-import math
 from pyautocad import Autocad, APoint
+import cad_patterns
 
 def draw_mechanical_flower():
     # 1. 自动连接到当前打开的 AutoCAD 实例
@@ -26,28 +26,20 @@ def draw_mechanical_flower():
     # 绘制中心的一个小装饰圆
     acad.model.AddCircle(center, base_radius / 4)
 
-    # 4. 循环绘制辐射结构
-    for i in range(num_petals):
-        # 计算角度 (将角度转换为弧度)
-        angle_deg = i * (360 / num_petals)
-        angle_rad = math.radians(angle_deg)
-
-        # 计算这一条臂的终点坐标
-        # x = r * cos(theta), y = r * sin(theta)
-        end_x = center_x + arm_length * math.cos(angle_rad)
-        end_y = center_y + arm_length * math.sin(angle_rad)
-        end_point = APoint(end_x, end_y)
-
-        # 绘制连接线
-        # AddLine(起点, 终点)
-        line = acad.model.AddLine(center, end_point)
-        
-        # 绘制末端的圆圈（像花瓣或齿轮）
-        petal_radius = 20
-        acad.model.AddCircle(end_point, petal_radius)
-        
-        # 在末端圆圈里再画一个小圆
-        acad.model.AddCircle(end_point, petal_radius / 3)
+    # 4. 辐射结构：一条臂 (连接线 + 末端两个圆) 定义为块，坐标由 cad_patterns 一次算出，
+    #    插入一次后用 ArrayPolar 在 CAD 内部复制，COM 调用次数与花瓣数量无关
+    petal_radius = 20
+    try:
+        acad.doc.Blocks.Item("PETAL_ARM")
+    except Exception:
+        # 块的基点在臂的末端，连接线指向 -X 方向 (插入时旋转到对应角度后正好指向中心)
+        block = acad.doc.Blocks.Add(APoint(0, 0), "PETAL_ARM")
+        block.AddLine(APoint(0, 0), APoint(-arm_length, 0))
+        block.AddCircle(APoint(0, 0), petal_radius)
+        block.AddCircle(APoint(0, 0), petal_radius / 3)
+
+    petals = cad_patterns.polar((center_x, center_y), arm_length, num_petals)
+    petals.insert_com(acad, "PETAL_ARM", APoint)
 
     # 5. 添加文字说明
     # 文字位置放在图案下方
@@ -0,0 +1,570 @@
+import os
+import io
+import math
+import time
+import queue
+import logging
+import threading
+import traceback
+import contextlib
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from drawing_summary import DrawingSummary
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+DEFAULT_POOL_SIZE = 2           # 常驻 worker 进程数
+DEFAULT_TIMEOUT = 30            # 单个任务的墙钟超时 (秒)
+DEFAULT_MEMORY_LIMIT_MB = 2048  # 单个 worker 的虚拟内存上限 (仅 POSIX 生效)
+
+
+# ================= worker 进程侧 =================
+
+def _limit_memory(memory_limit_mb):
+    """限制 worker 的地址空间，防止生成的代码吃光服务器内存"""
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        # Windows 没有 resource 模块，只能依赖超时兜底
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _peak_rss_kb():
+    """worker 进程的峰值常驻内存 (KB)，供基准测试统计；Windows 上返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Linux 下单位即为 KB
+
+
+def _track_created_docs(ezdxf):
+    """
+    包装 ezdxf.new / ezdxf.readfile，记录执行过程中创建的图纸对象。
+    这样即使 doc 是在函数内部创建的局部变量，也能直接拿到内存中的对象。
+    """
+    created = []
+
+    def _wrap(func):
+        def wrapper(*args, **kwargs):
+            doc = func(*args, **kwargs)
+            created.append(doc)
+            return doc
+        wrapper.__wrapped__ = func
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    ezdxf.new = _wrap(ezdxf.new)
+    ezdxf.readfile = _wrap(ezdxf.readfile)
+    return created
+
+
+def _find_drawing(scope, created_docs, output_file, ezdxf, timings):
+    """按优先级查找生成的图纸：全局变量 doc → 最后创建的图纸 → 磁盘上的输出文件"""
+    from ezdxf.document import Drawing
+
+    doc = scope.get("doc")
+    if isinstance(doc, Drawing):
+        return doc
+    if created_docs:
+        return created_docs[-1]
+    if os.path.exists(output_file):
+        t0 = time.perf_counter()
+        doc = ezdxf.readfile.__wrapped__(output_file)
+        timings["readfile"] = time.perf_counter() - t0
+        return doc
+    return None
+
+
+def _collect_artifacts(doc, job, timings):
+    """在 worker 内直接渲染内存中的图纸，并一次性序列化 DXF"""
+    from cad_render import render_doc_to_image, serialize_doc
+
+    t0 = time.perf_counter()
+    artifacts = {"dxf": serialize_doc(doc), "png": None, "render_error": None}
+    timings["serialize"] = time.perf_counter() - t0
+    if job.get("render", True):
+        img_buffer, img_err = render_doc_to_image(doc, timings=timings)
+        if img_buffer:
+            artifacts["png"] = img_buffer.getvalue()
+        else:
+            artifacts["render_error"] = img_err
+    return artifacts
+
+
+def _digest(summary, timings, t0):
+    """生成图纸概况 (供下一轮请求代替历史代码)，耗时计入 t0 起的 summary 阶段"""
+    digest = summary.digest()
+    timings["summary"] = time.perf_counter() - t0
+    return digest
+
+
+def _run_job(job, ezdxf, created_docs):
+    """在 worker 内执行一段生成的代码，stdout 只捕获本任务自己的输出"""
+    workdir = job["workdir"]
+    output_file = job["output_file"]
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    # 确保每次执行前清理旧文件
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    created_docs.clear()
+    stdout = io.StringIO()
+    import cad_patterns
+
+    scope = {"__name__": "__main__", "ezdxf": ezdxf, "math": math, "patterns": cad_patterns}
+    timings = {}
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(stdout):
+            exec(job["code"], scope)
+    except MemoryError:
+        # 内存超限后 worker 状态不可信，通知主进程回收
+        return {"ok": False, "message": traceback.format_exc(), "stdout": stdout.getvalue(), "recycle": True}
+    except (Exception, SystemExit):
+        timings["exec"] = time.perf_counter() - t0
+        return {"ok": False, "message": traceback.format_exc(), "stdout": stdout.getvalue(), "timings": timings}
+    timings["exec"] = time.perf_counter() - t0
+
+    doc = _find_drawing(scope, created_docs, output_file, ezdxf, timings)
+    created_docs.clear()
+    if doc is None:
+        return {
+            "ok": False,
+            "message": "代码执行没有报错，但没有找到生成的图纸对象。请使用 ezdxf.new() 创建图纸，并赋值给全局变量 doc。",
+            "stdout": stdout.getvalue(),
+            "timings": timings,
+        }
+    result = {"ok": True, "message": "执行成功", "stdout": stdout.getvalue(), "timings": timings}
+    result.update(_collect_artifacts(doc, job, timings))
+    result["digest"] = _digest(DrawingSummary.from_doc(doc), timings, time.perf_counter())
+    return result
+
+
+# ---------- 增量会话 (worker 内常驻的图纸) ----------
+
+def _entity_signatures(msp):
+    """计算模型空间中每个图元的签名 (handle → 导出标签的哈希)，用于找出本轮被修改的图元"""
+    from ezdxf.lldxf.tagwriter import TagCollector
+
+    dxfversion = msp.doc.dxfversion
+    signatures = {}
+    for entity in msp:
+        collector = TagCollector(dxfversion=dxfversion)
+        entity.export_dxf(collector)
+        signatures[entity.dxf.handle] = hash(tuple(tag.dxfstr() for tag in collector.tags))
+    return signatures
+
+
+def _entity_bbox(entity):
+    from ezdxf import bbox
+
+    box = bbox.extents([entity], fast=True)
+    if not box.has_data:
+        return None
+    return (box.extmin.x, box.extmin.y, box.extmax.x, box.extmax.y)
+
+
+def _union_boxes(boxes):
+    boxes = [b for b in boxes if b is not None]
+    if not boxes:
+        return None
+    return (
+        min(b[0] for b in boxes), min(b[1] for b in boxes),
+        max(b[2] for b in boxes), max(b[3] for b in boxes),
+    )
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _reset_session(session, ezdxf, dxf_bytes=None):
+    """(重新) 建立会话图纸：有上一次成功的 DXF 就从它恢复，否则新建空白图纸"""
+    from cad_render import load_doc_from_bytes
+
+    doc = load_doc_from_bytes(dxf_bytes) if dxf_bytes else ezdxf.new.__wrapped__()
+    session.clear()
+    session["doc"] = doc
+    session["good_dxf"] = dxf_bytes
+    session["bboxes"] = {e.dxf.handle: _entity_bbox(e) for e in doc.modelspace()}
+    session["summary"] = DrawingSummary.from_doc(doc, session["bboxes"])
+
+
+def _run_incremental_job(job, ezdxf, created_docs, session):
+    """
+    增量模式：图纸在 worker 中常驻，生成的代码只包含对 doc/msp 的增量操作。
+    执行后找出新增/修改/删除的图元，只渲染受影响的区域。
+    代码执行失败时，从上一次成功的 DXF 回滚，避免留下半成品。
+    """
+    from cad_render import render_doc_to_image, render_region_to_image, serialize_doc
+    import cad_patterns
+
+    if "doc" not in session or job.get("restore_dxf"):
+        _reset_session(session, ezdxf, job.get("restore_dxf"))
+
+    doc = session["doc"]
+    msp = doc.modelspace()
+    timings = {}
+    t0 = time.perf_counter()
+    before = _entity_signatures(msp)
+    timings["snapshot"] = time.perf_counter() - t0
+
+    created_docs.clear()
+    stdout = io.StringIO()
+    scope = {"__name__": "__main__", "ezdxf": ezdxf, "math": math, "doc": doc, "msp": msp, "patterns": cad_patterns}
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(stdout):
+            exec(job["code"], scope)
+    except MemoryError:
+        return {"ok": False, "message": traceback.format_exc(), "stdout": stdout.getvalue(), "recycle": True}
+    except (Exception, SystemExit):
+        message = traceback.format_exc()
+        timings["exec"] = time.perf_counter() - t0
+        _reset_session(session, ezdxf, session.get("good_dxf"))
+        return {"ok": False, "message": message, "stdout": stdout.getvalue(), "timings": timings}
+    finally:
+        created_docs.clear()
+    timings["exec"] = time.perf_counter() - t0
+
+    from ezdxf.document import Drawing
+
+    new_doc = scope.get("doc")
+    if isinstance(new_doc, Drawing) and new_doc is not doc:
+        # 模型没有遵守增量约定而是重建了整张图纸：整体替换并全量渲染
+        doc = session["doc"] = new_doc
+        session["bboxes"] = {e.dxf.handle: _entity_bbox(e) for e in doc.modelspace()}
+        t0 = time.perf_counter()
+        session["summary"] = DrawingSummary.from_doc(doc, session["bboxes"])
+        digest = _digest(session["summary"], timings, t0)
+        result = {"ok": True, "message": "执行成功 (图纸被整体重建)", "stdout": stdout.getvalue()}
+        img_buffer, img_err = render_doc_to_image(doc, timings=timings)
+        delta = {"added": len(session["bboxes"]), "modified": 0, "deleted": len(before), "full_render": True}
+    else:
+        t0 = time.perf_counter()
+        msp = doc.modelspace()
+        after = _entity_signatures(msp)
+        added = after.keys() - before.keys()
+        deleted = before.keys() - after.keys()
+        modified = {h for h in after.keys() & before.keys() if after[h] != before[h]}
+
+        bboxes = session["bboxes"]
+        changed_boxes = [bboxes.pop(h, None) for h in deleted]
+        changed_boxes += [bboxes.get(h) for h in modified]  # 修改前的位置也需要刷新
+        for h in added | modified:
+            bboxes[h] = _entity_bbox(doc.entitydb[h])
+            changed_boxes.append(bboxes[h])
+
+        region = _union_boxes(changed_boxes)
+        timings["diff"] = time.perf_counter() - t0
+        # 概况只按本轮的变更集增量更新
+        t0 = time.perf_counter()
+        session["summary"].update_from_doc(doc, added, modified, deleted, bboxes)
+        digest = _digest(session["summary"], timings, t0)
+        result = {"ok": True, "message": "执行成功", "stdout": stdout.getvalue()}
+        delta = {"added": len(added), "modified": len(modified), "deleted": len(deleted), "full_render": False}
+        if region is None:
+            img_buffer, img_err = None, "本轮没有可见的图元变更"
+        else:
+            t0 = time.perf_counter()
+            entities = [e for e in msp if bboxes.get(e.dxf.handle) and _intersects(bboxes[e.dxf.handle], region)]
+            img_buffer, img_err = render_region_to_image(doc, entities, region)
+            timings["render_region"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    dxf_bytes = serialize_doc(doc)
+    timings["serialize"] = time.perf_counter() - t0
+    session["good_dxf"] = dxf_bytes
+    result.update({
+        "timings": timings,
+        "dxf": dxf_bytes,
+        "png": img_buffer.getvalue() if img_buffer else None,
+        "render_error": img_err,
+        "delta": delta,
+        "digest": digest,
+    })
+    return result
+
+
+def _worker_main(conn, memory_limit_mb):
+    """worker 主循环：提前导入 ezdxf，然后不断从管道中接收任务"""
+    _limit_memory(memory_limit_mb)
+    import ezdxf  # 预热：每个任务都不必再付导入开销
+    import cad_render  # 同时预热 matplotlib 与 drawing 插件
+    import cad_patterns  # 生成代码中可用的 patterns (NumPy 阵列图案)
+    created_docs = _track_created_docs(ezdxf)
+    session = {}  # 增量模式下常驻的图纸状态 (仅专属 worker 使用)
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        try:
+            if job.get("mode") == "incremental":
+                result = _run_incremental_job(job, ezdxf, created_docs, session)
+            else:
+                result = _run_job(job, ezdxf, created_docs)
+        except BaseException:
+            result = {"ok": False, "message": traceback.format_exc(), "stdout": "", "recycle": True}
+        result["peak_rss_kb"] = _peak_rss_kb()
+        conn.send(result)
+        if result.get("recycle"):
+            break
+
+
+# ================= 主进程侧 =================
+
+class _Worker:
+    def __init__(self, ctx, memory_limit_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+
+class SandboxPool:
+    """
+    预启动的沙箱 worker 进程池，用来替代在 Streamlit 进程内直接 exec。
+    - 每个任务有墙钟超时与内存上限，stdout 只属于该任务；
+    - 卡死或崩溃的 worker 会被杀掉，并在后台补充新的 worker，不阻塞其他会话；
+    - 空闲 worker 放在线程安全的队列里，多个 Streamlit 会话按先来后到取用。
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB):
+        self.size = size
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        # spawn 在 Windows / Linux 上行为一致，也不会把 Streamlit 的线程状态 fork 进子进程
+        self._ctx = mp.get_context("spawn")
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        return _Worker(self._ctx, self.memory_limit_mb)
+
+    def _replace_in_background(self):
+        """后台补充一个新 worker，调用方无需等待子进程启动和 ezdxf 导入"""
+        def _start():
+            try:
+                self._idle.put(self._spawn())
+            except Exception as e:
+                logger.error(f"Failed to start sandbox worker: {e}")
+        threading.Thread(target=_start, daemon=True).start()
+
+    def _release(self, worker, keep_worker):
+        if keep_worker:
+            self._idle.put(worker)
+        else:
+            worker.kill()
+            self._replace_in_background()
+
+    def _make_job(self, code, workdir, output_file, render):
+        return {"code": code, "workdir": os.path.abspath(workdir), "output_file": output_file, "render": render}
+
+    @staticmethod
+    def _timeout_result(timeout):
+        return {
+            "ok": False,
+            "message": f"执行超时：代码运行超过 {timeout} 秒被强制终止。请检查是否存在死循环或计算量过大的循环。",
+            "stdout": "",
+        }
+
+    def _crash_result(self, worker):
+        exitcode = worker.process.exitcode
+        logger.error(f"Sandbox worker crashed (exitcode={exitcode}).")
+        return {
+            "ok": False,
+            "message": f"执行进程异常退出 (exitcode={exitcode})，可能是内存占用超过 {self.memory_limit_mb} MB 上限。",
+            "stdout": "",
+        }
+
+    def run(self, code, workdir, output_file, timeout=None, render=True):
+        """
+        在沙箱中执行代码，返回结果字典：
+        {"ok", "message", "stdout"}，成功时另含 {"dxf", "png", "render_error"}。
+        workdir 是该任务的工作目录，生成代码中的相对路径都相对于它。
+        """
+        timeout = timeout or self.timeout
+        job = self._make_job(code, workdir, output_file, render)
+        worker = self._idle.get()
+        keep_worker = True
+
+        try:
+            worker.conn.send(job)
+            if worker.conn.poll(timeout):
+                result = worker.conn.recv()
+                keep_worker = not result.get("recycle")
+            else:
+                logger.warning(f"Sandbox job timed out after {timeout}s, killing worker.")
+                keep_worker = False
+                result = self._timeout_result(timeout)
+        except (EOFError, OSError):
+            keep_worker = False
+            result = self._crash_result(worker)
+        finally:
+            self._release(worker, keep_worker)
+
+        return result
+
+    def race(self, codes, workdir, output_file, timeout=None, render=True):
+        """
+        投机执行：多个候选代码并行运行，每个候选使用 workdir 下独立的子目录。
+        第一个成功的候选获胜，其余仍在运行的候选被立即终止 (worker 在后台补充)。
+        返回 (获胜候选下标 或 None, 每个候选的结果列表)，被取消的候选结果为 None。
+        空闲 worker 不足时，剩余候选排队等待，不会占满整个池子之外的资源。
+        """
+        timeout = timeout or self.timeout
+        pending = list(enumerate(codes))
+        running = {}  # conn -> (候选下标, worker, 开始时间)
+        results = [None] * len(codes)
+        winner = None
+
+        while winner is None and (pending or running):
+            # 1. 把排队的候选分发给空闲 worker (手上没有任务时才阻塞等待)
+            while pending:
+                try:
+                    worker = self._idle.get(block=not running)
+                except queue.Empty:
+                    break
+                idx, code = pending.pop(0)
+                job = self._make_job(code, os.path.join(workdir, f"candidate_{idx}"), output_file, render)
+                try:
+                    worker.conn.send(job)
+                except OSError:
+                    results[idx] = self._crash_result(worker)
+                    self._release(worker, False)
+                    continue
+                running[worker.conn] = (idx, worker, time.monotonic())
+
+            if not running:
+                continue
+
+            # 2. 等待任意一个候选完成，最长等到最早开始的候选超时
+            earliest = min(start for _, _, start in running.values())
+            remaining = max(0.0, earliest + timeout - time.monotonic())
+            for conn in wait(list(running), timeout=remaining):
+                idx, worker, _ = running.pop(conn)
+                keep_worker = True
+                try:
+                    result = conn.recv()
+                    keep_worker = not result.get("recycle")
+                except (EOFError, OSError):
+                    keep_worker = False
+                    result = self._crash_result(worker)
+                self._release(worker, keep_worker)
+                results[idx] = result
+                if result["ok"] and winner is None:
+                    winner = idx
+
+            # 3. 处理超时的候选
+            now = time.monotonic()
+            for conn, (idx, worker, start) in list(running.items()):
+                if now - start >= timeout:
+                    logger.warning(f"Speculative candidate {idx} timed out after {timeout}s.")
+                    running.pop(conn)
+                    results[idx] = self._timeout_result(timeout)
+                    self._release(worker, False)
+
+        # 已有候选获胜，取消其余仍在运行的候选
+        for idx, worker, _ in running.values():
+            logger.info(f"Cancelling speculative candidate {idx}.")
+            self._release(worker, False)
+
+        return winner, results
+
+    def open_session(self):
+        """取出一个专属 worker 用于增量会话，并在后台补充池子，保证其他会话的并发度不变"""
+        worker = self._idle.get()
+        self._replace_in_background()
+        return SandboxSession(self, worker)
+
+    def shutdown(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.kill()
+
+
+class SandboxSession:
+    """
+    增量绘图会话：独占一个 worker 进程，图纸对象在该进程中跨轮次常驻。
+    worker 超时或崩溃时会被替换，并用最近一次成功的 DXF 恢复图纸状态。
+    """
+
+    def __init__(self, pool, worker):
+        self.pool = pool
+        self.worker = worker
+        self.last_dxf = None
+        self._needs_restore = False
+
+    def run(self, code, workdir, timeout=None, seed_dxf=None):
+        """
+        在会话图纸上执行增量代码，返回结果字典 (成功时另含 "delta" 变更统计)。
+        seed_dxf 用于在会话开始时以已有图纸为起点。
+        """
+        timeout = timeout or self.pool.timeout
+        if self.worker is None:
+            self.worker = self.pool._spawn()
+            self._needs_restore = True
+
+        job = {"code": code, "workdir": os.path.abspath(workdir), "mode": "incremental"}
+        if seed_dxf is not None and self.last_dxf is None:
+            job["restore_dxf"] = seed_dxf
+        elif self._needs_restore:
+            job["restore_dxf"] = self.last_dxf
+
+        try:
+            self.worker.conn.send(job)
+            if self.worker.conn.poll(timeout):
+                result = self.worker.conn.recv()
+                if result.get("recycle"):
+                    self._discard_worker()
+            else:
+                logger.warning(f"Incremental job timed out after {timeout}s, restarting session worker.")
+                self._discard_worker()
+                result = self.pool._timeout_result(timeout)
+        except (EOFError, OSError):
+            result = self.pool._crash_result(self.worker)
+            self._discard_worker()
+
+        if result["ok"]:
+            self.last_dxf = result["dxf"]
+            self._needs_restore = False
+        return result
+
+    def _discard_worker(self):
+        self.worker.kill()
+        self.worker = None
+
+    def close(self):
+        if self.worker is not None:
+            try:
+                self.worker.conn.send(None)
+            except OSError:
+                pass
+            self._discard_worker()
@@ -0,0 +1,323 @@
+import json
+import math
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("CAD_Agent")
+
+# ================= 配置区域 =================
+DEFAULT_RESULT_LIMIT = 10      # 每次工具调用最多返回的图元数 (控制回给模型的 token)
+MAX_RESULT_LIMIT = 50
+ENTITIES_PER_CELL = 4          # 网格大小按平均每格约这么多个图元确定
+DIRECTIONS = ("right", "left", "top", "bottom")
+
+# 给模型的提示：附加在本轮需求后 (仅启用空间查询工具时)
+TOOL_HINT = (
+    "如果需求涉及图纸中已有的图元 (例如“最右边的圆”“靠近 (100, 50) 的文字”)，"
+    "先调用空间查询工具 (query_extreme / query_nearest / query_rect) 获取坐标与句柄，"
+    "不要在代码里遍历 msp 查找；拿到结果后再输出代码。"
+)
+
+
+# 工具定义 (OpenAI function calling 格式，与 tool_vllm_qwen.py 相同)
+_FILTER_PROPERTIES = {
+    "type": {"type": "string", "description": "只返回该类型的图元 (DXF 类型名，如 CIRCLE、LINE、TEXT、INSERT)"},
+    "layer": {"type": "string", "description": "只返回该图层上的图元"},
+}
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "query_extreme",
+            "description": "查找某个方向上最靠外的图元，例如“最右边的圆”“最上面的文字”。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "direction": {"type": "string", "enum": list(DIRECTIONS), "description": "方向：right 最右、left 最左、top 最上、bottom 最下"},
+                    "k": {"type": "integer", "description": "返回的图元数，默认 1"},
+                    **_FILTER_PROPERTIES,
+                },
+                "required": ["direction"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "query_nearest",
+            "description": "查找离某个点最近的图元 (按到包围盒的距离)。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "x": {"type": "number", "description": "点的 X 坐标"},
+                    "y": {"type": "number", "description": "点的 Y 坐标"},
+                    "k": {"type": "integer", "description": "返回的图元数，默认 1"},
+                    **_FILTER_PROPERTIES,
+                },
+                "required": ["x", "y"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "query_rect",
+            "description": "查找与矩形区域相交 (或完全位于其中) 的图元。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "xmin": {"type": "number"},
+                    "ymin": {"type": "number"},
+                    "xmax": {"type": "number"},
+                    "ymax": {"type": "number"},
+                    "inside": {"type": "boolean", "description": "true 时只返回完全位于矩形内的图元"},
+                    "limit": {"type": "integer", "description": f"最多返回的图元数，默认 {DEFAULT_RESULT_LIMIT}"},
+                    **_FILTER_PROPERTIES,
+                },
+                "required": ["xmin", "ymin", "xmax", "ymax"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "drawing_stats",
+            "description": "图纸的图元总数、整体范围、各类型与各图层的数量。",
+            "parameters": {"type": "object", "properties": {}},
+        },
+    },
+]
+
+
+def _round(v):
+    return float(f"{v:.6g}")
+
+
+class SpatialIndex:
+    """
+    模型空间图元的空间索引：包围盒保存在 N×4 的 NumPy 数组中，按图元中心落入均匀网格 (松散网格)：
+    - 尺寸不超过一个格子的图元按中心所在格子分桶，矩形/最近邻查询只检查附近的格子；
+    - 更大的图元单独放在 big 列表里，每次查询都向量化地全部检查；
+    - 四个方向的极值顺序在建索引时排好，“最右边的 k 个圆”只需从一端往里找。
+    建立后只读；图纸变化后重新 from_doc / from_records。
+    作为函数调用的工具箱使用：TOOLS 交给模型，模型的 tool_calls 由 call() 执行。
+    """
+
+    TOOLS = TOOLS
+    TOOL_HINT = TOOL_HINT
+
+    def __init__(self, handles, types, layers, boxes, labels=None):
+        self.handles = list(handles)
+        self.labels = list(labels) if labels is not None else [None] * len(self.handles)
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.type_names, type_ids = np.unique(np.asarray(types, dtype=object).astype(str), return_inverse=True)
+        self.layer_names, layer_ids = np.unique(np.asarray(layers, dtype=object).astype(str), return_inverse=True)
+        self.type_ids = type_ids.astype(np.int32)
+        self.layer_ids = layer_ids.astype(np.int32)
+        self._build_grid()
+        self._orders = {
+            "right": np.argsort(-self.boxes[:, 2], kind="stable"),
+            "left": np.argsort(self.boxes[:, 0], kind="stable"),
+            "top": np.argsort(-self.boxes[:, 3], kind="stable"),
+            "bottom": np.argsort(self.boxes[:, 1], kind="stable"),
+        }
+
+    def __len__(self):
+        return len(self.handles)
+
+    # ---------- 建立 ----------
+
+    @classmethod
+    def from_doc(cls, doc):
+        """从 ezdxf 图纸的模型空间建立索引 (没有几何范围的图元不进入索引)"""
+        from ezdxf import bbox
+
+        handles, types, layers, boxes, labels = [], [], [], [], []
+        cache = bbox.Cache()
+        for e in doc.modelspace():
+            box = bbox.extents([e], fast=True, cache=cache)
+            if not box.has_data:
+                continue
+            label = None
+            if e.dxftype() == "TEXT":
+                label = e.dxf.text
+            elif e.dxftype() == "MTEXT":
+                label = e.plain_text()
+            elif e.dxftype() == "INSERT":
+                label = e.dxf.name
+            handles.append(e.dxf.handle)
+            types.append(e.dxftype())
+            layers.append(e.dxf.get("layer", "0"))
+            boxes.append((box.extmin.x, box.extmin.y, box.extmax.x, box.extmax.y))
+            labels.append(label)
+        return cls(handles, types, layers, boxes, labels)
+
+    @classmethod
+    def from_records(cls, records):
+        """从 {handle, type, layer, bbox, text} 字典序列建立 (如 cad_mirror.ModelMirror.query() 的结果)"""
+        records = [r for r in records if r.get("bbox")]
+        return cls([r.get("handle") for r in records], [r["type"] for r in records], [r["layer"] for r in records],
+                   [r["bbox"] for r in records], [r.get("text") for r in records])
+
+    def _build_grid(self):
+        n = len(self.handles)
+        if n == 0:
+            self.origin, self.cell, self.shape = np.zeros(2), 1.0, (1, 1)
+            self._cell_start = np.zeros(2, dtype=np.int64)
+            self._cell_items = np.zeros(0, dtype=np.int64)
+            self.big = np.zeros(0, dtype=np.int64)
+            return
+        lo = self.boxes[:, :2].min(axis=0)
+        hi = self.boxes[:, 2:].max(axis=0)
+        span = np.maximum(hi - lo, 1e-9)
+        # 格子边长：让平均每格约 ENTITIES_PER_CELL 个图元
+        self.cell = float(max(math.sqrt(span[0] * span[1] * ENTITIES_PER_CELL / n), span.max() / 1024, 1e-9))
+        self.origin = lo
+        self.shape = (int(span[0] // self.cell) + 1, int(span[1] // self.cell) + 1)
+
+        sizes = np.maximum(self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1])
+        small = sizes <= self.cell
+        self.big = np.nonzero(~small)[0]
+        items = np.nonzero(small)[0]
+        cell_ids = self._cell_id(self._centers(items))
+        order = np.argsort(cell_ids, kind="stable")
+        self._cell_items = items[order]
+        # CSR：格子 c 中的图元为 _cell_items[_cell_start[c]:_cell_start[c + 1]]
+        counts = np.bincount(cell_ids, minlength=self.shape[0] * self.shape[1])
+        self._cell_start = np.concatenate([[0], np.cumsum(counts)])
+
+    def _centers(self, idx):
+        b = self.boxes[idx]
+        return np.column_stack([(b[:, 0] + b[:, 2]) / 2, (b[:, 1] + b[:, 3]) / 2])
+
+    def _cell_xy(self, points):
+        xy = np.floor((np.asarray(points, dtype=np.float64) - self.origin) / self.cell).astype(np.int64)
+        return np.clip(xy, 0, [self.shape[0] - 1, self.shape[1] - 1])
+
+    def _cell_id(self, points):
+        xy = self._cell_xy(points).reshape(-1, 2)
+        return xy[:, 0] * self.shape[1] + xy[:, 1]
+
+    def _cells_in(self, x0, y0, x1, y1):
+        """格子范围 [x0, x1] × [y0, y1] 内的全部图元序号"""
+        parts = [self._cell_items[self._cell_start[cx * self.shape[1] + y0]:self._cell_start[cx * self.shape[1] + y1 + 1]]
+                 for cx in range(x0, x1 + 1)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    # ---------- 过滤 ----------
+
+    def _filter(self, idx, type=None, layer=None):
+        if type:
+            wanted = np.nonzero(np.char.upper(self.type_names.astype(str)) == type.upper())[0]
+            idx = idx[np.isin(self.type_ids[idx], wanted)]
+        if layer:
+            wanted = np.nonzero(np.char.lower(self.layer_names.astype(str)) == layer.lower())[0]
+            idx = idx[np.isin(self.layer_ids[idx], wanted)]
+        return idx
+
+    def _describe(self, i, distance=None):
+        b = self.boxes[i]
+        item = {
+            "handle": self.handles[i],
+            "type": str(self.type_names[self.type_ids[i]]),
+            "layer": str(self.layer_names[self.layer_ids[i]]),
+            "bbox": [_round(v) for v in b],
+            "center": [_round((b[0] + b[2]) / 2), _round((b[1] + b[3]) / 2)],
+        }
+        if self.labels[i]:
+            item["text"] = self.labels[i]
+        if distance is not None:
+            item["distance"] = _round(distance)
+        return item
+
+    # ---------- 查询 ----------
+
+    def query_rect(self, xmin, ymin, xmax, ymax, type=None, layer=None, limit=DEFAULT_RESULT_LIMIT, inside=False):
+        """与矩形相交 (inside=True 时为完全位于矩形内) 的图元，按到矩形中心的距离排序"""
+        if len(self) == 0:
+            return []
+        half = self.cell / 2  # 按中心分桶：图元最多超出其格子半个格长
+        (x0, y0), (x1, y1) = self._cell_xy([[xmin - half, ymin - half], [xmax + half, ymax + half]])
+        idx = np.concatenate([self._cells_in(x0, y0, x1, y1), self.big])
+        b = self.boxes[idx]
+        if inside:
+            mask = (b[:, 0] >= xmin) & (b[:, 1] >= ymin) & (b[:, 2] <= xmax) & (b[:, 3] <= ymax)
+        else:
+            mask = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+        idx = self._filter(idx[mask], type, layer)
+        c = self._centers(idx)
+        order = np.argsort(np.hypot(c[:, 0] - (xmin + xmax) / 2, c[:, 1] - (ymin + ymax) / 2), kind="stable")
+        return [self._describe(i) for i in idx[order][:limit]]
+
+    def _box_distance(self, idx, x, y):
+        b = self.boxes[idx]
+        dx = np.maximum(np.maximum(b[:, 0] - x, 0), x - b[:, 2])
+        dy = np.maximum(np.maximum(b[:, 1] - y, 0), y - b[:, 3])
+        return np.hypot(dx, dy)
+
+    def query_nearest(self, x, y, k=1, type=None, layer=None):
+        """离点 (x, y) 最近的 k 个图元 (按到包围盒的距离，点在包围盒内时距离为 0)，由近到远"""
+        if len(self) == 0:
+            return []
+        cx, cy = self._cell_xy([x, y])
+        max_r = max(self.shape)
+        r = 0
+        while True:
+            x0, y0 = max(cx - r, 0), max(cy - r, 0)
+            x1, y1 = min(cx + r, self.shape[0] - 1), min(cy + r, self.shape[1] - 1)
+            idx = self._filter(np.concatenate([self._cells_in(x0, y0, x1, y1), self.big]), type, layer)
+            d = self._box_distance(idx, x, y)
+            # 未检查的格子中，图元到点的距离至少为 r 个格长减去半个格长
+            if r >= max_r or (len(idx) >= k and np.partition(d, k - 1)[k - 1] <= r * self.cell - self.cell / 2):
+                break
+            r = max(1, r * 2)
+        order = np.argsort(d, kind="stable")[:k]
+        return [self._describe(idx[i], d[i]) for i in order]
+
+    def query_extreme(self, direction, k=1, type=None, layer=None):
+        """某个方向上最靠外的 k 个图元：right / left / top / bottom (按包围盒的对应边)"""
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction 必须是 {DIRECTIONS} 之一")
+        found = []
+        order = self._orders[direction]
+        # 从极值一端分段往里找，满足过滤条件的凑够 k 个即停
+        chunk = max(64, k * 4)
+        for start in range(0, len(order), chunk):
+            found.extend(self._filter(order[start:start + chunk], type, layer).tolist())
+            if len(found) >= k:
+                break
+        return [self._describe(i) for i in found[:k]]
+
+    def stats(self):
+        """图元总数、类型与图层分布、整体范围"""
+        if len(self) == 0:
+            return {"count": 0}
+        return {
+            "count": len(self),
+            "extents": [_round(v) for v in (*self.boxes[:, :2].min(axis=0), *self.boxes[:, 2:].max(axis=0))],
+            "types": {str(t): int(c) for t, c in zip(self.type_names, np.bincount(self.type_ids, minlength=len(self.type_names)))},
+            "layers": {str(l): int(c) for l, c in zip(self.layer_names, np.bincount(self.layer_ids, minlength=len(self.layer_names)))},
+        }
+
+    # ---------- 工具调用 ----------
+
+    def call(self, name, arguments):
+        """执行模型发起的工具调用 (arguments 为 JSON 字符串或字典)，返回 JSON 字符串；参数错误时返回 {"error": ...}"""
+        try:
+            args = json.loads(arguments) if isinstance(arguments, str) else dict(arguments or {})
+            limit = max(1, min(int(args.pop("limit", args.pop("k", DEFAULT_RESULT_LIMIT if name == "query_rect" else 1))), MAX_RESULT_LIMIT))
+            if name == "query_rect":
+                result = self.query_rect(limit=limit, **args)
+            elif name == "query_nearest":
+                result = self.query_nearest(k=limit, **args)
+            elif name == "query_extreme":
+                result = self.query_extreme(k=limit, **args)
+            elif name == "drawing_stats":
+                result = self.stats()
+            else:
+                return json.dumps({"error": f"未知工具: {name}"}, ensure_ascii=False)
+        except (TypeError, ValueError, KeyError) as e:
+            return json.dumps({"error": f"参数错误: {e}"}, ensure_ascii=False)
+        return json.dumps(result, ensure_ascii=False)
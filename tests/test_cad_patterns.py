@@ -0,0 +1,132 @@
+import math
+
+import ezdxf
+import numpy as np
+import pytest
+
+import cad_patterns as patterns
+from fake_acad import FakeAcad, APoint
+
+
+def test_polar_full_circle_spacing():
+    p = patterns.polar((10, 20), 5, 4, start_angle=90)
+    np.testing.assert_allclose(p.points, [(10, 25), (5, 20), (10, 15), (15, 20)], atol=1e-12)
+    np.testing.assert_allclose(p.rotations, [0, 90, 180, 270])
+    assert p.polar == ((10.0, 20.0), 4, 360.0)
+
+
+def test_polar_partial_angle_includes_both_ends():
+    p = patterns.polar((0, 0), 10, 3, angle=90)
+    np.testing.assert_allclose(p.points, [(10, 0), (10 * math.cos(math.pi / 4), 10 * math.sin(math.pi / 4)), (0, 10)], atol=1e-12)
+    assert patterns.polar((0, 0), 10, 3, rotate=False).polar is None
+
+
+def test_rect_grid_layout():
+    p = patterns.rect((1, 2), rows=2, columns=3, row_spacing=10, column_spacing=5)
+    assert len(p) == 6
+    np.testing.assert_allclose(p.points[0], (1, 2))
+    np.testing.assert_allclose(p.points[-1], (11, 12))
+    assert p.grid == (2, 3, 10.0, 5.0)
+
+
+def test_along_path_count_and_spacing():
+    square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+    p = patterns.along_path(square, count=4, closed=True)
+    np.testing.assert_allclose(p.points, square, atol=1e-12)
+    np.testing.assert_allclose(p.rotations, [0, 90, 180, -90])
+
+    p = patterns.along_path([(0, 0), (10, 0)], spacing=2.5)
+    np.testing.assert_allclose(p.points[:, 0], [0, 2.5, 5, 7.5, 10])
+
+    p = patterns.along_path(square, spacing=10, closed=True)
+    assert len(p) == 4  # 闭合路径的终点与起点重合，不重复
+    with pytest.raises(ValueError):
+        patterns.along_path([(0, 0), (0, 0)], count=3)
+    with pytest.raises(ValueError):
+        patterns.along_path(square)
+
+
+def test_transforms():
+    grid = patterns.rect((0, 0), 2, 2, 1, 1)
+    moved = grid.translate(5, 0)
+    assert moved.grid == grid.grid
+    np.testing.assert_allclose(moved.points[0], (5, 0))
+
+    rotated = grid.rotate(90)
+    assert rotated.grid is None
+    np.testing.assert_allclose(rotated.points[-1], (-1, 1), atol=1e-12)
+    np.testing.assert_allclose(rotated.rotations, 90)
+
+    ring = patterns.polar((0, 0), 1, 4).translate(3, 4)
+    assert ring.polar[0] == (3, 4)
+
+    one = patterns.points([(2, 1)], rotations=[30])
+    both = one.mirror((0, 0), (0, 1))  # 以 Y 轴为对称轴
+    np.testing.assert_allclose(both.points, [(2, 1), (-2, 1)])
+    np.testing.assert_allclose(both.rotations, [30, 150])
+    assert both.flipped.tolist() == [False, True]
+    assert len(one.mirror((0, 0), (0, 1), keep=False)) == 1
+
+
+def _doc_with_block():
+    doc = ezdxf.new()
+    doc.blocks.new("BOLT").add_circle((0, 0), 1)
+    return doc
+
+
+def test_insert_grid_as_single_minsert():
+    doc = _doc_with_block()
+    msp = doc.modelspace()
+    refs = patterns.rect((0, 0), 3, 4, 10, 5).insert(msp, "BOLT")
+    assert len(refs) == 1 and len(msp) == 1
+    insert = refs[0]
+    assert (insert.dxf.row_count, insert.dxf.column_count) == (3, 4)
+    assert len(list(insert.multi_insert())) == 12
+
+
+def test_insert_rotated_and_mirrored_per_point():
+    doc = _doc_with_block()
+    msp = doc.modelspace()
+    p = patterns.polar((0, 0), 10, 6).mirror((0, 0), (1, 0), keep=True)
+    refs = p.insert(msp, "BOLT", scale=2)
+    assert len(refs) == 12
+    assert [r.dxf.yscale for r in refs] == [2] * 6 + [-2] * 6
+    np.testing.assert_allclose([r.dxf.rotation for r in refs[:6]], p.rotations[:6])
+
+    circles = patterns.points([(0, 0), (5, 5)]).add_circles(msp, 1.5)
+    assert [c.dxf.radius for c in circles] == [1.5, 1.5]
+
+
+def _fake_with_block():
+    fake = FakeAcad()
+    blk = fake.doc.Blocks.Add(APoint(0, 0), "BOLT")
+    blk.AddCircle(APoint(0, 0), 1)
+    return fake
+
+
+def test_insert_com_grid_uses_minsert():
+    fake = _fake_with_block()
+    refs = patterns.rect((0, 0), 2, 3, 10, 5).insert_com(fake, "BOLT", APoint, layer="0")
+    assert len(refs) == 1
+    (insert,) = fake.dxf_doc.modelspace()
+    assert (insert.dxf.row_count, insert.dxf.column_count) == (2, 3)
+
+
+def test_insert_com_polar_matches_pattern():
+    for angle in (360, 120):
+        fake = _fake_with_block()
+        p = patterns.polar((5, 5), 10, 4, start_angle=30, angle=angle)
+        refs = p.insert_com(fake, "BOLT", APoint)
+        assert len(refs) == 4
+        inserts = list(fake.dxf_doc.modelspace())
+        got = sorted((round(e.dxf.insert.x, 6), round(e.dxf.insert.y, 6)) for e in inserts)
+        expected = sorted((round(x, 6), round(y, 6)) for x, y in p.points.tolist())
+        assert got == expected
+
+
+def test_insert_com_per_point_and_circles():
+    fake = _fake_with_block()
+    p = patterns.along_path([(0, 0), (30, 0)], count=4)
+    assert len(p.insert_com(fake, "BOLT", APoint)) == 4
+    assert len(p.add_circles_com(fake, 2, APoint)) == 4
+    assert len(fake.dxf_doc.modelspace()) == 8
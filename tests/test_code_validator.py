@@ -0,0 +1,65 @@
+import os
+import sys
+import subprocess
+
+from code_validator import validate_code
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BBOX_CODE = (
+    "import ezdxf\n"
+    "doc = ezdxf.new()\n"
+    "msp = doc.modelspace()\n"
+    "msp.add_line((0, 0), (10, 0))\n"
+    "box = ezdxf.bbox.extents(msp)\n"
+)
+
+
+def test_ezdxf_submodule_accepted_in_fresh_process():
+    # 新进程中 ezdxf.bbox 尚未被任何模块导入，校验结果不能依赖导入历史
+    script = (
+        "from code_validator import validate_code\n"
+        f"ok, _code, error, _fixes = validate_code({BBOX_CODE!r})\n"
+        "print(ok, error)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.startswith("True"), result.stdout
+
+
+def test_explicit_submodule_import_accepted():
+    ok, _code, error, _fixes = validate_code("import ezdxf.bbox\n" + BBOX_CODE)
+    assert ok, error
+
+
+def test_unknown_ezdxf_attribute_rejected():
+    ok, _code, error, _fixes = validate_code("import ezdxf\ndoc = ezdxf.nwe()\n")
+    assert not ok
+    assert "nwe" in error and "new" in error
+
+
+def test_unknown_method_on_modelspace_rejected():
+    ok, _code, error, _fixes = validate_code("import ezdxf\ndoc = ezdxf.new()\nmsp = doc.modelspace()\nmsp.add_cirle((0, 0), 1)\n")
+    assert not ok
+    assert "add_circle" in error
+
+
+def test_forbidden_calls_and_modules():
+    ok, _code, error, _fixes = validate_code("import subprocess\nsubprocess.run(['ls'])\n")
+    assert not ok and "subprocess" in error
+    ok, _code, error, _fixes = validate_code("import time\ntime.sleep(1)\n")
+    assert not ok and "time.sleep" in error
+
+
+def test_drawing_handoff_appended():
+    ok, code, _error, fixes = validate_code("import ezdxf\ndrawing = ezdxf.new()\n")
+    assert ok
+    assert code.rstrip().endswith("doc = drawing")
+    assert fixes
+
+
+def test_pyautocad_argument_count():
+    ok, _code, error, _fixes = validate_code("acad.model.AddCircle(APoint(0, 0))\n", api="pyautocad")
+    assert not ok and "AddCircle" in error
+    ok, _code, error, _fixes = validate_code("acad.model.AddCircle(APoint(0, 0), 5)\n", api="pyautocad")
+    assert ok, error
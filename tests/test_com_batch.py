@@ -0,0 +1,204 @@
+from com_batch import BatchingAcad
+from fake_acad import FakeAcad, APoint, aDouble
+
+
+class RecordingObserver:
+    def __init__(self):
+        self.writes = []
+        self.stale = []
+
+    def record_writes(self, writes):
+        self.writes.extend(writes)
+
+    def mark_stale(self, reason):
+        self.stale.append(reason)
+
+
+def make_batch(**kwargs):
+    fake = FakeAcad()
+    return fake, BatchingAcad(fake, make_array=aDouble, **kwargs)
+
+
+def test_chain_of_lines_merged_into_polyline():
+    fake, acad = make_batch()
+    pts = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+    for a, b in zip(pts, pts[1:]):
+        acad.model.AddLine(APoint(*a), APoint(*b))
+    assert acad.flush() == 2  # 一条多段线 + Closed
+    entities = list(fake.dxf_doc.modelspace())
+    assert [e.dxftype() for e in entities] == ["LWPOLYLINE"]
+    assert entities[0].closed
+    assert acad.stats["merged_lines"] == 4
+
+
+def test_referenced_line_not_merged_and_ops_applied():
+    fake, acad = make_batch()
+    fake.doc.Layers.Add("墙")
+    line = acad.model.AddLine(APoint(0, 0), APoint(10, 0))
+    acad.model.AddLine(APoint(10, 0), APoint(20, 0))
+    line.Layer = "墙"
+    acad.flush()
+    types = sorted(e.dxftype() for e in fake.dxf_doc.modelspace())
+    assert types == ["LINE", "LINE"]
+    assert line.Layer == "墙"
+
+
+def test_method_call_resolves_placeholder_arguments():
+    fake, acad = make_batch()
+    boundary = acad.model.AddCircle(APoint(0, 0), 5)
+    hatch = acad.model.AddHatch(0, "SOLID", True)
+    # hatch 的方法调用会先提交，参数中的 boundary 占位对象必须替换为真实图元
+    hatch.AppendOuterLoop([boundary])
+    hatch.Evaluate()
+    hatch_entity = [e for e in fake.dxf_doc.modelspace() if e.dxftype() == "HATCH"][0]
+    assert len(hatch_entity.paths) == 1
+
+
+def test_method_call_resolves_keyword_and_tuple_arguments():
+    calls = []
+
+    class Target:
+        def Use(self, *args, **kwargs):
+            calls.append((args, kwargs))
+
+    fake, acad = make_batch()
+    first = acad.model.AddCircle(APoint(0, 0), 1)
+    acad.flush()
+    object.__setattr__(first, "_record", {**first._record, "real": Target()})
+    second = acad.model.AddCircle(APoint(5, 0), 1)
+    first.Use((second,), other=[second])
+    (args, kwargs), = calls
+    assert type(args[0][0]).__name__ == "FakeEntity"
+    assert type(kwargs["other"][0]).__name__ == "FakeEntity"
+
+
+def test_discard_leaves_drawing_unchanged():
+    fake, acad = make_batch()
+    acad.model.AddCircle(APoint(0, 0), 5)
+    acad.discard()
+    assert acad.flush() == 0
+    assert len(fake.dxf_doc.modelspace()) == 0
+
+
+def test_failed_flush_rolls_back_created_entities():
+    fake, acad = make_batch()
+    acad.model.AddCircle(APoint(0, 0), 5)
+    acad.model.AddCircle(APoint(0, 0), -1)  # 半径非法，替身抛出异常
+    try:
+        acad.flush()
+    except Exception:
+        pass
+    else:
+        raise AssertionError("flush should fail")
+    assert len(fake.dxf_doc.modelspace()) == 0
+
+
+def test_script_mode_restores_osmode_and_closes_undo_inside_script():
+    events = []
+    fake, acad = make_batch(use_script=True)
+    fake.doc._variables["OSMODE"] = 4133
+    fake.doc.StartUndoMark = lambda: events.append("start")
+    fake.doc.EndUndoMark = lambda: events.append("end")
+    fake.doc.SendCommand = lambda text: events.append(text)
+    acad.model.AddCircle(APoint(0, 0), 5)
+    acad.model.AddPoint(APoint(1, 1))
+    acad.flush()
+
+    assert events[0] == "start"
+    assert "end" not in events  # 撤销组由脚本自己结束
+    script = events[1].splitlines()
+    assert script[0] == "_.SETVAR OSMODE 0"
+    assert script[-2:] == ["_.SETVAR OSMODE 4133", "_.UNDO _E"]
+    assert fake.doc.GetVariable("OSMODE") == 4133  # 不在脚本执行前恢复
+
+
+def test_script_send_failure_still_closes_undo_mark():
+    events = []
+    fake, acad = make_batch(use_script=True)
+    fake.doc.EndUndoMark = lambda: events.append("end")
+
+    def fail(_text):
+        raise RuntimeError("busy")
+    fake.doc.SendCommand = fail
+    acad.model.AddPoint(APoint(1, 1))
+    try:
+        acad.flush()
+    except RuntimeError:
+        pass
+    assert events == ["end"]
+
+
+def test_observer_receives_writes():
+    fake = FakeAcad()
+    observer = RecordingObserver()
+    acad = BatchingAcad(fake, make_array=aDouble, observer=observer)
+    acad.model.AddCircle(APoint(0, 0), 5)
+    acad.flush()
+    assert [w[0] for w in observer.writes] == ["AddCircle"]
+    assert observer.stale == []
+
+
+class HandleDocAcad(FakeAcad):
+    """替身的 HandleToObject 只用于试运行 (总是报不支持)，这里按句柄查 ezdxf 图元"""
+
+    def __init__(self):
+        super().__init__()
+        fake = self
+
+        def handle_to_object(handle):
+            from fake_acad import FakeEntity
+            return FakeEntity(fake.model, fake.dxf_doc.entitydb[handle])
+        self.doc.HandleToObject = handle_to_object
+
+
+def test_doc_lookup_and_block_definition_do_not_mark_stale():
+    from cad_mirror import ModelMirror
+
+    fake = HandleDocAcad()
+    existing = fake.dxf_doc.modelspace().add_circle((0, 0), 3)
+    mirror = ModelMirror()
+    acad = BatchingAcad(fake, make_array=aDouble, observer=mirror)
+
+    obj = acad.doc.HandleToObject(existing.dxf.handle)
+    assert obj.Radius == 3
+    assert obj.GetBoundingBox()
+    block = acad.doc.Blocks.Add(APoint(0, 0), "BOLT")
+    block.AddCircle(APoint(0, 0), 1)
+    acad.model.InsertBlock(APoint(5, 5), "BOLT", 1, 1, 1, 0)
+    acad.flush()
+
+    assert mirror.stale_reason is None
+    assert mirror.defined_blocks == {"BOLT"}
+    assert [e["type"] for e in mirror.query()] == ["INSERT"]
+
+
+def test_modifying_looked_up_object_marks_stale():
+    from cad_mirror import ModelMirror
+
+    fake = HandleDocAcad()
+    existing = fake.dxf_doc.modelspace().add_circle((0, 0), 3)
+    mirror = ModelMirror()
+    acad = BatchingAcad(fake, make_array=aDouble, observer=mirror)
+    acad.doc.HandleToObject(existing.dxf.handle).Delete()
+    assert mirror.stale_reason == "Delete"
+
+
+def test_tracked_object_unwrapped_in_batched_calls():
+    fake = HandleDocAcad()
+    circle = fake.dxf_doc.modelspace().add_circle((0, 0), 3)
+    acad = BatchingAcad(fake, make_array=aDouble)
+    boundary = acad.doc.HandleToObject(circle.dxf.handle)
+    hatch = acad.model.AddHatch(0, "SOLID", True)
+    hatch.AppendOuterLoop([boundary])
+    hatch_entity = [e for e in fake.dxf_doc.modelspace() if e.dxftype() == "HATCH"][0]
+    assert len(hatch_entity.paths) == 1
+
+
+def test_other_document_access_still_marks_stale():
+    from cad_mirror import ModelMirror
+
+    fake = FakeAcad()
+    mirror = ModelMirror()
+    acad = BatchingAcad(fake, make_array=aDouble, observer=mirror)
+    acad.doc.Regen(1)
+    assert mirror.stale_reason == "Regen"
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+import pytest
+
+from com_worker import ComWorker, ComSessionBusy
+from fake_acad import FakeAcad
+
+
+@pytest.fixture
+def worker():
+    w = ComWorker(connect=FakeAcad, name="test-com-worker")
+    yield w
+    w.shutdown()
+
+
+def test_run_returns_result_and_info(worker):
+    value, info = worker.run(lambda acad: acad.doc.Name, "s1")
+    assert value == "DryRun.dwg"
+    assert info["reconnected"] is True
+    assert worker.doc_name == "DryRun.dwg"
+
+
+def test_queued_job_cancelled_on_timeout(worker):
+    release = threading.Event()
+    started = threading.Event()
+    ran = []
+
+    def blocker(_acad):
+        started.set()
+        release.wait(5)
+
+    worker.submit(blocker, "other")
+    assert started.wait(5)
+    with pytest.raises(FuturesTimeout):
+        worker.run(lambda acad: ran.append(1), "s1", timeout=0.05)
+    assert worker.pending() == 0
+    assert not worker.busy("s1")  # 排队中的任务已取消，会话可以立即重试
+
+    release.set()
+    worker.run(lambda acad: None, "s1")
+    assert ran == []
+
+
+def test_running_job_blocks_session_until_finished(worker):
+    release = threading.Event()
+    done = threading.Event()
+
+    def slow(_acad):
+        release.wait(5)
+        done.set()
+
+    with pytest.raises(FuturesTimeout):
+        worker.run(slow, "s1", timeout=0.05)
+    assert worker.busy("s1")
+    with pytest.raises(ComSessionBusy):
+        worker.submit(lambda acad: None, "s1")
+    # 其他会话不受影响 (排在超时任务之后执行)
+    other = worker.submit(lambda acad: "ok", "s2")
+
+    release.set()
+    assert done.wait(5)
+    assert other.result(5)[0] == "ok"
+    assert not worker.busy("s1")
+    assert worker.run(lambda acad: "again", "s1")[0] == "again"
@@ -0,0 +1,32 @@
+from context_compactor import ContextCompactor
+
+
+def _code_reply(body):
+    return {"role": "assistant", "content": f"```python\n{body}\n```"}
+
+
+def _history_with_retry():
+    return [
+        {"role": "user", "content": "指令" * 50 + "画一个配电柜"},
+        _code_reply("doc = ezdxf.new()\nmsp = doc.modelspace()\nmsp.add_line((0, 0), (10, 0))  # working"),
+        {"role": "user", "content": "在配电柜右侧增加三个回路，每个回路标注电缆型号与长度" * 10},
+        _code_reply("msp.add_circle((0, 0), 5)  # failed attempt 1"),
+        {"role": "user", "content": "执行代码报错：\nNameError: name 'msp' is not defined\n请修复代码并确保最终图纸赋值给变量 doc。"},
+        _code_reply("msp.add_circle((0, 0), 5)  # failed attempt 2"),
+        {"role": "user", "content": "执行代码报错：\nNameError: name 'msp' is not defined\n请修复代码并确保最终图纸赋值给变量 doc。"},
+    ]
+
+
+def test_keeps_latest_working_code_and_current_attempt():
+    compacted, _stats = ContextCompactor(token_budget=100_000).compact(_history_with_retry())
+    assert "# working" in compacted[1]["content"]
+    assert "failed attempt 1" not in compacted[3]["content"]
+    assert "failed attempt 2" in compacted[5]["content"]
+
+
+def test_latest_user_request_survives_budget_pressure():
+    history = _history_with_retry()
+    compacted, _stats = ContextCompactor(token_budget=10).compact(history)
+    assert compacted[2]["content"] == history[2]["content"]
+    assert compacted[-1]["content"] == history[-1]["content"]
+    assert compacted[0]["content"] == history[0]["content"]
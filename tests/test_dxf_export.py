@@ -0,0 +1,91 @@
+import io
+import gzip
+import zipfile
+
+import ezdxf
+import pytest
+
+from cad_render import serialize_doc
+from dxf_export import (
+    export_doc, export_dxf_bytes, read_dxf_bytes, strip_unused_tables, download_name, compress, BINARY_SENTINEL,
+)
+
+
+def make_doc():
+    doc = ezdxf.new(setup=True)
+    msp = doc.modelspace()
+    doc.layers.add("中心线", linetype="CENTER")
+    msp.add_line((0, 0), (10, 0), dxfattribs={"linetype": "DASHED"})
+    msp.add_circle((5, 5), 2, dxfattribs={"layer": "中心线"})
+    msp.add_text("标题", dxfattribs={"style": "OpenSans", "insert": (0, 20)})
+    msp.add_linear_dim(base=(0, 5), p1=(0, 0), p2=(10, 0), dimstyle="EZDXF").render()
+    return doc
+
+
+def test_strip_keeps_referenced_entries():
+    doc = make_doc()
+    removed = strip_unused_tables(doc)
+    assert all(n > 0 for n in removed.values())
+    linetypes = {e.dxf.name.upper() for e in doc.linetypes}
+    styles = {e.dxf.name.upper() for e in doc.styles}
+    dimstyles = {e.dxf.name.upper() for e in doc.dimstyles}
+    assert {"BYBLOCK", "BYLAYER", "CONTINUOUS", "DASHED", "CENTER"} <= linetypes  # 图元与图层引用的线型
+    assert "DASHDOT" not in linetypes
+    assert {"STANDARD", "OPENSANS"} <= styles
+    assert doc.dimstyles.get("EZDXF").dxf.dimtxsty.upper() in styles
+    assert dimstyles == {"STANDARD", "EZDXF"}
+    assert not doc.audit().has_errors
+
+
+def test_strip_keeps_styles_referenced_only_by_dimstyle():
+    # 引线只引用标注样式本身，样式中的文字样式与线型没有任何图元直接使用
+    doc = ezdxf.new(setup=True)
+    doc.dimstyles.new("MYDIM", dxfattribs={"dimtxsty": "LiberationSerif", "dimltype": "DASHDOT"})
+    doc.modelspace().add_leader([(0, 0), (10, 10)], dimstyle="MYDIM")
+    strip_unused_tables(doc)
+    assert "LiberationSerif" in doc.styles
+    assert "DASHDOT" in doc.linetypes
+    assert "MYDIM" in doc.dimstyles
+    loaded = read_dxf_bytes(export_doc(doc, binary=True)[0])
+    assert loaded.dimstyles.get("MYDIM").dxf.dimtxsty == "LiberationSerif"
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("compression", [None, "gzip", "zip"])
+@pytest.mark.parametrize("minimal", [False, True])
+def test_export_round_trip(binary, compression, minimal):
+    doc = make_doc()
+    data, name, mime = export_doc(doc, binary=binary, compression=compression, minimal=minimal)
+    assert (name, mime) == download_name(binary, compression)
+    if compression is None:
+        assert data.startswith(BINARY_SENTINEL) == binary
+    loaded = read_dxf_bytes(data)
+    assert sorted(e.dxftype() for e in loaded.modelspace()) == ["CIRCLE", "DIMENSION", "LINE", "TEXT"]
+    assert not loaded.audit().has_errors
+
+
+def test_export_dxf_bytes_compress_only_keeps_original_bytes():
+    ascii_bytes = serialize_doc(make_doc())
+    data, name, _mime = export_dxf_bytes(ascii_bytes, compression="gzip")
+    assert name == "drawing.dxf.gz"
+    assert gzip.decompress(data) == ascii_bytes
+    data, name, _mime = export_dxf_bytes(ascii_bytes, compression="zip", file_stem="part")
+    assert name == "part.zip"
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == ["part.dxf"]
+        assert zf.read("part.dxf") == ascii_bytes
+    assert export_dxf_bytes(ascii_bytes)[0] is ascii_bytes
+
+
+def test_minimal_and_binary_smaller_than_ascii():
+    ascii_bytes = serialize_doc(make_doc())
+    minimal = export_dxf_bytes(ascii_bytes, minimal=True)[0]
+    binary = export_dxf_bytes(ascii_bytes, binary=True)[0]
+    assert len(minimal) < len(ascii_bytes)
+    assert len(binary) < len(ascii_bytes)
+
+
+def test_gzip_is_deterministic_and_bad_compression_rejected():
+    assert compress(b"abc", "gzip", "x.dxf") == compress(b"abc", "gzip", "x.dxf")
+    with pytest.raises(ValueError):
+        compress(b"abc", "bz2", "x.dxf")
@@ -0,0 +1,119 @@
+from fake_acad import dry_run
+
+
+def test_helper_function_sees_exec_scope():
+    code = (
+        "def segment(x1, y1, x2, y2):\n"
+        "    return acad.model.AddLine(APoint(x1, y1), APoint(x2, y2))\n"
+        "\n"
+        "for i in range(3):\n"
+        "    segment(0, i * 10, 50, i * 10)\n"
+    )
+    ok, err, _stdout, artifacts = dry_run(code, render=False)
+    assert ok, err
+    assert artifacts["entities"] == 3
+
+
+def test_comprehension_sees_exec_scope():
+    code = (
+        "pts = [APoint(math.cos(a) * 10, math.sin(a) * 10) for a in (0, math.pi / 2, math.pi)]\n"
+        "circles = [acad.model.AddCircle(p, 2) for p in pts]\n"
+    )
+    ok, err, _stdout, artifacts = dry_run(code, render=False)
+    assert ok, err
+    assert artifacts["entities"] == 3
+
+
+def test_extra_scope_visible_inside_functions():
+    code = (
+        "def draw():\n"
+        "    return extra_radius\n"
+        "acad.model.AddCircle(APoint(0, 0), draw())\n"
+    )
+    ok, err, _stdout, artifacts = dry_run(code, render=False, scope={"extra_radius": 5.0})
+    assert ok, err
+    assert artifacts["entities"] == 1
+
+
+def test_real_errors_still_reported():
+    ok, err, _stdout, _artifacts = dry_run("acad.model.AddCircle(APoint(0, 0))\n", render=False)
+    assert not ok
+    assert "TypeError" in err
+
+
+def test_hatch_with_circle_boundary():
+    code = (
+        "c = acad.model.AddCircle(APoint(0, 0), 5)\n"
+        "h = acad.model.AddHatch(0, 'SOLID', True)\n"
+        "h.AppendOuterLoop([c])\n"
+        "h.Evaluate()\n"
+    )
+    ok, err, _stdout, artifacts = dry_run(code, render=False)
+    assert ok, err
+    assert artifacts["entities"] == 2
+
+
+def test_bounding_box_of_created_entity():
+    code = (
+        "c = acad.model.AddCircle(APoint(10, 20), 5)\n"
+        "lo, hi = c.GetBoundingBox()\n"
+        "assert (lo.x, lo.y, hi.x, hi.y) == (5, 15, 15, 25)\n"
+    )
+    ok, err, _stdout, _artifacts = dry_run(code, render=False)
+    assert ok, err
+
+
+def test_block_reused_when_already_defined():
+    code = (
+        "def arm_block(name):\n"
+        "    try:\n"
+        "        return acad.doc.Blocks.Item(name)\n"
+        "    except Exception:\n"
+        "        blk = acad.doc.Blocks.Add(APoint(0, 0), name)\n"
+        "        blk.AddCircle(APoint(0, 0), 2)\n"
+        "        return blk\n"
+        "\n"
+        "for i in range(2):\n"
+        "    arm_block('ARM')\n"
+        "    acad.model.InsertBlock(APoint(i * 10, 0), 'ARM', 1, 1, 1, 0)\n"
+        "assert acad.doc.Blocks.Item('ARM').Count == 1\n"
+    )
+    ok, err, _stdout, artifacts = dry_run(code, render=False)
+    assert ok, err
+    assert artifacts["entities"] == 2
+
+
+def test_lookup_of_existing_live_state_is_unsupported():
+    for code in (
+        "acad.doc.Layers.Item('电缆').Color = 1\n",
+        "first = acad.model.Item(0)\n",
+        "acad.model.InsertBlock(APoint(0, 0), 'LIVE_BLOCK', 1, 1, 1, 0)\n",
+    ):
+        ok, err, _stdout, artifacts = dry_run(code, render=False)
+        assert ok, err
+        assert artifacts["unsupported"]
+
+
+def test_unsupported_not_swallowed_by_except_exception():
+    code = (
+        "try:\n"
+        "    acad.doc.SendCommand('_ZOOM _E ')\n"
+        "except Exception:\n"
+        "    raise ValueError('should not get here')\n"
+    )
+    ok, err, _stdout, artifacts = dry_run(code, render=False)
+    assert ok, err
+    assert "SendCommand" in artifacts["unsupported"]
+
+
+def test_real_error_after_handled_lookup_still_reported():
+    code = (
+        "try:\n"
+        "    acad.doc.Layers.Item('电缆')\n"
+        "except Exception:\n"
+        "    acad.doc.Layers.Add('电缆')\n"
+        "acad.model.AddCircle(APoint(0, 0))\n"
+    )
+    ok, err, _stdout, _artifacts = dry_run(code, render=False)
+    assert not ok
+    assert "TypeError" in err
@@ -0,0 +1,87 @@
+import os
+import json
+import struct
+
+import ezdxf
+import pytest
+
+from percieve_dxf import extract_blocks_to_images, manifest_path_for, load_drawing, referenced_blocks, select_blocks
+
+
+def _png_size(path):
+    with open(path, "rb") as f:
+        header = f.read(24)
+    return struct.unpack(">II", header[16:24])
+
+
+@pytest.fixture
+def dxf_path(tmp_path):
+    doc = ezdxf.new()
+    for i in range(3):
+        block = doc.blocks.new(f"PART_{i}")
+        block.add_circle((0, 0), 5 + i)
+        block.add_line((-10, 0), (10, 0))
+        doc.modelspace().add_blockref(f"PART_{i}", (i * 30, 0))
+    path = tmp_path / "parts.dxf"
+    doc.saveas(path)
+    return str(path)
+
+
+def _extract(dxf_path, output_dir, **kwargs):
+    failures = extract_blocks_to_images(dxf_path, str(output_dir), **kwargs)
+    assert failures == {}
+    return {name: _png_size(output_dir / name) for name in sorted(os.listdir(output_dir)) if name.endswith(".png")}
+
+
+def test_parallel_uses_requested_dpi(dxf_path, tmp_path):
+    serial = _extract(dxf_path, tmp_path / "serial", workers=1, dpi=50)
+    parallel = _extract(dxf_path, tmp_path / "parallel", workers=2, dpi=50)
+    assert serial == parallel
+    assert len(parallel) == 3
+
+
+def test_manifest_rerenders_when_dpi_changes(dxf_path, tmp_path):
+    out = tmp_path / "blocks"
+    low = _extract(dxf_path, out, workers=2, dpi=50)
+    with open(manifest_path_for(str(out)), encoding="utf-8") as f:
+        first = json.load(f)["blocks"]
+
+    # 参数未变：全部跳过，清单不变
+    assert _extract(dxf_path, out, workers=2, dpi=50) == low
+    with open(manifest_path_for(str(out)), encoding="utf-8") as f:
+        assert json.load(f)["blocks"] == first
+
+    high = _extract(dxf_path, out, workers=2, dpi=100)
+    for name in low:
+        assert high[name][0] > low[name][0]
+
+
+@pytest.fixture
+def nested_dxf_path(tmp_path):
+    doc = ezdxf.new()
+    inner = doc.blocks.new("INNER")
+    inner.add_circle((0, 0), 1)
+    outer = doc.blocks.new("OUTER")
+    outer.add_blockref("INNER", (0, 0))
+    outer.add_line((-2, 0), (2, 0))
+    doc.blocks.new("UNUSED").add_circle((0, 0), 3)
+    doc.blocks.new("ON_PAPER").add_line((0, 0), (1, 1))
+    doc.modelspace().add_blockref("OUTER", (10, 10))
+    doc.paperspace().add_blockref("ON_PAPER", (0, 0))
+    path = tmp_path / "nested.dxf"
+    doc.saveas(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("low_memory", [False, True])
+def test_referenced_blocks_follow_nested_inserts(nested_dxf_path, low_memory):
+    doc, roots = load_drawing(nested_dxf_path, low_memory)
+    assert referenced_blocks(doc, roots) == {"OUTER", "INNER", "ON_PAPER"}
+    assert select_blocks(doc, skip_unreferenced=True, roots=roots) == ["INNER", "OUTER", "ON_PAPER"]
+
+
+def test_extract_skips_unreferenced_blocks(nested_dxf_path, tmp_path):
+    out = tmp_path / "blocks"
+    failures = extract_blocks_to_images(nested_dxf_path, str(out), skip_unreferenced=True, dpi=50)
+    assert failures == {}
+    assert sorted(os.listdir(out)) == ["INNER.png", "ON_PAPER.png", "OUTER.png"]
@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+from types import SimpleNamespace
+
+from cad_pipeline import CadPipeline
+from pipeline_metrics import MetricsRegistry, RequestTrace
+
+
+def test_concurrent_textfile_writes_are_atomic(tmp_path):
+    registry = MetricsRegistry()
+    for i in range(200):
+        registry.inc("cad_agent_test_total", help_text="test", kind=f"k{i}")
+    path = str(tmp_path / "metrics.prom")
+    expected = registry.render_prometheus()
+    errors = []
+
+    def writer():
+        try:
+            for _ in range(20):
+                registry.write_textfile(path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == expected
+    assert os.listdir(tmp_path) == ["metrics.prom"]  # 没有残留的临时文件
+
+
+def test_histogram_rendering():
+    registry = MetricsRegistry()
+    registry.observe("stage_seconds", 0.02, buckets=(0.01, 0.1), stage="exec")
+    registry.observe("stage_seconds", 5, buckets=(0.01, 0.1), stage="exec")
+    text = registry.render_prometheus()
+    assert 'stage_seconds_bucket{le="0.01",stage="exec"} 0' in text
+    assert 'stage_seconds_bucket{le="0.1",stage="exec"} 1' in text
+    assert 'stage_seconds_bucket{le="+Inf",stage="exec"} 2' in text
+    assert 'stage_seconds_count{stage="exec"} 2' in text
+
+
+def test_concurrent_trace_finish(tmp_path):
+    trace_file = str(tmp_path / "trace.jsonl")
+    metrics_file = str(tmp_path / "metrics.prom")
+
+    def run():
+        trace = RequestTrace("test")
+        with trace.span("exec"):
+            pass
+        trace.finish("success", trace_file=trace_file, metrics_file=metrics_file)
+
+    threads = [threading.Thread(target=run) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with open(trace_file, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 16
+    with open(metrics_file, encoding="utf-8") as f:
+        assert "cad_agent_requests_total" in f.read()
+
+
+class _IgnoresNClient:
+    """OpenAI 兼容客户端替身：服务端忽略 n，每次只返回一个候选"""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        message = SimpleNamespace(content="```python\ndoc = ezdxf.new()\n```")
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=10)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def test_candidate_fallback_requests_are_traced():
+    pipeline = CadPipeline(_IgnoresNClient(), sandbox_pool=None, model_name="test")
+    trace = RequestTrace("test")
+    contents = pipeline.generate_candidates([{"role": "user", "content": "画一条线"}], 3, trace, attempt=2)
+    assert len(contents) == 3
+    assert len(trace.usage) == 3
+    assert all(u["attempt"] == 2 for u in trace.usage)
+    assert [s["stage"] for s in trace.spans].count("llm") == 3
@@ -0,0 +1,120 @@
+import json
+
+import numpy as np
+import pytest
+
+from spatial_index import SpatialIndex
+
+
+def brute_box_distance(boxes, x, y):
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, 0), x - boxes[:, 2])
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, 0), y - boxes[:, 3])
+    return np.hypot(dx, dy)
+
+
+@pytest.fixture(scope="module")
+def random_index():
+    rng = np.random.default_rng(7)
+    n = 3000
+    lo = rng.uniform(0, 1000, size=(n, 2))
+    size = rng.exponential(3, size=(n, 2))
+    size[:20] *= 100  # 少量大图元进入 big 列表
+    boxes = np.column_stack([lo, lo + size])
+    types = rng.choice(["CIRCLE", "LINE", "TEXT"], size=n)
+    layers = rng.choice(["0", "墙", "Dim"], size=n)
+    handles = [f"{i:X}" for i in range(n)]
+    return SpatialIndex(handles, types, layers, boxes), boxes, types, layers
+
+
+def test_query_rect_matches_brute_force(random_index):
+    index, boxes, types, _layers = random_index
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        x0, y0 = rng.uniform(-50, 1000, size=2)
+        x1, y1 = x0 + rng.uniform(0, 300), y0 + rng.uniform(0, 300)
+        hits = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0)
+        expected = {f"{i:X}" for i in np.nonzero(hits)[0]}
+        got = {r["handle"] for r in index.query_rect(x0, y0, x1, y1, limit=len(boxes))}
+        assert got == expected
+
+        inside = (boxes[:, 0] >= x0) & (boxes[:, 2] <= x1) & (boxes[:, 1] >= y0) & (boxes[:, 3] <= y1) & (types == "CIRCLE")
+        got = {r["handle"] for r in index.query_rect(x0, y0, x1, y1, type="circle", inside=True, limit=len(boxes))}
+        assert got == {f"{i:X}" for i in np.nonzero(inside)[0]}
+
+
+def test_query_nearest_matches_brute_force(random_index):
+    index, boxes, _types, layers = random_index
+    rng = np.random.default_rng(2)
+    for _ in range(100):
+        x, y = rng.uniform(-200, 1200, size=2)
+        k = int(rng.integers(1, 6))
+        d = brute_box_distance(boxes, x, y)
+        expected = np.sort(d)[:k]
+        got = [r["distance"] for r in index.query_nearest(x, y, k=k)]
+        np.testing.assert_allclose(got, expected, rtol=1e-5, atol=1e-9)
+
+        on_layer = np.nonzero(layers == "墙")[0]
+        expected = np.sort(d[on_layer])[:k]
+        results = index.query_nearest(x, y, k=k, layer="墙")
+        assert all(r["layer"] == "墙" for r in results)
+        np.testing.assert_allclose([r["distance"] for r in results], expected, rtol=1e-5, atol=1e-9)
+
+
+def test_query_extreme(random_index):
+    index, boxes, types, _layers = random_index
+    right = index.query_extreme("right", k=3, type="TEXT")
+    text_idx = np.nonzero(types == "TEXT")[0]
+    expected = np.sort(boxes[text_idx, 2])[::-1][:3]
+    np.testing.assert_allclose([r["bbox"][2] for r in right], expected, rtol=1e-5)
+    bottom = index.query_extreme("bottom")
+    assert bottom[0]["bbox"][1] == pytest.approx(boxes[:, 1].min(), rel=1e-5)
+    with pytest.raises(ValueError):
+        index.query_extreme("up")
+
+
+def test_from_records_and_tool_calls():
+    records = [
+        {"handle": "A", "type": "CIRCLE", "layer": "0", "bbox": (0, 0, 10, 10), "text": None},
+        {"handle": "B", "type": "CIRCLE", "layer": "0", "bbox": (90, 0, 100, 10), "text": None},
+        {"handle": "C", "type": "TEXT", "layer": "注释", "bbox": (50, 50, 60, 55), "text": "标题"},
+        {"handle": None, "type": "LINE", "layer": "0", "bbox": None, "text": None},  # 没有范围的记录被忽略
+    ]
+    index = SpatialIndex.from_records(records)
+    assert len(index) == 3
+    assert json.loads(index.call("query_extreme", '{"direction": "right", "type": "CIRCLE"}'))[0]["handle"] == "B"
+    nearest = json.loads(index.call("query_nearest", {"x": 52, "y": 40}))
+    assert nearest[0]["handle"] == "C" and nearest[0]["text"] == "标题"
+    assert json.loads(index.call("drawing_stats", "{}"))["types"] == {"CIRCLE": 2, "TEXT": 1}
+    assert "error" in json.loads(index.call("query_rect", '{"xmin": 0}'))
+    assert "error" in json.loads(index.call("no_such_tool", "{}"))
+    assert len(json.loads(index.call("query_rect", '{"xmin": -1, "ymin": -1, "xmax": 200, "ymax": 200, "limit": 0}'))) == 1
+
+
+def test_from_doc_and_empty_index():
+    import ezdxf
+    doc = ezdxf.new()
+    msp = doc.modelspace()
+    msp.add_circle((100, 0), 5, dxfattribs={"layer": "孔"})
+    msp.add_line((0, 0), (10, 0))
+    index = SpatialIndex.from_doc(doc)
+    assert index.query_extreme("right")[0]["layer"] == "孔"
+
+    empty = SpatialIndex([], [], [], np.zeros((0, 4)))
+    assert empty.query_rect(0, 0, 1, 1) == []
+    assert empty.query_nearest(0, 0) == []
+    assert empty.query_extreme("left") == []
+    assert empty.stats() == {"count": 0}
+
+
+def test_query_nearest_clustered_points():
+    # 大部分图元挤在一角，少数零尺寸的点散布在远处：格子很小，需要多轮扩大搜索范围
+    rng = np.random.default_rng(3)
+    cluster = rng.uniform(0, 5, size=(2000, 2))
+    far = rng.uniform(0, 10_000, size=(30, 2))
+    pts = np.vstack([cluster, far])
+    boxes = np.column_stack([pts, pts])
+    index = SpatialIndex([str(i) for i in range(len(pts))], ["POINT"] * len(pts), ["0"] * len(pts), boxes)
+    for x, y in rng.uniform(0, 10_000, size=(50, 2)):
+        expected = np.sort(brute_box_distance(boxes, x, y))[:2]
+        got = [r["distance"] for r in index.query_nearest(x, y, k=2)]
+        np.testing.assert_allclose(got, expected, rtol=1e-5)
@@ -1,7 +1,13 @@
+import sys
 import json
-from qwen_agent.llm import get_chat_model
+from typing import List
+
+import ezdxf
 from openai import OpenAI
 
+from cad_pipeline import run_tool_loop
+from cad_tool_engine import ToolRegistry, EzdxfBackend, draw_with_tools
+
 
 
 def get_current_temperature(location: str, unit: str = "celsius"):
@@ -39,90 +45,24 @@ def get_temperature_date(location: str, date: str, unit: str = "celsius"):
         "unit": unit,
     }
 
-def get_avg(numbers: list):
+def get_avg(numbers: List[float]):
+    """Get the average of a list of numbers.
+
+    Args:
+        numbers: The list of numbers to get the average of.
+    """
 
     result = sum(numbers) / len(numbers)
     return {
         "result": result,
     }
 
-def get_function_by_name(name):
-    if name == "get_current_temperature":
-        return get_current_temperature
-    if name == "get_temperature_date":
-        return get_temperature_date
-    if name == "get_avg":
-        return get_avg
-
-
-TOOLS = [
-    {
-        "type": "function",
-        "function": {
-            "name": "get_current_temperature",
-            "description": "Get current temperature at a location.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {
-                        "type": "string",
-                        "description": 'The location to get the temperature for, in the format "City, State, Country".',
-                    },
-                    "unit": {
-                        "type": "string",
-                        "enum": ["celsius", "fahrenheit"],
-                        "description": 'The unit to return the temperature in. Defaults to "celsius".',
-                    },
-                },
-                "required": ["location"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_temperature_date",
-            "description": "Get temperature at a location and date.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {
-                        "type": "string",
-                        "description": 'The location to get the temperature for, in the format "City, State, Country".',
-                    },
-                    "date": {
-                        "type": "string",
-                        "description": 'The date to get the temperature for, in the format "Year-Month-Day".',
-                    },
-                    "unit": {
-                        "type": "string",
-                        "enum": ["celsius", "fahrenheit"],
-                        "description": 'The unit to return the temperature in. Defaults to "celsius".',
-                    },
-                },
-                "required": ["location", "date"],
-            },
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_avg",
-            "description": "Get the average of a list of numbers.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "numbers": {
-                        "type": "list",
-                        "description": "The list of numbers to get the average of.",
-    
-                    },
-                },
-                "required": ["numbers"],
-            },
-        },
-    },
-]
+# 示例工具：schema 由函数签名和 docstring 自动生成，不再手写 JSON 和按名称分发的 if 链
+registry = ToolRegistry()
+for fn in (get_current_temperature, get_temperature_date, get_avg):
+    registry.tool(fn)
+
+TOOLS = registry.TOOLS
 MESSAGES = [
     {"role": "user",  "content": "What's the temperature in San Francisco now? How about tomorrow? Current Date: 2024-09-30."},
 ]
@@ -146,51 +86,17 @@ client = OpenAI(
 
 model_name = "Qwen3-8B"
 
-tools = TOOLS
 messages = MESSAGES
 
-response = client.chat.completions.create(
-    model=model_name,
-    messages=messages,
-    tools=tools,
-    temperature=0.7,
-    top_p=0.8,
-    max_tokens=512,
-    extra_body={
-        "repetition_penalty": 1.05,
-        "chat_template_kwargs": {"enable_thinking": True}  # default to True
-    },
-)
-
-messages.append(response.choices[0].message.model_dump())
-
-if tool_calls := messages[-1].get("tool_calls", None):
-    for tool_call in tool_calls:
-        call_id: str = tool_call["id"]
-        if fn_call := tool_call.get("function"):
-            fn_name: str = fn_call["name"]
-            fn_args: dict = json.loads(fn_call["arguments"])
-        
-            fn_res: str = json.dumps(get_function_by_name(fn_name)(**fn_args))
-
-            messages.append({
-                "role": "tool",
-                "content": fn_res,
-                "tool_call_id": call_id,
-            })
-
-response = client.chat.completions.create(
-    model=model_name,
-    messages=messages,
-    tools=tools,
-    temperature=0.7,
-    top_p=0.8,
-    max_tokens=512,
-    extra_body={
-        "repetition_penalty": 1.05,
-    },
-)
-
-messages.append(response.choices[0].message.model_dump())
-
-print(response.choices[0].message.content)
\ No newline at end of file
+# 1. 示例工具：多轮调用，直到模型给出最终回复
+reply, n_calls = run_tool_loop(client, model_name, messages, registry, temperature=0.7, max_tokens=512)
+print(f"[{n_calls} tool calls] {reply}")
+
+# 2. CAD 绘图：图元由工具调用直接写入 ezdxf 图纸，同一轮的调用批量执行，无需生成和 exec 代码
+prompt = sys.argv[1] if len(sys.argv) > 1 else "画一个 100×60 的矩形，四个角各画一个半径 5 的圆，并在中心标注“底板”"
+doc = ezdxf.new(setup=True)
+reply, toolbox = draw_with_tools(client, model_name, [{"role": "user", "content": prompt}], EzdxfBackend(doc))
+for name, arguments, result in toolbox.log:
+    print(f"{name}({arguments}) -> {json.dumps(result, ensure_ascii=False)}")
+print(reply)
+doc.saveas("tool_drawing.dxf")